@@ -0,0 +1,289 @@
+import argparse
+import asyncio
+import json
+import random
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING
+
+import main_grounding_dominik
+import main_understanding
+from batch_runner import write_results
+from dataset_shards import is_shard_input, open_dataset
+from mock_server import constrain_answer, message_texts, mock_answer
+from output_contracts import OutputContracts, add_contract_arguments, contracts_from_args
+from response_cache import ResponseCache
+from results_store import aggregate_results, print_aggregates
+from telemetry import current_case
+from utils import add_image_arguments, add_verbose_argument, case_id, configure_test_log, discover_tests, \
+    image_budget_name, parse_image_budget
+
+if TYPE_CHECKING:
+    # openai takes most of the startup time, it is imported once the batch outputs are read
+    from openai.types.chat import ChatCompletion
+
+PIPELINES = ["grounding_click", "grounding_multi", "understanding"]
+BATCH_URL = "/v1/chat/completions"
+# limits of one OpenAI batch input file
+MAX_REQUESTS_PER_FILE = 50000
+MAX_BYTES_PER_FILE = 200 * 1000 * 1000
+# tests evaluated at the same time, bounds the memory of the encoded images in flight
+REPLAY_CHUNK = 256
+
+
+class BatchPending(Exception):
+    """The answer of a request is not in the batch output yet, the request goes into the next batch."""
+
+
+def custom_id(request: dict) -> str:
+    """Stable id of a request within its test: the case id and the hash of the full request body."""
+    return f"{current_case.get()}#{ResponseCache.key(request)[:32]}"
+
+
+class BatchClient:
+    """Stands in for batch_runner.CompletionClient when tests are evaluated against a batch instead of the API.
+        Requests answered in the loaded batch outputs are returned as completions, every other request is
+        collected for the next batch input file and raises BatchPending.
+        Args:
+            outputs (dict | None): Batch output lines by custom_id, see load_batch_outputs.
+            contracts (OutputContracts | None): Must match the export, max_tokens and response_format are part of
+                the custom_id. A re-ask is a follow-up request of the next batch.
+    """
+
+    def __init__(self, outputs: dict[str, dict] | None = None, contracts: OutputContracts | None = None):
+        self.outputs = outputs or {}
+        self.contracts = contracts or OutputContracts()
+        self.pending: dict[str, dict] = {}
+        self.failed: dict[str, str] = {}
+        self.answered = 0
+        self.usage = {"prompt_tokens": 0, "completion_tokens": 0}
+
+    async def create(self, **request) -> "ChatCompletion":
+        """Drop-in for client.chat.completions.create."""
+        from openai.types.chat import ChatCompletion
+
+        request_id = custom_id(request)
+        line = self.outputs.get(request_id)
+        if line is not None:
+            error = batch_line_error(line)
+            if error is None:
+                completion = ChatCompletion.model_validate(line["response"]["body"])
+                self.answered += 1
+                if completion.usage is not None:
+                    self.usage["prompt_tokens"] += completion.usage.prompt_tokens
+                    self.usage["completion_tokens"] += completion.usage.completion_tokens
+                return completion
+            self.failed[request_id] = error
+        self.pending[request_id] = {"custom_id": request_id, "method": "POST", "url": BATCH_URL, "body": request}
+        raise BatchPending(request_id)
+
+    async def complete(self, prompt: ModuleType, messages: list[dict], targets: int | None = 1, **request) -> str:
+        return await self.contracts.complete(self, prompt, messages, targets, **request)
+
+    async def close(self):
+        pass
+
+
+def batch_line_error(line: dict) -> str | None:
+    """Error of a batch output line, None if the request succeeded."""
+    if line.get("error"):
+        return json.dumps(line["error"])
+    response = line.get("response") or {}
+    if response.get("status_code") != 200:
+        return f"status {response.get('status_code')}: {json.dumps(response.get('body'))[:200]}"
+    return None
+
+
+def load_batch_outputs(output_paths: list[Path]) -> dict[str, dict]:
+    """Output lines of completed batches by custom_id, a later success replaces an earlier failure."""
+    outputs = {}
+    for path in output_paths:
+        with open(path, "r") as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                line = json.loads(line)
+                previous = outputs.get(line["custom_id"])
+                if previous is None or batch_line_error(previous) is not None:
+                    outputs[line["custom_id"]] = line
+    return outputs
+
+
+def write_batch_files(lines: list[dict], output_path: Path, max_requests: int = MAX_REQUESTS_PER_FILE,
+                      max_bytes: int = MAX_BYTES_PER_FILE) -> list[Path]:
+    """Write batch input lines, split into several files (output-00000.jsonl, ...) at the provider's limits."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    encoded = [json.dumps(line, separators=(",", ":")) + "\n" for line in lines]
+    chunks, current, size = [], [], 0
+    for line in encoded:
+        if current and (len(current) >= max_requests or size + len(line) > max_bytes):
+            chunks.append(current)
+            current, size = [], 0
+        current.append(line)
+        size += len(line)
+    if current:
+        chunks.append(current)
+    if len(chunks) <= 1:
+        paths = [output_path]
+    else:
+        paths = [output_path.with_name(f"{output_path.stem}-{i:05d}{output_path.suffix}") for i in range(len(chunks))]
+    for path, chunk in zip(paths, chunks or [[]]):
+        with open(path, "w") as f:
+            f.writelines(chunk)
+    return paths
+
+
+def pipeline_evaluate(args, client: BatchClient, image_options: dict, dataset):
+    """The evaluate_test coroutine of the main scripts for a pipeline, so batch answers are parsed and scored
+        exactly like live ones."""
+    if args.pipeline == "grounding_click":
+        return lambda test, model: main_grounding_dominik.evaluate_test(client, test, model, image_options, None,
+                                                                       dataset)
+    if args.pipeline == "grounding_multi":
+        return lambda test, model: main_grounding_dominik.evaluate_test_multi(client, test, model, image_options, None,
+                                                                             args.all_objects, dataset)
+    prompt = main_understanding.get_system_prompt(args.category)
+    return lambda test, model: main_understanding.evaluate_test(client, test, prompt, model, image_options, dataset)
+
+
+async def replay(args, client: BatchClient) -> tuple[list[dict], int]:
+    """Evaluate every test and model against the client.
+        Returns:
+            tuple[list[dict], int]: Results of the finished tests and the number of tests waiting for a batch.
+    """
+    dataset = open_dataset(args.input) if is_shard_input(args.input) else None
+    if dataset is not None:
+        tests = dataset.tests(with_task_description=args.pipeline == "understanding")
+    else:
+        suffixes = (".png", ".json", ".py") if args.pipeline == "understanding" else (".png", ".json")
+        tests = discover_tests(args.input, suffixes=suffixes)
+    if not tests:
+        raise FileNotFoundError(f"No tests found for input: {args.input}")
+    image_executor = ProcessPoolExecutor(args.image_workers) if args.image_workers and len(tests) > 1 else None
+    image_options = {"image_format": args.image_format, "quality": args.image_quality, "executor": image_executor,
+                     **parse_image_budget(args.image_budgets[0])}
+    evaluate = pipeline_evaluate(args, client, image_options, dataset)
+
+    async def run_one(test: Path, model: str) -> dict | None:
+        current_case.set(case_id(test))
+        try:
+            return await evaluate(test, model)
+        except BatchPending:
+            return None
+        except Exception as e:
+            return {"case_id": case_id(test), "model": model, "error": repr(e),
+                    "image_budget": image_budget_name(image_options)}
+
+    jobs = [(test, model) for model in args.models for test in tests]
+    outcomes = []
+    for start in range(0, len(jobs), REPLAY_CHUNK):
+        outcomes += await asyncio.gather(*(run_one(test, model) for test, model in jobs[start:start + REPLAY_CHUNK]))
+    if image_executor is not None:
+        image_executor.shutdown()
+    results = [outcome for outcome in outcomes if outcome is not None]
+    return results, len(outcomes) - len(results)
+
+
+def fake_output(batch_path: Path, output_path: Path, failure_rate: float = 0.0, seed: int = 0):
+    """Answer a batch input file like the provider would, with mock_server answers for offline tests."""
+    random.seed(seed)
+    with open(batch_path, "r") as f, open(output_path, "w") as out:
+        for line in f:
+            request = json.loads(line)
+            body = request["body"]
+            if random.random() < failure_rate:
+                result = {"status_code": 500, "request_id": uuid.uuid4().hex,
+                          "body": {"error": {"message": "Internal server error", "type": "server_error"}}}
+            else:
+                system, user = message_texts(body["messages"])
+                prompt_tokens = (len(system) + len(user)) // 4
+                content, finish_reason = constrain_answer(mock_answer("auto", system, user), body)
+                result = {"status_code": 200, "request_id": uuid.uuid4().hex, "body": {
+                    "id": f"chatcmpl-{uuid.uuid4().hex}",
+                    "object": "chat.completion",
+                    "created": int(time.time()),
+                    "model": body["model"],
+                    "choices": [{"index": 0, "finish_reason": finish_reason,
+                                 "message": {"role": "assistant", "content": content}}],
+                    "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": 20,
+                              "total_tokens": prompt_tokens + 20},
+                }}
+            out.write(json.dumps({"id": f"batch_req_{uuid.uuid4().hex}", "custom_id": request["custom_id"],
+                                  "response": result, "error": None}) + "\n")
+
+
+async def main(args):
+    if args.command == "fake":
+        fake_output(Path(args.batch), Path(args.output), args.failure_rate, args.seed)
+        print(f"Wrote fake batch output to {args.output}")
+        return
+
+    configure_test_log(args.verbose)
+    outputs = load_batch_outputs([Path(path) for path in args.outputs]) if args.command == "ingest" else {}
+    client = BatchClient(outputs, contracts_from_args(args))
+    results, waiting = await replay(args, client)
+    if args.command == "export":
+        paths = write_batch_files(list(client.pending.values()), Path(args.output), args.max_requests,
+                                  args.max_bytes)
+        print(f"Wrote {len(client.pending)} requests for {waiting} tests to {', '.join(map(str, paths))}")
+        return
+
+    print(f"{client.answered} requests answered by the batch outputs "
+          f"({client.usage['prompt_tokens']} prompt + {client.usage['completion_tokens']} completion tokens), "
+          f"{len(client.failed)} failed")
+    write_results(results, Path(args.results))
+    print_aggregates(aggregate_results(results))
+    client.contracts.print_stats()
+    if client.pending:
+        # failed requests and follow-up requests of multi-step tests, e.g. the single object fallback of multi_bbox
+        paths = write_batch_files(list(client.pending.values()), Path(args.retry), args.max_requests, args.max_bytes)
+        print(f"{waiting} tests are not finished, wrote {len(client.pending)} requests "
+              f"({len(client.failed)} retries) to {', '.join(map(str, paths))}")
+    else:
+        print("All tests finished")
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Run the benchmarks through a provider batch API: export the "
+                                                 "requests, ingest the completed batch output")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    export_parser = subparsers.add_parser("export", help="Write the batch input file of all tests.")
+    export_parser.add_argument("--output", required=True, type=str, metavar="FILE", help="Batch input JSONL file.")
+    ingest_parser = subparsers.add_parser("ingest", help="Score the tests from completed batch output files.")
+    ingest_parser.add_argument("outputs", nargs="+", type=str, metavar="FILE",
+                               help="Batch output files, the first batch and every retry batch.")
+    ingest_parser.add_argument("--results", required=True, type=str, metavar="FILE",
+                               help="Write one JSON result per finished test to this file.")
+    ingest_parser.add_argument("--retry", type=str, metavar="FILE", default="batch_retry.jsonl",
+                               help="Batch input file for the failed and follow-up requests.")
+    for subparser in (export_parser, ingest_parser):
+        subparser.add_argument("--input", required=True, type=str, metavar="DIR|GLOB",
+                               help="Tests as for the main scripts, or packed .shard files.")
+        subparser.add_argument("--pipeline", choices=PIPELINES, default="grounding_click")
+        subparser.add_argument("--models", nargs="+", type=str, metavar="MODEL",
+                               default=["bytedance/ui-tars-1.5-7b"], help="Model names at the provider.")
+        subparser.add_argument("--category", choices=main_understanding.allowed_categories, default="with_instruct",
+                               help="Prompt of the understanding pipeline.")
+        subparser.add_argument("--all-objects", action="store_true",
+                               help="grounding_multi: ask for all visible objects instead of the ground truth targets.")
+        subparser.add_argument("--max-requests", type=int, default=MAX_REQUESTS_PER_FILE,
+                               help="Split batch input files after this many requests.")
+        subparser.add_argument("--max-bytes", type=int, default=MAX_BYTES_PER_FILE,
+                               help="Split batch input files before they exceed this size.")
+        add_image_arguments(subparser)
+        add_contract_arguments(subparser)
+        add_verbose_argument(subparser)
+    fake_parser = subparsers.add_parser("fake", help="Answer a batch input file locally, like the mock server.")
+    fake_parser.add_argument("batch", type=str, metavar="FILE", help="Batch input file.")
+    fake_parser.add_argument("--output", required=True, type=str, metavar="FILE", help="Fake batch output file.")
+    fake_parser.add_argument("--failure-rate", type=float, default=0.0, help="Share of requests answered with a 500.")
+    fake_parser.add_argument("--seed", type=int, default=0)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(main(args))
@@ -0,0 +1,180 @@
+import asyncio
+import json
+import time
+from pathlib import Path
+from types import ModuleType
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+from output_contracts import OutputContracts
+from response_cache import ResponseCache
+from scheduler import Scheduler, estimate_image_tokens, estimate_request_tokens
+from telemetry import Telemetry, current_case
+from utils import case_id
+
+if TYPE_CHECKING:
+    # openai takes most of the startup time, it is imported once a client is created
+    from openai import AsyncOpenAI
+    from openai.types.chat import ChatCompletion
+
+# clients by (api_key, base_url, max_retries) once pool_async_clients was called, e.g. by the warm worker
+_client_pool: dict[tuple, "AsyncOpenAI"] | None = None
+
+
+def create_async_client(api_key: str, base_url: str = "https://openrouter.ai/api/v1", max_retries: int = 2) -> "AsyncOpenAI":
+    """Create the client shared by all requests of a run.
+        One AsyncOpenAI instance owns one httpx connection pool, so TLS handshakes
+        and connections are reused across all test cases instead of per call.
+        With pool_async_clients they are also reused across runs in the same process.
+    """
+    from openai import AsyncOpenAI
+
+    if _client_pool is None:
+        return AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+    key = (api_key, base_url, max_retries)
+    if key not in _client_pool:
+        _client_pool[key] = AsyncOpenAI(api_key=api_key, base_url=base_url, max_retries=max_retries)
+    return _client_pool[key]
+
+
+def pool_async_clients():
+    """Keep the clients of finished runs open for the next run of a long-lived process."""
+    global _client_pool
+    if _client_pool is None:
+        _client_pool = {}
+
+
+async def close_pooled_clients():
+    global _client_pool
+    for client in (_client_pool or {}).values():
+        await client.close()
+    _client_pool = None
+
+
+class CompletionClient:
+    """Shared AsyncOpenAI client plus the optional response cache, rate-limit scheduler and telemetry in front of it.
+        The output contracts size and check the answers of the requests sent through complete.
+    """
+
+    def __init__(self, client: "AsyncOpenAI", cache: ResponseCache | None = None, scheduler: Scheduler | None = None,
+                 telemetry: Telemetry | None = None, contracts: OutputContracts | None = None):
+        self.client = client
+        self.cache = cache
+        self.scheduler = scheduler
+        self.telemetry = telemetry
+        self.contracts = contracts or OutputContracts()
+
+    async def create(self, **request) -> "ChatCompletion":
+        """Drop-in for client.chat.completions.create."""
+        from openai.types.chat import ChatCompletion
+
+        trace = {"started": time.time()}
+        start = time.perf_counter()
+        use_cache = self.cache is not None and self.cache.mode != "off"
+        if use_cache:
+            key = self.cache.key(request)
+            entry = self.cache.get(key)
+            if entry is not None:
+                response = ChatCompletion.model_validate(entry["completion"])
+                trace["total"] = time.perf_counter() - start
+                self._record(request, trace, response, cached=True)
+                return response
+            if self.cache.mode == "readonly":
+                raise LookupError(f"No cached response for request {key} and the cache is read-only.")
+
+        async def send() -> "ChatCompletion":
+            sent = time.perf_counter()
+            # the streaming wrapper returns once the headers arrived, which gives the time to first byte
+            async with self.client.chat.completions.with_streaming_response.create(**request) as raw_response:
+                trace["ttfb"] = time.perf_counter() - sent
+                completion = await raw_response.parse()
+            trace["latency"] = time.perf_counter() - sent
+            return completion
+
+        try:
+            if self.scheduler is not None:
+                response = await self.scheduler.submit(request["model"], send,
+                                                       estimated_tokens=estimate_request_tokens(request), trace=trace)
+            else:
+                response = await send()
+        except Exception as e:
+            trace["total"] = time.perf_counter() - start
+            self._record(request, trace, None, error=repr(e))
+            raise
+        trace["total"] = time.perf_counter() - start
+        self._record(request, trace, response)
+
+        if use_cache:
+            self.cache.put(key, request, response.model_dump())
+        return response
+
+    def _record(self, request: dict, trace: dict, response: "ChatCompletion | None", cached: bool = False,
+                error: str | None = None):
+        if self.telemetry is None:
+            return
+        usage = response.usage.model_dump() if response is not None and response.usage is not None else None
+        image_tokens = sum(estimate_image_tokens(item["image_url"]["url"])
+                           for message in request["messages"] if isinstance(message["content"], list)
+                           for item in message["content"] if item.get("type") == "image_url")
+        self.telemetry.record(request["model"], trace, usage, image_tokens=image_tokens, cached=cached, error=error)
+
+    async def complete(self, prompt: ModuleType, messages: list[dict], targets: int | None = 1, **request) -> str:
+        """Content of the answer to messages, requested and checked with the output contract of the prompt."""
+        return await self.contracts.complete(self, prompt, messages, targets, **request)
+
+    async def close(self):
+        if self.client not in (_client_pool or {}).values():
+            await self.client.close()
+        if self.telemetry is not None:
+            self.telemetry.close()
+
+
+async def run_batch(tests: list[Path], evaluate_test: Callable[[Path, str], Awaitable[dict]], models: list[str],
+                    concurrency: int = 8, image_budget: str | None = None) -> list[dict]:
+    """Evaluate all tests for all models with at most `concurrency` tests in flight per model.
+        All models run at the same time, so the sweep takes as long as the slowest model instead of the sum.
+        Args:
+            tests (list[Path]): Test paths without suffix, see utils.discover_tests.
+            evaluate_test (Callable): Coroutine that evaluates one test with one model and returns its result dict.
+            models (list[str]): Model names at the provider.
+            concurrency (int): Maximum number of tests evaluated at the same time per model.
+            image_budget (str | None): Image budget of this pass, see utils.image_budget_name. Failed tests are
+                tagged with it, so the failures of several passes are not merged into one.
+        Returns:
+            list[dict]: One result per model and test, ordered by model then test. Failed tests carry an "error" entry.
+    """
+    semaphores = {model: asyncio.Semaphore(concurrency) for model in models}
+    total = len(tests) * len(models)
+    start = time.perf_counter()
+    done = 0
+
+    async def run_one(test: Path, model: str) -> dict:
+        nonlocal done
+        async with semaphores[model]:
+            current_case.set(case_id(test))
+            try:
+                result = await evaluate_test(test, model)
+            except Exception as e:
+                print(f"Test {case_id(test)} with {model} failed: {e!r}")
+                result = {"case_id": case_id(test), "model": model, "error": repr(e)}
+                if image_budget is not None:
+                    result["image_budget"] = image_budget
+        done += 1
+        print(f"[{done}/{total}] {model} {case_id(test)} ({time.perf_counter() - start:.1f}s)")
+        return result
+
+    # interleave models so every model's pipe is filled from the start
+    jobs = [(test, model) for test in tests for model in models]
+    results = await asyncio.gather(*(run_one(test, model) for test, model in jobs))
+    elapsed = time.perf_counter() - start
+    print(f"Evaluated {total} tests in {elapsed:.1f}s ({total / max(elapsed, 1e-9):.2f} tests/s)")
+    order = {model: i for i, model in enumerate(models)}
+    return [result for _, result in sorted(zip(jobs, results), key=lambda item: order[item[0][1]])]
+
+
+def write_results(results: list[dict], output_path: Path):
+    """Write one JSON object per line."""
+    output_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(output_path, "w") as f:
+        for result in results:
+            f.write(json.dumps(result) + "\n")
+    print(f"Wrote {len(results)} results to {output_path}")
@@ -0,0 +1,232 @@
+import argparse
+import asyncio
+import contextlib
+import io
+import json
+import os
+import resource
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+import main_grounding_dominik
+import main_understanding
+from batch_runner import CompletionClient, create_async_client, run_batch
+from benchmark1_grounding.system_prompts import qwen3vl_multi_bbox as multi_bbox_prompt
+from prompts import build_messages
+from utils import discover_tests, encode_image_bytes
+
+PIPELINES = ["grounding_click", "grounding_multi", "understanding"]
+MODEL = "mock/harness"
+# jobs of the startup measurements talk to the mock server only
+JOB_ENV = {**os.environ, "OPENROUTER_API_KEY": os.environ.get("OPENROUTER_API_KEY", "mock")}
+
+
+def start_mock_process(latency: float, latency_dist: str) -> tuple[subprocess.Popen, str]:
+    """Run mock_server.py in its own process, so its CPU time is not counted as harness overhead."""
+    process = subprocess.Popen([sys.executable, str(Path(__file__).parent / "mock_server.py"), "--port", "0",
+                                "--shape", "auto", "--latency", str(latency), "--latency-dist", latency_dist],
+                               stdout=subprocess.PIPE, text=True)
+    line = process.stdout.readline()
+    if not line.startswith("Mock endpoint listening on "):
+        process.kill()
+        raise RuntimeError(f"Mock server did not start: {line!r}")
+    return process, line.rsplit(" ", 1)[-1].strip()
+
+
+def pipeline_tests(pipeline: str) -> list[Path]:
+    if pipeline == "understanding":
+        return discover_tests("benchmark2_understanding/examples", suffixes=(".png", ".json", ".py"))
+    if pipeline == "grounding_multi":
+        return discover_tests("benchmark1_grounding/examples/object_recognition_multi")
+    return discover_tests("benchmark1_grounding/examples")
+
+
+def pipeline_evaluate(pipeline: str, client: CompletionClient):
+    if pipeline == "grounding_click":
+        return lambda test, model: main_grounding_dominik.evaluate_test(client, test, model)
+    if pipeline == "grounding_multi":
+        return lambda test, model: main_grounding_dominik.evaluate_test_multi(client, test, model)
+    prompt = main_understanding.get_system_prompt("with_instruct")
+    return lambda test, model: main_understanding.evaluate_test(client, test, prompt, model)
+
+
+async def run_level(pipeline: str, base_url: str, concurrency: int, num_tests: int) -> dict:
+    """Evaluate num_tests tests of a pipeline against the mock server and measure the harness process."""
+    tests = pipeline_tests(pipeline)
+    tests = (tests * (num_tests // len(tests) + 1))[:num_tests]
+    client = CompletionClient(create_async_client("mock", base_url=base_url, max_retries=0))
+    evaluate = pipeline_evaluate(pipeline, client)
+    usage_before = resource.getrusage(resource.RUSAGE_SELF)
+    start = time.perf_counter()
+    # the per test prints are part of the harness, but not of the report
+    with contextlib.redirect_stdout(io.StringIO()):
+        results = await run_batch(tests, evaluate, [MODEL], concurrency=concurrency)
+    elapsed = time.perf_counter() - start
+    usage_after = resource.getrusage(resource.RUSAGE_SELF)
+    await client.close()
+    requests = sum(result.get("requests", 1) for result in results)
+    cpu = (usage_after.ru_utime - usage_before.ru_utime) + (usage_after.ru_stime - usage_before.ru_stime)
+    return {
+        "pipeline": pipeline,
+        "concurrency": concurrency,
+        "tests": len(results),
+        "errors": sum("error" in result for result in results),
+        "requests": requests,
+        "elapsed_s": elapsed,
+        "requests_per_s": requests / elapsed,
+        "cpu_ms_per_request": 1000 * cpu / requests,
+        # ru_maxrss is in kilobytes on Linux
+        "peak_rss_mb": usage_after.ru_maxrss / 1024,
+    }
+
+
+def time_per_call(function, iterations: int) -> float:
+    start = time.perf_counter()
+    for _ in range(iterations):
+        function()
+    return 1e6 * (time.perf_counter() - start) / iterations
+
+
+def micro_benchmarks(iterations: int) -> dict:
+    """Microseconds per call of the hot path steps, without any network."""
+    test = discover_tests("benchmark1_grounding/examples/object_recognition_multi")[0]
+    image_bytes = test.with_suffix(".png").read_bytes()
+    data_url, _ = encode_image_bytes(image_bytes, grid_size=28)
+    ground_truth = main_grounding_dominik.parse_ground_truth_bboxes(test.with_suffix(".json"))
+    bbox_response = json.dumps([{"bbox": [300, 240, 340, 320], "label": label} for label, _ in ground_truth])
+    uitars_response = "Thought: The ball is on the left.\nAction: click(start_box='(230,131)')"
+    response_bboxes = main_grounding_dominik.parse_model_response_bboxes(bbox_response)
+    return {
+        # bypasses the payload cache, every call pads and encodes again
+        "encode_image_us": time_per_call(lambda: encode_image_bytes(image_bytes, grid_size=28), max(iterations // 20, 1)),
+        "build_messages_us": time_per_call(lambda: build_messages(multi_bbox_prompt, data_url, "Detect: BASKETBALL"),
+                                           iterations),
+        "parse_bboxes_us": time_per_call(lambda: main_grounding_dominik.parse_model_response_bboxes(bbox_response),
+                                         iterations),
+        "parse_uitars_us": time_per_call(lambda: main_grounding_dominik.parse_model_response_uitars(uitars_response),
+                                         iterations),
+        "score_bboxes_us": time_per_call(lambda: main_grounding_dominik.evaluate_response_bboxes(ground_truth,
+                                                                                               response_bboxes),
+                                         iterations),
+    }
+
+
+def time_command(argv: list[str], runs: int) -> float:
+    """Best wall time in milliseconds of a fresh `python -m fmvlatim` process, interpreter start included."""
+    times = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run([sys.executable, "-m", "fmvlatim", *argv], stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+                       env=JOB_ENV, check=True)
+        times.append(1000 * (time.perf_counter() - start))
+    return min(times)
+
+
+def time_worker_job(argv: list[str], runs: int) -> float:
+    """Best round trip in milliseconds of a job sent to a warm `python -m fmvlatim worker`, after one warm-up job."""
+    process = subprocess.Popen([sys.executable, "-m", "fmvlatim", "worker"], stdin=subprocess.PIPE,
+                               stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, text=True, env=JOB_ENV)
+    times = []
+    try:
+        for i in range(runs + 1):
+            start = time.perf_counter()
+            process.stdin.write(json.dumps({"id": i, "command": argv[0], "args": argv[1:]}) + "\n")
+            process.stdin.flush()
+            reply = json.loads(process.stdout.readline())
+            if not reply.get("ok"):
+                raise RuntimeError(f"Worker job failed: {reply}")
+            times.append(1000 * (time.perf_counter() - start))
+    finally:
+        process.stdin.close()
+        process.wait()
+    return min(times[1:])
+
+
+def startup_benchmarks(base_url: str, runs: int) -> dict:
+    """Milliseconds of CLI startup and of one small grounding job, in a fresh process and in the warm worker."""
+    job = ["grounding", "--input", "benchmark1_grounding/examples/object_recognition_single", "--base-url", base_url,
+           "--no-cache", "--concurrency", "1"]
+    return {
+        "help_ms": time_command(["--help"], runs),
+        "grounding_help_ms": time_command(["grounding", "--help"], runs),
+        "cold_job_ms": time_command(job, runs),
+        "warm_job_ms": time_worker_job(job, runs),
+    }
+
+
+def compare_to_baseline(report: dict, baseline: dict, tolerance: float) -> list[str]:
+    """Regressions of CPU per request and of the micro benchmarks beyond the tolerance."""
+    regressions = []
+    levels = {(level["pipeline"], level["concurrency"]): level for level in baseline.get("levels", [])}
+    for level in report["levels"]:
+        before = levels.get((level["pipeline"], level["concurrency"]))
+        if before and level["cpu_ms_per_request"] > before["cpu_ms_per_request"] * (1 + tolerance):
+            regressions.append(f"{level['pipeline']} @ {level['concurrency']}: cpu/request "
+                               f"{before['cpu_ms_per_request']:.2f} -> {level['cpu_ms_per_request']:.2f} ms")
+    for name, value in report["micro"].items():
+        before = baseline.get("micro", {}).get(name)
+        if before and value > before * (1 + tolerance):
+            regressions.append(f"{name}: {before:.1f} -> {value:.1f} us")
+    for name, value in report.get("startup", {}).items():
+        before = baseline.get("startup", {}).get(name)
+        if before and value > before * (1 + tolerance):
+            regressions.append(f"{name}: {before:.0f} -> {value:.0f} ms")
+    return regressions
+
+
+async def main(args):
+    process, base_url = start_mock_process(args.latency, args.latency_dist)
+    try:
+        levels = []
+        for pipeline in args.pipelines:
+            for concurrency in args.concurrency:
+                level = await run_level(pipeline, base_url, concurrency, args.tests)
+                levels.append(level)
+                print(f"{pipeline:16} concurrency {concurrency:4}: {level['requests_per_s']:8.1f} req/s, "
+                      f"{level['cpu_ms_per_request']:6.2f} ms cpu/request, peak rss {level['peak_rss_mb']:.0f} MB"
+                      + (f", {level['errors']} errors" if level["errors"] else ""))
+        startup = startup_benchmarks(base_url, args.startup_runs) if args.startup_runs else {}
+        for name, value in startup.items():
+            print(f"{name:20} {value:10.0f} ms")
+    finally:
+        process.terminate()
+        process.wait()
+
+    micro = micro_benchmarks(args.iterations)
+    for name, value in micro.items():
+        print(f"{name:20} {value:10.1f} us")
+    report = {"levels": levels, "micro": micro, "startup": startup}
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+        print(f"Wrote benchmark report to {args.output}")
+    if args.baseline:
+        with open(args.baseline, "r") as f:
+            regressions = compare_to_baseline(report, json.load(f), args.tolerance)
+        for regression in regressions:
+            print(f"Regression: {regression}")
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Throughput and overhead benchmark of the harness against the mock server")
+    parser.add_argument("--pipelines", nargs="+", choices=PIPELINES, default=PIPELINES)
+    parser.add_argument("--concurrency", nargs="+", type=int, default=[1, 4, 16, 64],
+                        help="Concurrency levels to run every pipeline at.")
+    parser.add_argument("--tests", type=int, default=200, help="Tests per pipeline and concurrency level.")
+    parser.add_argument("--latency", type=float, default=0.05, help="Mean latency of the mock server in seconds.")
+    parser.add_argument("--latency-dist", type=str, default="lognormal")
+    parser.add_argument("--iterations", type=int, default=2000, help="Iterations of the micro benchmarks.")
+    parser.add_argument("--startup-runs", type=int, default=5,
+                        help="Runs of the CLI startup and per-job overhead measurements (best of), 0 skips them.")
+    parser.add_argument("--output", type=str, metavar="FILE", help="Write the report as JSON, e.g. as a later baseline.")
+    parser.add_argument("--baseline", type=str, metavar="FILE",
+                        help="Earlier --output to compare against, exits with 1 on regressions.")
+    parser.add_argument("--tolerance", type=float, default=0.25, help="Allowed relative slowdown against the baseline.")
+
+    args = parser.parse_args()
+    os.chdir(Path(__file__).parent)
+    asyncio.run(main(args))
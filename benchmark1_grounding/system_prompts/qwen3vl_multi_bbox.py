@@ -0,0 +1,12 @@
+from prompts import legacy_system_prompt
+
+CATALOG = "names"
+OUTPUT = "multi_bbox"
+INSTRUCTION = """Analyze the image and detect the bounding boxes of all objects given in the user prompt that are inside the blue game play area.
+If the user prompt asks for all objects, detect every object inside the blue game play area.
+Return only a JSON array in this exact format: [{"bbox": [x_min, y_min, x_max, y_max], "label": "string"}, ...] without markdown,
+with one entry per detected object, where the coordinates are normalized values from 0 to 1000 (representing 0% to 100% of image dimensions),
+assuming the top-left corner is (0,0). Use the object names from the list of possible objects as labels. Do not include any other text.
+If no object is detected, return []."""
+
+SYSTEM_PROMPT = legacy_system_prompt(CATALOG, INSTRUCTION)
\ No newline at end of file
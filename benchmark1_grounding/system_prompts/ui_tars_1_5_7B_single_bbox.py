@@ -1,4 +1,9 @@
-SYSTEM_PROMPT = """You are a GUI agent. You are given a task and your action history, with screenshots. You need to perform the next action to complete the task.
+from prompts import legacy_system_prompt
+
+# agent prompt without part list, it stays the system prompt
+CATALOG = None
+OUTPUT = "uitars"
+INSTRUCTION = """You are a GUI agent. You are given a task and your action history, with screenshots. You need to perform the next action to complete the task.
 
 ## Output Format
 ```
@@ -14,4 +19,6 @@ click(point='<point>x1 y1</point>')
 ## Note
 - Use English in `Thought` part.
 - Write a small plan and finally summarize your next action (with its target element) in one sentence in `Thought` part.
-"""
\ No newline at end of file
+"""
+
+SYSTEM_PROMPT = legacy_system_prompt(CATALOG, INSTRUCTION)
\ No newline at end of file
@@ -1,12 +1,8 @@
-SYSTEM_PROMPT = """Analyze the image and identify the objects that are inside the blue game play area according to their properties.
-Respond only with one object name from the given list according to the TASK_DESCRIPTION under the list and nothing else.
+from prompts import legacy_system_prompt
 
-Possible objects:
-Bowling Ball - This bowling ball is real heavy and doesn't bounce much.
-Basketball - This basketball is medium weight and very bouncy.
-Soccer Ball - This soccer ball is medium in both weight and bounciness.
-Pinball - This pinball is very hard and heavy and doesn't bounce much.
-Super Ball - This super ball gains height with every bounce. The harder it's hit, the further it will roll. It's not affected by gravity. You can program it to show any number on its surface.
-Programmable Ball - This ball can be programmed to vary in appearance, mass, elasticity, density, and friction.
-Baseball - This baseball is pretty light and not very bouncy.
-Tennis Ball - This tennis ball or floor can be stretched vertically or horizontally to any length you need. It's not as slippery as a caution wall. Explosives will blow it up."""
\ No newline at end of file
+CATALOG = "balls"
+OUTPUT = "part"
+INSTRUCTION = """Analyze the image and identify the objects that are inside the blue game play area according to their properties.
+Respond only with one object name from the list of possible objects according to the TASK_DESCRIPTION below and nothing else."""
+
+SYSTEM_PROMPT = legacy_system_prompt(CATALOG, INSTRUCTION)
\ No newline at end of file
@@ -1,6 +1,9 @@
-SYSTEM_PROMPT = """Analyze the image and identify the objects that are inside the blue game play area according to their properties.
-Respond only with one object name from the given list according to the TASK_DESCRIPTION under the list and nothing else.
-Don't change the name of the object leave it in the caps font and with underscores between the words
+from prompts import legacy_system_prompt
 
-Possible objects:
-BOWLING_BALL,BASKETBALL,SOCCER_BALL,PINBALL,SUPER_BALL,PROGRAMMABLE_BALL,BASEBALL,TENNIS_BALL,YELLOW_BRICK_WALL,CINDER_BLOCK_WALL,GRECO_ROMAN_WALL,WOODEN_WALL,LOG_WALL,CAUTION_WALL,GRASS_FLOOR,SAND_WALL,PIPE_WALL,CURVED_PIPE_WALL,T_CONNECTOR,LARGE_CURVED_PIPE,ACCELERATOR_TUBE,LATTICE_ARCHWAY,SCAFFOLD_BARRIER,WOODEN_BARRIER,ARCHWAY,BRICK_INCLINE,YELLOW_BRICK_INCLINE,GRANITE_INCLINE,WOOD_INCLINE,LOG_INCLINE,GRASS_INCLINE,POOL_TABLE_WALL,POOL_CUE,TRAP_DOOR,BALLOON,HOT_AIR_BALLOON,BLIMP,TEETER_TOTTER,TIPPY_TRAILER,PULLEY,BOAT_CLEAT,TIN_SNIPS,CAPTAIN_Z_SUPER_PHASER,BUCKET,LEAKY_BUCKET,LAUNDRY_BASKET,FLASHLIGHT,LAVA_LAMP,MAGNIFYING_GLASS,CANDLE,ALADDINS_LAMP,FINT_AND_STARTER,MATCH_ON_A_SPRING,CANNON,DYNAMITE,ROCKET,FIREWORKS,MISSILE,NITROGYRECINE,CAN_OPENER,ELECTRIC_MIXER,COFFEE_POT,ELECTRIC_FAN,VACUUM,EGG_TIMER,ELECTRIC_MOTOR,ELECTRIC_SWITCH_AND_OUTLET,ELECTRICAL_OUTLET,SOLAR_PANEL,LASER_ACTIVATED_PLUG,RED_LASER,GREEN_LASER,BLUE_LASER,LASER_MIXER,ANGLED_MIRROR,LASER_DETECTOR,MOUSE_MOTOR,MANDRILL_MOTOR,CONVEYOR_BELT,BELT,GEAR,TINY_GEAR,PINWHEEL,TRANS_ROTO_MATIC,ROTO_TRANS_CONVERTER,BIKE_PUMP,ANTI_GRAVITY_PAD,PINBALL_BUMPER,PINBALL_FLIPPER,BOXING_GLOVE,MELS_HOUSE,MOUSE_HOLE,CHEESE,NEWTON_MOUSE,CURIE_CAT,FISH_TANK,ALLIGATOR,MEL_SCHLEMMINGTON,BOXES,MESSAGE_COMPUTER"""
\ No newline at end of file
+CATALOG = "names"
+OUTPUT = "part"
+INSTRUCTION = """Analyze the image and identify the objects that are inside the blue game play area according to their properties.
+Respond only with one object name from the list of possible objects according to the TASK_DESCRIPTION below and nothing else.
+Don't change the name of the object leave it in the caps font and with underscores between the words"""
+
+SYSTEM_PROMPT = legacy_system_prompt(CATALOG, INSTRUCTION)
\ No newline at end of file
@@ -0,0 +1 @@
+SYSTEM_PROMPT = """TASK_DESCRIPTION: What tips the teeter-totter over when the simulation is started?"""
\ No newline at end of file
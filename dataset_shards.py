@@ -0,0 +1,263 @@
+import argparse
+import glob
+import json
+import mmap
+import shutil
+import struct
+import tempfile
+import time
+from concurrent.futures import Executor, ProcessPoolExecutor
+from dataclasses import asdict
+from pathlib import Path
+
+from tim_parser import parse_tim
+from utils import CROP_MODES, ImageTransform, case_id, discover_tests, encode_image_bytes, image_bytes_payload
+
+SHARD_MAGIC = b"FMVSHRD1"
+SHARD_SUFFIX = ".shard"
+# magic and header length
+PREFIX_STRUCT = struct.Struct("<8sQ")
+# one fixed-width row per case, offsets are relative to the start of the data region, as numpy dtype fields
+INDEX_FIELDS = [
+    ("image_offset", "<u8"), ("image_length", "<u8"),
+    ("encoded_offset", "<u8"), ("encoded_length", "<u8"),
+    ("meta_offset", "<u8"), ("meta_length", "<u8"),
+    ("flags", "<u8"),
+]
+HAS_TASK_DESCRIPTION = 1
+
+
+def _align(offset: int, alignment: int = 8) -> int:
+    return (offset + alignment - 1) // alignment * alignment
+
+
+def _case_metadata(test: Path) -> dict:
+    json_path = test.with_suffix(".json")
+    if json_path.exists():
+        with open(json_path, "r") as f:
+            scene = json.load(f)
+    else:
+        scene = parse_tim(test.with_suffix(".TIM"))
+    metadata = {"scene": scene}
+    py_path = test.with_suffix(".py")
+    if py_path.exists():
+        # imported here, prompts is only needed for understanding tests
+        from prompts import read_task_description
+        metadata["task_description"] = read_task_description(py_path)
+    return metadata
+
+
+def write_shard(tests: list[Path], shard_path: Path, encode: dict | None = None, executor: Executor | None = None):
+    """Pack test cases into one shard file.
+        Args:
+            tests (list[Path]): Test paths without suffix, see utils.discover_tests.
+            shard_path (Path): Output file.
+            encode (dict | None): grid_size, image_format, quality, crop and max_image_tokens to pre-encode the image
+                payloads with, so runners with the same image options skip padding and encoding entirely.
+            executor (Executor | None): Pool for the pre-encoding.
+    """
+    # numpy is only needed once a shard is read or written, not to parse the arguments of the scripts
+    import numpy as np
+
+    index = np.zeros(len(tests), dtype=np.dtype(INDEX_FIELDS))
+    image_bytes = [test.with_suffix(".png").read_bytes() for test in tests]
+    encoded = [None] * len(tests)
+    if encode is not None:
+        arguments = [(data, encode["grid_size"], encode["image_format"], encode["quality"], encode["crop"],
+                      encode["max_image_tokens"]) for data in image_bytes]
+        if executor is not None:
+            encoded = list(executor.map(encode_image_bytes, *zip(*arguments)))
+        else:
+            encoded = [encode_image_bytes(*argument) for argument in arguments]
+
+    with tempfile.TemporaryFile() as data:
+        for i, test in enumerate(tests):
+            metadata = _case_metadata(test)
+            if encoded[i] is not None:
+                metadata["transform"] = asdict(encoded[i][1])
+            blobs = {
+                "image": image_bytes[i],
+                "encoded": encoded[i][0].encode("ascii") if encoded[i] is not None else b"",
+                "meta": json.dumps(metadata, separators=(",", ":")).encode("utf-8"),
+            }
+            for name, blob in blobs.items():
+                index[f"{name}_offset"][i] = data.tell()
+                index[f"{name}_length"][i] = len(blob)
+                data.write(blob)
+            index["flags"][i] = HAS_TASK_DESCRIPTION if "task_description" in metadata else 0
+
+        ids = "\n".join(case_id(test) for test in tests).encode("utf-8")
+        header = json.dumps({"version": 1, "count": len(tests), "ids_length": len(ids), "encode": encode}).encode("utf-8")
+        ids_offset = PREFIX_STRUCT.size + len(header)
+        index_offset = _align(ids_offset + len(ids))
+        data_offset = _align(index_offset + index.nbytes, mmap.PAGESIZE)
+
+        shard_path.parent.mkdir(parents=True, exist_ok=True)
+        with open(shard_path, "wb") as f:
+            f.write(PREFIX_STRUCT.pack(SHARD_MAGIC, len(header)))
+            f.write(header)
+            f.write(ids)
+            f.write(b"\0" * (index_offset - f.tell()))
+            f.write(index.tobytes())
+            f.write(b"\0" * (data_offset - f.tell()))
+            data.seek(0)
+            shutil.copyfileobj(data, f)
+
+
+class DatasetShard:
+    """Memory-mapped shard written by write_shard.
+        Opening only reads the header, ids and index, the images and metadata of a case are paged in
+        by the OS once the case is accessed.
+    """
+
+    def __init__(self, shard_path: Path):
+        import numpy as np
+
+        self.path = Path(shard_path)
+        with open(self.path, "rb") as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, header_length = PREFIX_STRUCT.unpack_from(self.mmap, 0)
+        if magic != SHARD_MAGIC:
+            raise ValueError(f"{self.path} is not a dataset shard.")
+        self.header = json.loads(self.mmap[PREFIX_STRUCT.size:PREFIX_STRUCT.size + header_length])
+        self.encode = self.header["encode"]
+        ids_offset = PREFIX_STRUCT.size + header_length
+        ids = self.mmap[ids_offset:ids_offset + self.header["ids_length"]].decode("utf-8")
+        self.ids = ids.split("\n") if ids else []
+        self.positions = {test_id: i for i, test_id in enumerate(self.ids)}
+        index_offset = _align(ids_offset + self.header["ids_length"])
+        self.index = np.frombuffer(self.mmap, dtype=np.dtype(INDEX_FIELDS), count=self.header["count"],
+                                   offset=index_offset)
+        self.data_offset = _align(index_offset + self.index.nbytes, mmap.PAGESIZE)
+        self.buffer = memoryview(self.mmap)
+
+    def __len__(self):
+        return len(self.ids)
+
+    def __contains__(self, test_id: str):
+        return test_id in self.positions
+
+    def _blob(self, test_id: str, name: str) -> memoryview:
+        row = self.index[self.positions[test_id]]
+        start = self.data_offset + int(row[f"{name}_offset"])
+        return self.buffer[start:start + int(row[f"{name}_length"])]
+
+    def image_bytes(self, test_id: str) -> memoryview:
+        """Zero-copy view of the original .png bytes."""
+        return self._blob(test_id, "image")
+
+    def encoded_image(self, test_id: str) -> memoryview | None:
+        blob = self._blob(test_id, "encoded")
+        return blob if len(blob) else None
+
+    def metadata(self, test_id: str) -> dict:
+        return json.loads(bytes(self._blob(test_id, "meta")))
+
+    def has_task_description(self, test_id: str) -> bool:
+        return bool(self.index[self.positions[test_id]]["flags"] & HAS_TASK_DESCRIPTION)
+
+
+class ShardDataset:
+    """All shards of a packed dataset, addressed by case id like the loose test files."""
+
+    def __init__(self, shard_paths: list[Path]):
+        if not shard_paths:
+            raise FileNotFoundError("No dataset shards given.")
+        self.shards = [DatasetShard(path) for path in shard_paths]
+        self.shard_of = {test_id: shard for shard in self.shards for test_id in shard.ids}
+
+    def __len__(self):
+        return len(self.shard_of)
+
+    def __contains__(self, test_id: str):
+        return test_id in self.shard_of
+
+    def tests(self, with_task_description: bool = False) -> list[Path]:
+        """Test paths in the same form as utils.discover_tests, case_id(test) is the key into the shards."""
+        return sorted(Path(test_id) for test_id, shard in self.shard_of.items()
+                      if not with_task_description or shard.has_task_description(test_id))
+
+    def scene(self, test_id: str) -> dict:
+        """Content of the test's .json file."""
+        return self.shard_of[test_id].metadata(test_id)["scene"]
+
+    def task_description(self, test_id: str) -> str:
+        return self.shard_of[test_id].metadata(test_id)["task_description"]
+
+    async def payload(self, test_id: str, grid_size: int | None = 28, image_format: str = "PNG",
+                      quality: int | None = None, crop: str = "full", max_image_tokens: int | None = None,
+                      executor: Executor | None = None) -> tuple[str, ImageTransform]:
+        """Pre-encoded payload if the shard was packed with the same image options, else encoded on the fly.
+            Same result as utils.image_bytes_payload.
+        """
+        shard = self.shard_of[test_id]
+        options = {"grid_size": grid_size, "image_format": image_format, "quality": quality, "crop": crop,
+                   "max_image_tokens": max_image_tokens}
+        if shard.encode == options:
+            encoded = shard.encoded_image(test_id)
+            if encoded is not None:
+                return str(encoded, "ascii"), ImageTransform(**shard.metadata(test_id)["transform"])
+        return await image_bytes_payload(shard.image_bytes(test_id), grid_size, image_format, quality, crop,
+                                         max_image_tokens, executor)
+
+
+def is_shard_input(input_path: str) -> bool:
+    return input_path.endswith(SHARD_SUFFIX)
+
+
+def open_dataset(input_path: str) -> ShardDataset:
+    """Open a shard file or a glob pattern of shard files, e.g. shards/examples-*.shard."""
+    return ShardDataset([Path(path) for path in sorted(glob.glob(input_path))])
+
+
+def pack(root: str, output_prefix: Path, cases_per_shard: int = 10000, encode: dict | None = None,
+         workers: int | None = None) -> list[Path]:
+    tests = discover_tests(root, suffixes=(".png",))
+    tests = [test for test in tests if test.with_suffix(".json").exists() or test.with_suffix(".TIM").exists()]
+    if not tests:
+        raise FileNotFoundError(f"No test with .png and .json or .TIM files found for input: {root}")
+    executor = ProcessPoolExecutor(workers) if encode is not None and workers else None
+    shard_paths = []
+    for start in range(0, len(tests), cases_per_shard):
+        shard_path = output_prefix.with_name(f"{output_prefix.name}-{start // cases_per_shard:05d}{SHARD_SUFFIX}")
+        write_shard(tests[start:start + cases_per_shard], shard_path, encode, executor)
+        shard_paths.append(shard_path)
+    if executor is not None:
+        executor.shutdown()
+    return shard_paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Pack test cases into memory-mapped dataset shards")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    pack_parser = subparsers.add_parser("pack", help="Pack all tests below a directory.")
+    pack_parser.add_argument("root", type=str, metavar="DIR|GLOB")
+    pack_parser.add_argument("--output", type=str, metavar="PREFIX", default="shards/dataset",
+                             help="Shards are written to PREFIX-00000.shard, PREFIX-00001.shard, ...")
+    pack_parser.add_argument("--cases-per-shard", type=int, default=10000)
+    pack_parser.add_argument("--encode", action="store_true",
+                             help="Also store the padded and encoded payload, see --grid-size and --image-format.")
+    pack_parser.add_argument("--grid-size", type=int, default=28, help="0 stores the payload unpadded.")
+    pack_parser.add_argument("--image-format", type=str.upper, default="PNG")
+    pack_parser.add_argument("--image-quality", type=int, default=None)
+    pack_parser.add_argument("--crop", choices=CROP_MODES, default="full")
+    pack_parser.add_argument("--max-image-tokens", type=int, default=None)
+    pack_parser.add_argument("--workers", type=int, default=None, help="Processes for --encode.")
+    info_parser = subparsers.add_parser("info", help="Open shards and list their cases.")
+    info_parser.add_argument("input", type=str, metavar="FILE|GLOB")
+    args = parser.parse_args()
+
+    if args.command == "pack":
+        encode = None
+        if args.encode:
+            encode = {"grid_size": args.grid_size or None, "image_format": args.image_format,
+                      "quality": args.image_quality, "crop": args.crop, "max_image_tokens": args.max_image_tokens}
+        for shard_path in pack(args.root, Path(args.output), args.cases_per_shard, encode, args.workers):
+            print(f"Wrote {shard_path} ({shard_path.stat().st_size / 1e6:.1f} MB)")
+    else:
+        start = time.perf_counter()
+        dataset = open_dataset(args.input)
+        elapsed = time.perf_counter() - start
+        for test in dataset.tests():
+            print(case_id(test))
+        print(f"Opened {len(dataset.shards)} shards with {len(dataset)} cases in {1000 * elapsed:.1f} ms")
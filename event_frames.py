@@ -0,0 +1,153 @@
+import asyncio
+import math
+from concurrent.futures import Executor
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from utils import encode_image, prepare_image
+
+if TYPE_CHECKING:
+    # numpy and PIL are imported once frames are encoded, main_event parses its arguments without them
+    import numpy as np
+    from PIL import Image
+
+# edge length of the grey thumbnails frames are compared on
+THUMBNAIL_SIZE = 32
+# white border between the tiles of a montage
+TILE_SPACING = 4
+
+
+def frame_paths(level_dir: Path) -> list[Path]:
+    """Frames of a simulation, ordered by file name, e.g. <level>/0000.png, <level>/0001.png, ..."""
+    return sorted(level_dir.glob("*.png"))
+
+
+def thumbnail(image: "Image.Image") -> "np.ndarray":
+    import numpy as np
+    from PIL import Image
+
+    return np.asarray(image.convert("L").resize((THUMBNAIL_SIZE, THUMBNAIL_SIZE), Image.Resampling.BILINEAR),
+                      dtype=np.float32)
+
+
+def drop_near_duplicates(images: list["Image.Image"], threshold: float) -> list[int]:
+    """Indices of the frames to keep, a frame is dropped if it barely differs from the last kept one.
+        Args:
+            images (list[Image.Image]): Frames in chronological order.
+            threshold (float): Minimum mean absolute difference of the grey thumbnails (0-255), 0 keeps every frame.
+        Returns:
+            list[int]: Indices of the kept frames, the first and the last frame are always kept.
+    """
+    import numpy as np
+
+    if threshold <= 0 or len(images) <= 2:
+        return list(range(len(images)))
+    kept = [0]
+    last = thumbnail(images[0])
+    for i in range(1, len(images) - 1):
+        current = thumbnail(images[i])
+        if float(np.abs(current - last).mean()) > threshold:
+            kept.append(i)
+            last = current
+    return kept + [len(images) - 1]
+
+
+def sample_evenly(indices: list[int], max_frames: int | None) -> list[int]:
+    """At most max_frames of the indices, evenly spaced and including the first and the last."""
+    if not max_frames or len(indices) <= max_frames:
+        return indices
+    if max_frames == 1:
+        return [indices[-1]]
+    return [indices[round(i * (len(indices) - 1) / (max_frames - 1))] for i in range(max_frames)]
+
+
+def parse_montage(spec: str) -> tuple[int, int]:
+    """Parse a --montage value COLSxROWS, e.g. 2x2. 1x1 sends every frame as its own image."""
+    columns, _, rows = spec.lower().partition("x")
+    if not columns.isdigit() or not rows.isdigit() or int(columns) < 1 or int(rows) < 1:
+        raise ValueError(f"Montage {spec} is not of the form COLSxROWS, e.g. 2x2.")
+    return int(columns), int(rows)
+
+
+def tile_montage(images: list["Image.Image"], columns: int) -> "Image.Image":
+    """Tile frames of the same size left to right, top to bottom into one image."""
+    from PIL import Image
+
+    width, height = images[0].size
+    columns = min(columns, len(images))
+    rows = math.ceil(len(images) / columns)
+    montage = Image.new("RGB", (columns * width + (columns - 1) * TILE_SPACING,
+                                rows * height + (rows - 1) * TILE_SPACING), (255, 255, 255))
+    for i, image in enumerate(images):
+        row, column = divmod(i, columns)
+        montage.paste(image, (column * (width + TILE_SPACING), row * (height + TILE_SPACING)))
+    return montage
+
+
+def encode_event_frames(frame_files: list[str], montage: tuple[int, int] = (1, 1), max_frames: int | None = None,
+                        dedup_threshold: float = 0.0, grid_size: int | None = 28, image_format: str = "PNG",
+                        quality: int | None = None, crop: str = "full",
+                        max_image_tokens: int | None = None) -> tuple[list[str], dict]:
+    """Select, tile and encode the frames of an event.
+        Module level function, so it can be submitted to a ProcessPoolExecutor.
+        Args:
+            frame_files (list[str]): Frame files in chronological order.
+            montage (tuple[int, int]): Columns and rows of frames per image.
+            max_frames (int | None): Frames to keep after dropping near duplicates, evenly spaced.
+            dedup_threshold (float): See drop_near_duplicates.
+            crop (str): Applied to every frame, see utils.prepare_image.
+            max_image_tokens (int | None): Visual token budget per sent image (frame or montage).
+        Returns:
+            tuple[list[str], dict]: data URLs in chronological order and frame statistics.
+    """
+    from PIL import Image
+
+    frames = []
+    for frame_file in frame_files:
+        with Image.open(frame_file) as image:
+            frames.append(prepare_image(image, None, crop)[0])
+    kept = sample_evenly(drop_near_duplicates(frames, dedup_threshold), max_frames)
+    tiles_per_image = montage[0] * montage[1]
+    data_urls = []
+    for start in range(0, len(kept), tiles_per_image):
+        tiles = [frames[i] for i in kept[start:start + tiles_per_image]]
+        image = tile_montage(tiles, montage[0]) if len(tiles) > 1 else tiles[0]
+        image, _ = prepare_image(image, grid_size, "full", max_image_tokens)
+        data_urls.append(encode_image(image, image_format, quality))
+    stats = {
+        "frames": len(frames),
+        "frames_sent": len(kept),
+        "images": len(data_urls),
+        # base64 size of sending every frame file as it is, the baseline for the upload savings
+        "frames_bytes": sum(4 * math.ceil(Path(frame_file).stat().st_size / 3) for frame_file in frame_files),
+    }
+    return data_urls, stats
+
+
+class FramePayloads:
+    """Encoded frames per level and options, shared by all questions about the same level.
+        Concurrent requests for the same frames wait for one encoding instead of encoding again.
+    """
+
+    def __init__(self, executor: Executor | None = None):
+        self.executor = executor
+        self.tasks: dict[tuple, asyncio.Future] = {}
+        self.encoded = 0
+        self.reused = 0
+
+    async def get(self, frame_files: list[Path], **options) -> tuple[list[str], dict]:
+        key = (tuple(frame_files), tuple(sorted(options.items())))
+        if key in self.tasks:
+            self.reused += 1
+        else:
+            self.encoded += 1
+            loop = asyncio.get_running_loop()
+            # without an executor the default thread pool encodes, so the event loop is never blocked
+            self.tasks[key] = loop.run_in_executor(self.executor, _encode_event_frames_kwargs,
+                                                   [str(path) for path in frame_files], options)
+        return await self.tasks[key]
+
+
+def _encode_event_frames_kwargs(frame_files: list[str], options: dict) -> tuple[list[str], dict]:
+    # executors only pass positional arguments
+    return encode_event_frames(frame_files, **options)
@@ -0,0 +1 @@
+"""Command line entry point of the benchmarks, see `python -m fmvlatim --help`."""
@@ -0,0 +1,3 @@
+from fmvlatim.cli import main
+
+main()
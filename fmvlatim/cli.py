@@ -0,0 +1,62 @@
+import argparse
+import importlib
+import sys
+from pathlib import Path
+from types import ModuleType
+
+# the benchmark scripts are top-level modules of the repository
+REPO_DIR = Path(__file__).resolve().parent.parent
+if str(REPO_DIR) not in sys.path:
+    sys.path.insert(0, str(REPO_DIR))
+
+# command -> (module, help), every module has build_parser() and an async main(args).
+# A module is only imported when its command runs, so the dispatch does not pay for openai, numpy and PIL.
+COMMANDS = {
+    "grounding": ("main_grounding_dominik", "Grounding benchmark: UI-TARS clicks or bounding boxes of the targets."),
+    "understanding": ("main_understanding", "Understanding benchmark: object property and state questions."),
+    "event": ("main_event", "Event benchmark: cause, effect and outcome questions about simulations."),
+    "batch": ("batch_api", "Run a benchmark through a provider batch API."),
+    "compare": ("sequential_eval", "Compare two models and stop as soon as the difference is decided."),
+}
+
+
+def load_command(command: str) -> tuple[ModuleType, argparse.ArgumentParser]:
+    """Module and argument parser of a command."""
+    module = importlib.import_module(COMMANDS[command][0])
+    parser = module.build_parser()
+    parser.prog = f"python -m fmvlatim {command}"
+    return module, parser
+
+
+async def run_command(command: str, argv: list[str]):
+    """Run a command like its script would, e.g. run_command("grounding", ["--input", "tests/"])."""
+    module, parser = load_command(command)
+    await module.main(parser.parse_args(argv))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(prog="python -m fmvlatim", description="FMVLATIM benchmarks")
+    subparsers = parser.add_subparsers(dest="command", required=True, metavar="COMMAND")
+    for command, (_, help_text) in COMMANDS.items():
+        # the arguments of a command are parsed by its own parser, see main
+        subparsers.add_parser(command, help=help_text, add_help=False)
+    worker_parser = subparsers.add_parser("worker", help="Keep one warm process and run jobs from stdin or a socket.")
+    worker_parser.add_argument("--socket", type=str, metavar="PATH",
+                               help="Accept JSONL jobs on this Unix socket instead of stdin.")
+    worker_parser.add_argument("--preload", nargs="*", choices=list(COMMANDS), default=["grounding", "understanding", "event"],
+                               help="Import these commands and warm their caches before the first job.")
+    return parser
+
+
+def main(argv: list[str] | None = None):
+    argv = sys.argv[1:] if argv is None else argv
+    # asyncio alone takes a third of the startup of --help
+    import asyncio
+
+    if argv and argv[0] in COMMANDS:
+        asyncio.run(run_command(argv[0], argv[1:]))
+        return
+    args = build_parser().parse_args(argv)
+    from fmvlatim.worker import run_worker
+
+    asyncio.run(run_worker(args))
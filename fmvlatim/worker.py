@@ -0,0 +1,144 @@
+import argparse
+import asyncio
+import contextlib
+import importlib
+import json
+import os
+import sys
+import time
+from pathlib import Path
+
+from fmvlatim.cli import COMMANDS, run_command
+
+
+def preload(commands: list[str]):
+    """Import the commands and fill the caches every job would fill again in a fresh process."""
+    for command in commands:
+        importlib.import_module(COMMANDS[command][0])
+    # the commands import these lazily, a warm worker loads them before the first job
+    import numpy  # noqa: F401
+    import openai  # noqa: F401
+    from PIL import Image  # noqa: F401
+    from batch_runner import pool_async_clients
+    from output_contracts import part_matcher
+    from prompts import CATALOG_FILES, system_prompt
+    from utils import pool_image_executors
+
+    # the API clients of finished jobs stay open, with their connections, for the next job with the same endpoint
+    pool_async_clients()
+    # as do the image pools, a job does not start and stop its own worker processes
+    pool_image_executors()
+    for catalog in CATALOG_FILES:
+        system_prompt(catalog)
+    part_matcher()
+
+
+async def run_job_command(command: str, argv: list[str]) -> int | str | None:
+    # argparse exits on --help and on invalid arguments, a SystemExit escaping a task would stop the event loop
+    try:
+        await run_command(command, argv)
+    except SystemExit as e:
+        return e.code
+    return None
+
+
+async def run_job(job: dict, default_log) -> dict:
+    """Run one job {"id": ..., "command": "grounding", "args": [...], "log": FILE} and describe the outcome.
+        The output of the job goes to its log file, or to default_log.
+    """
+    reply = {"id": job.get("id")}
+    command = job.get("command")
+    if command not in COMMANDS:
+        return {**reply, "ok": False, "error": f"Unknown command {command}, use one of {list(COMMANDS)}."}
+    start = time.perf_counter()
+    with contextlib.ExitStack() as stack:
+        log = stack.enter_context(open(job["log"], "a")) if job.get("log") else default_log
+        stack.enter_context(contextlib.redirect_stdout(log))
+        try:
+            # its own task, so context variables such as the current variant do not leak into the next job
+            exit_code = await asyncio.create_task(run_job_command(command, [str(arg) for arg in job.get("args", [])]))
+            reply["ok"] = exit_code in (0, None)
+            if not reply["ok"]:
+                reply["error"] = f"Invalid arguments (exit code {exit_code})"
+        except Exception as e:
+            reply["ok"] = False
+            reply["error"] = repr(e)
+    reply["elapsed_s"] = time.perf_counter() - start
+    return reply
+
+
+async def serve_stdin(lock: asyncio.Lock):
+    """One job per stdin line, one reply per stdout line. The output of the jobs goes to stderr."""
+    replies = sys.stdout
+    loop = asyncio.get_running_loop()
+    while True:
+        line = await loop.run_in_executor(None, sys.stdin.readline)
+        if not line:
+            return
+        if not line.strip():
+            continue
+        async with lock:
+            reply = await handle_line(line, sys.stderr)
+        replies.write(json.dumps(reply) + "\n")
+        replies.flush()
+        if reply.get("shutdown"):
+            return
+
+
+async def serve_socket(path: Path, lock: asyncio.Lock):
+    """Jobs and replies as JSON lines over connections to a Unix socket, the output of the jobs goes to stderr."""
+    stopped = asyncio.Event()
+
+    async def handle(reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        while line := await reader.readline():
+            if not line.strip():
+                continue
+            # jobs of all connections run one after the other, they share stdout and the caches
+            async with lock:
+                reply = await handle_line(line.decode("utf-8"), sys.stderr)
+            writer.write((json.dumps(reply) + "\n").encode("utf-8"))
+            await writer.drain()
+            if reply.get("shutdown"):
+                stopped.set()
+                break
+        writer.close()
+
+    if path.exists():
+        path.unlink()
+    server = await asyncio.start_unix_server(handle, path=str(path))
+    print(f"Worker listening on {path}", file=sys.stderr, flush=True)
+    async with server:
+        await stopped.wait()
+    path.unlink(missing_ok=True)
+
+
+async def handle_line(line: str, default_log) -> dict:
+    try:
+        job = json.loads(line)
+    except json.JSONDecodeError as e:
+        return {"id": None, "ok": False, "error": f"Invalid job: {e}"}
+    if job.get("command") == "shutdown":
+        return {"id": job.get("id"), "ok": True, "shutdown": True}
+    return await run_job(job, default_log)
+
+
+async def run_worker(args: argparse.Namespace):
+    """Run jobs in one long-lived process, so they do not pay for interpreter start, imports and cold caches.
+        A job is a JSON line {"id": 1, "command": "grounding", "args": ["--input", "tests/"], "log": "job1.log"},
+        the reply {"id": 1, "ok": true, "elapsed_s": 1.2} or with "error". {"command": "shutdown"} stops the worker.
+    """
+    start = time.perf_counter()
+    preload(args.preload)
+    print(f"Worker {os.getpid()} ready after {time.perf_counter() - start:.2f} s", file=sys.stderr, flush=True)
+    lock = asyncio.Lock()
+    try:
+        if args.socket:
+            await serve_socket(Path(args.socket), lock)
+        else:
+            await serve_stdin(lock)
+    finally:
+        from batch_runner import close_pooled_clients
+        from utils import shutdown_pooled_executors
+
+        await close_pooled_clients()
+        shutdown_pooled_executors()
@@ -1,2 +1,5 @@
+from fmvlatim.cli import main
+
 if __name__ == "__main__":
-    print('Nothing to see here, call main_understanding or main_grounding instead.')
+    # same as python -m fmvlatim
+    main()
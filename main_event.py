@@ -0,0 +1,249 @@
+import argparse
+import asyncio
+import json
+from pathlib import Path
+from types import ModuleType
+
+from benchmark3_event.system_prompts import qwen3vl_cause_ident_text as cause_ident_text_prompt
+from benchmark3_event.system_prompts import qwen3vl_cause_ident_visual as cause_ident_visual_prompt
+from benchmark3_event.system_prompts import qwen3vl_effect_prediction_text as effect_prediction_text_prompt
+from benchmark3_event.system_prompts import qwen3vl_effect_prediction_visual as effect_prediction_visual_prompt
+from benchmark3_event.system_prompts import qwen3vl_outcome_prediction_textual as outcome_prediction_text_prompt
+from benchmark3_event.system_prompts import qwen3vl_outcome_prediction_visual as outcome_prediction_visual_prompt
+from batch_runner import CompletionClient, create_async_client, run_batch, write_results
+from event_frames import FramePayloads, frame_paths, parse_montage
+from main_understanding import parse_model_response
+from output_contracts import add_contract_arguments, contracts_from_args, numbered_answers
+from prompts import build_messages, prompt_name, read_task_description, scene_text
+from response_cache import add_cache_arguments, cache_from_args
+from results_store import aggregate_results, print_aggregates
+from scene_index import load_scene
+from scheduler import add_scheduler_arguments, scheduler_from_args
+from telemetry import add_telemetry_arguments, current_case, current_prompt, current_variant, print_report, \
+    telemetry_from_args, write_report
+from utils import add_image_arguments, add_verbose_argument, case_id, configure_test_log, create_image_executor, \
+    discover_tests, get_api_key, image_budget_name, parse_image_budget, release_image_executor, select_shard, test_log
+
+EVENT_PROMPTS = {
+    "cause_ident": {"text": cause_ident_text_prompt, "visual": cause_ident_visual_prompt},
+    "effect_prediction": {"text": effect_prediction_text_prompt, "visual": effect_prediction_visual_prompt},
+    "outcome_prediction": {"text": outcome_prediction_text_prompt, "visual": outcome_prediction_visual_prompt},
+}
+VARIANTS = ["text", "visual"]
+
+
+def read_question(test: Path) -> dict:
+    '''Example of an event test, a question about a level with its simulation frames:
+
+examples/cause_ident/DOMINO1.py     SYSTEM_PROMPT = """TASK_DESCRIPTION: What made the last domino fall?"""
+examples/cause_ident/DOMINO1.json   {"solution": "BOWLING_BALL", "level": "DOMINO", "frames": [0, 40]}
+examples/cause_ident/DOMINO.TIM     scene of the level (or DOMINO.json), serialized for the text variant
+examples/cause_ident/DOMINO/        frames of the simulation, 0000.png, 0001.png, ...
+
+"level" defaults to the name of the test, "frames" (first and last frame, inclusive) to all frames.
+    '''
+    with open(test.with_suffix(".json"), "r") as f:
+        question = json.load(f)
+    question["level_path"] = test.parent / question.get("level", test.name)
+    question["task_description"] = read_task_description(test.with_suffix(".py"))
+    return question
+
+
+def question_frames(question: dict) -> list[Path]:
+    frames = frame_paths(question["level_path"])
+    if "frames" in question:
+        first, last = question["frames"]
+        frames = frames[first:last + 1]
+    return frames
+
+
+def group_questions(tests: list[Path], questions_per_request: int) -> list[list[Path]]:
+    """Questions about the same level and frames, in chunks that are asked in one request each."""
+    groups: dict[tuple, list[Path]] = {}
+    for test in tests:
+        question = read_question(test)
+        groups.setdefault((question["level_path"], tuple(question.get("frames", ()))), []).append(test)
+    return [questions[start:start + questions_per_request] for questions in groups.values()
+            for start in range(0, len(questions), questions_per_request)]
+
+
+def parse_answers(response: str, count: int) -> list[str]:
+    """Answers of a request with count questions, numbered "1: ..." lines if there is more than one."""
+    if count == 1:
+        return [parse_model_response(response)]
+    answers = numbered_answers(response)
+    return [parse_model_response(answers.get(i + 1, "")) for i in range(count)]
+
+
+async def generate_model_response(client: CompletionClient, data_urls: list[str] | None, prompt: ModuleType,
+                                  user_text: str, model_name="qwen/qwen3-vl-8b-instruct", questions: int = 1):
+    messages = build_messages(prompt, data_urls, user_text)
+    current_prompt.set(prompt_name(prompt))
+    answer = await client.complete(prompt, messages, questions, model=model_name)
+    test_log.debug(f"{current_case.get()}: Model Response: {answer}")
+    return answer
+
+
+async def evaluate_event(client: CompletionClient, questions: list[Path], prompt: ModuleType, variant: str,
+                         model_name: str, payloads: FramePayloads, frame_options: dict) -> dict:
+    """Ask one or more questions about the same level and frames in one request."""
+    parsed = [read_question(test) for test in questions]
+    level_path = parsed[0]["level_path"]
+    if variant == "text":
+        data_urls, stats = None, {}
+        context = scene_text(load_scene(level_path))
+    else:
+        frames = question_frames(parsed[0])
+        if not frames:
+            raise FileNotFoundError(f"No frames found in {level_path}")
+        # every question about these frames gets the same encoded images
+        data_urls, stats = await payloads.get(frames, **frame_options)
+        context = ""
+    if len(parsed) == 1:
+        question_text = parsed[0]["task_description"]
+    else:
+        question_text = "Answer every question on its own line as <number>: <answer>.\n" + "\n".join(
+            f"{i + 1}: {question['task_description']}" for i, question in enumerate(parsed))
+    user_text = "\n\n".join(text for text in (context, question_text) if text)
+    raw_response = await generate_model_response(client, data_urls, prompt, user_text, model_name, len(parsed)) or ""
+    answers = parse_answers(raw_response, len(parsed))
+
+    results = []
+    for test, question, answer in zip(questions, parsed, answers):
+        score = answer == parse_model_response(str(question["solution"]))
+        test_log.debug(f"{case_id(test)}: Ground Truth: {question['solution']}, Parsed Response: {answer}, "
+                       f"Score: {score}")
+        results.append({
+            "case_id": case_id(test),
+            "model": model_name,
+            "ground_truth": question["solution"],
+            "raw_response": raw_response,
+            "response": answer,
+            "score": score,
+            "correct": score,
+            "target": question["solution"],
+            "image_budget": image_budget_name(frame_options),
+            "frames_sent": stats.get("frames_sent", 0),
+        })
+    return {
+        "case_id": case_id(questions[0]),
+        "model": model_name,
+        "questions": results,
+        "image_bytes": sum(len(data_url) for data_url in data_urls or []),
+        # every frame sent as its own image, once per question
+        "frames_bytes": stats.get("frames_bytes", 0) * len(questions),
+    }
+
+
+def calculate_benchmark_results(results: list[dict]) -> dict:
+    """Accuracy with 95% confidence intervals per model and image budget."""
+    return aggregate_results(results)
+
+
+async def main(args):
+    configure_test_log(args.verbose)
+    tests = discover_tests(args.input, suffixes=(".json", ".py"))
+    if not tests:
+        raise FileNotFoundError(f"No test with .json and .py files found for input: {args.input}")
+    if args.shard:
+        num_tests = len(tests)
+        tests = select_shard(tests, args.shard)
+        print(f"Shard {args.shard}: {len(tests)} of {num_tests} tests")
+    prompt = EVENT_PROMPTS[args.task][args.variant]
+    groups = group_questions(tests, args.questions_per_request)
+    group_of = {case_id(questions[0]): questions for questions in groups}
+
+    cache = cache_from_args(args)
+    scheduler = scheduler_from_args(args)
+    telemetry = telemetry_from_args(args)
+    # retries are handled by the scheduler, which also honours Retry-After
+    client = CompletionClient(create_async_client(get_api_key(), base_url=args.base_url, max_retries=0), cache,
+                              scheduler, telemetry, contracts_from_args(args))
+    models = args.models or [args.model]
+    image_executor = None
+    if args.image_workers and args.variant == "visual":
+        image_executor = create_image_executor(args.image_workers)
+    payloads = FramePayloads(image_executor)
+    group_results = []
+    results = []
+    for image_budget in args.image_budgets:
+        frame_options = {"montage": parse_montage(args.montage), "max_frames": args.max_frames,
+                         "dedup_threshold": args.dedup_threshold, "grid_size": 28, "image_format": args.image_format,
+                         "quality": args.image_quality, **parse_image_budget(image_budget)}
+        current_variant.set(image_budget_name(frame_options))
+        batch_results = await run_batch(
+            [questions[0] for questions in groups],
+            lambda test, model, frame_options=frame_options: evaluate_event(
+                client, group_of[case_id(test)], prompt, args.variant, model, payloads, frame_options),
+            models, concurrency=args.concurrency, image_budget=image_budget_name(frame_options))
+        group_results += batch_results
+        for group_result in batch_results:
+            if "questions" in group_result:
+                results += group_result["questions"]
+            else:
+                # the request of the group failed, so did all of its questions
+                results += [{"case_id": case_id(test), "model": group_result["model"], "error": group_result["error"],
+                             "image_budget": group_result["image_budget"]}
+                            for test in group_of[group_result["case_id"]]]
+    await client.close()
+    scheduler.print_stats()
+    client.contracts.print_stats()
+    release_image_executor(image_executor)
+    if cache.mode != "off":
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+
+    image_bytes = sum(result.get("image_bytes", 0) for result in group_results)
+    frames_bytes = sum(result.get("frames_bytes", 0) for result in group_results)
+    requests = sum("questions" in result for result in group_results)
+    questions = sum(len(result["questions"]) for result in group_results if "questions" in result)
+    print(f"{requests} requests for {questions} questions ({questions / max(requests, 1):.1f} questions per request)")
+    if args.variant == "visual":
+        print(f"{image_bytes / 1e6:.2f} MB of images uploaded instead of {frames_bytes / 1e6:.2f} MB with every frame "
+              f"sent for every question, frames encoded {payloads.encoded} times and reused {payloads.reused} times")
+    if args.output:
+        write_results(results, Path(args.output))
+    print_aggregates(calculate_benchmark_results(results))
+    report = telemetry.report(results)
+    print_report(report)
+    if args.report:
+        write_report(report, Path(args.report))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark Event Model Evaluation")
+    parser.add_argument("--input", required=True, type=str, metavar="FILE|DIR|GLOB",
+                        help="Event test with .py and .json files, or a directory / glob pattern of such tests. "
+                             "See read_question for the format.")
+    parser.add_argument("--task", choices=list(EVENT_PROMPTS), default="cause_ident")
+    parser.add_argument("--variant", choices=VARIANTS, default="visual",
+                        help="visual: send the frames of the simulation, text: send the parts of the level as text.")
+    parser.add_argument("--shard", type=str, metavar="i/N",
+                        help="Only run the i-th of N disjoint slices of the tests (0 <= i < N).")
+    parser.add_argument("--model", type=str, default="qwen/qwen3-vl-235b-a22b-instruct",
+                        help="Model name at the provider.")
+    parser.add_argument("--models", nargs="+", type=str, metavar="MODEL",
+                        help="Evaluate several models side by side, overrides --model.")
+    parser.add_argument("--base-url", type=str, default="https://openrouter.ai/api/v1",
+                        help="OpenAI-compatible endpoint, e.g. http://127.0.0.1:8000/v1 for mock_server.py.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of requests in flight per model.")
+    parser.add_argument("--questions-per-request", type=int, default=1,
+                        help="Ask up to this many questions about the same level and frames in one request.")
+    parser.add_argument("--montage", type=str, metavar="COLSxROWS", default="2x2",
+                        help="Tile this many frames into one image, 1x1 sends every frame on its own.")
+    parser.add_argument("--max-frames", type=int, default=8, help="Frames sent per event, evenly spaced, 0 sends all.")
+    parser.add_argument("--dedup-threshold", type=float, default=2.0,
+                        help="Drop frames whose grey thumbnail differs from the previous kept frame by less than "
+                             "this mean absolute difference (0-255), 0 keeps every frame.")
+    parser.add_argument("--output", type=str, metavar="FILE", help="Write one JSON result per question to this file.")
+    add_cache_arguments(parser)
+    add_scheduler_arguments(parser)
+    add_telemetry_arguments(parser)
+    add_image_arguments(parser)
+    add_contract_arguments(parser)
+    add_verbose_argument(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(main(args))
@@ -1,11 +1,22 @@
+import asyncio
 import json
 from pathlib import Path
-from pprint import pprint
-from openai import OpenAI
+from types import ModuleType
 import argparse
-from utils import get_api_key, encode_image, pad_image
+from dataset_shards import ShardDataset, is_shard_input, open_dataset
+from batch_runner import CompletionClient, create_async_client, run_batch, write_results
+from response_cache import add_cache_arguments, cache_from_args
+from scheduler import add_scheduler_arguments, scheduler_from_args
+from prompts import build_messages, prompt_name
+from output_contracts import add_contract_arguments, contracts_from_args, extract_json, parse_click_point, part_matcher
+from telemetry import add_telemetry_arguments, current_case, current_prompt, current_variant, print_report, telemetry_from_args, write_report
+from scene_index import SceneIndex
+from results_store import add_store_arguments, aggregate_results, print_aggregates, store_from_args
+from utils import ImageTransform, get_api_key, load_image_payload, add_image_arguments, add_verbose_argument, configure_test_log, create_image_executor, release_image_executor, discover_tests, case_id, select_shard, parse_image_budget, image_budget_name, test_log
 
-from benchmark1_grounding.system_prompts.ui_tars_1_5_7B_single_bbox import SYSTEM_PROMPT
+from benchmark1_grounding.system_prompts import ui_tars_1_5_7B_single_bbox as ui_tars_prompt
+from benchmark1_grounding.system_prompts import qwen3vl_single_bbox as single_bbox_prompt
+from benchmark1_grounding.system_prompts import qwen3vl_multi_bbox as multi_bbox_prompt
 
 def parse_ground_truth(json_path:Path) -> str:
     '''Example:
@@ -59,6 +70,10 @@ def parse_ground_truth_bbox(json_path:Path) -> tuple[str|None, list[int]]:
     # example converts to: {"bbox": [186, 108, 218, 140], "label": "BASKETBALL"}
     with open(json_path, "r") as f:
         data = json.load(f)
+    return scene_ground_truth_bbox(data)
+
+def scene_ground_truth_bbox(data:dict) -> tuple[str|None, list[int]]:
+    # same as parse_ground_truth_bbox for an already loaded scene, e.g. from a dataset shard
     parts = data.get("parts", [])
     if not parts:
         return (None, [])
@@ -76,81 +91,115 @@ def parse_ground_truth_bbox(json_path:Path) -> tuple[str|None, list[int]]:
     y_max = y_min + height
     return (part_type, [x_min, y_min, x_max, y_max])
 
-def generate_model_response(image_path:Path, api_key:str, additional_user_prompt="", model_name="qwen/qwen3-vl-8b-instruct", base_url="https://openrouter.ai/api/v1"):
-    client = OpenAI(api_key=api_key, base_url=base_url)
-    base64_image = encode_image(pad_image(image_path, 28))
-    data_url = f"data:image/jpeg;base64,{base64_image}"
-    user_prompt = []
-    if additional_user_prompt:
-        user_prompt.append({"type": "text", "text": additional_user_prompt})
-    user_prompt.append({
-        "type": "image_url",
-        "image_url": {
-            "url": data_url
-        }
-    })
-    messages = [
-        {
-            "role": "system",
-            "content": SYSTEM_PROMPT
-        },
-        {
-            "role": "user",
-            "content": user_prompt
-        }
-    ]
-    response = client.chat.completions.create(model=model_name, messages=messages, temperature=0.1)
-    part_name = response.choices[0].message.content
-    pprint(response.model_dump())
-    print(f"Model Response: {part_name}")
+def parse_ground_truth_bboxes(json_path:Path) -> list[tuple[str, list[int]]]:
+    # all parts of the scene, e.g. [("BASKETBALL", [186, 108, 218, 140]), ...]
+    with open(json_path, "r") as f:
+        data = json.load(f)
+    return scene_ground_truth_bboxes(data)
+
+def scene_ground_truth_bboxes(data:dict) -> list[tuple[str, list[int]]]:
+    boxes = []
+    for part in data.get("parts", []):
+        part_type = part.get("part_type")
+        position = part.get("position", {})
+        size = part.get("size", {})
+        x_min, y_min = position.get("x"), position.get("y")
+        width, height = size.get("width_1"), size.get("height_1")
+        if part_type is None or None in (x_min, y_min, width, height):
+            continue
+        boxes.append((part_type, [x_min, y_min, x_min + width, y_min + height]))
+    return boxes
+
+async def generate_model_response(client:CompletionClient, data_url:str, additional_user_prompt="", model_name="qwen/qwen3-vl-8b-instruct", prompt:ModuleType=ui_tars_prompt, targets:int|None=1):
+    messages = build_messages(prompt, data_url, additional_user_prompt)
+    current_prompt.set(prompt_name(prompt))
+    # targets: objects asked for, sizes max_tokens of the output contract
+    part_name = await client.complete(prompt, messages, targets, model=model_name, temperature=0.1)
+    test_log.debug(f"{current_case.get()}: Model Response: {part_name}")
     return part_name
 
 def parse_model_response(response: str):
     return response.strip()
 
-def parse_model_response_bbox(response: str) -> tuple[str|None, list[int]]:
+def normalized_bbox_to_pixels(bbox: list[float], transform:ImageTransform|None=None) -> list[int]:
+    if transform is not None:
+        # normalized to the image that was sent, undo padding, scaling and cropping
+        x_min, y_min = transform.normalized_to_original(bbox[0], bbox[1])
+        x_max, y_max = transform.normalized_to_original(bbox[2], bbox[3])
+        return [round(x_min), round(y_min), round(x_max), round(y_max)]
     PNG_WIDTH = 640
     PNG_HEIGHT = 441
+    # Convert normalized coordinates (0-1000) to absolute pixels
+    x_min, y_min, x_max, y_max = bbox
+    x_min_px = int((x_min / 1000.0) * PNG_WIDTH)
+    y_min_px = int((y_min / 1000.0) * PNG_HEIGHT)
+    x_max_px = int((x_max / 1000.0) * PNG_WIDTH)
+    y_max_px = int((y_max / 1000.0) * PNG_HEIGHT)
+    return [x_min_px, y_min_px, x_max_px, y_max_px]
+
+def canonical_label(label: str, targets:tuple[str, ...]=()) -> str:
+    # "Bowling Ball" -> BOWLING_BALL, the requested targets count as names even if they are not in the catalog
+    return part_matcher(targets).match(label)[0] or label
+
+def parse_model_response_bbox(response: str, transform:ImageTransform|None=None, targets:tuple[str, ...]=()) -> tuple[str|None, list[int]]:
     response_text = response.strip()
     try:
-        bbox_data = json.loads(response_text)
+        bbox_data = extract_json(response_text)
+        if not isinstance(bbox_data, dict):
+            test_log.debug(f"{current_case.get()}: Invalid bounding box format.")
+            return (None, [])
         bbox = bbox_data.get("bbox")
         if bbox is None:
-            print("No bowlingball detected.")
+            test_log.debug(f"{current_case.get()}: No bowlingball detected.")
             return (None, [])
         if not isinstance(bbox, list) or len(bbox) != 4:
             raise ValueError("Invalid bounding box format.")
         
         label = bbox_data.get("label")
         if not label:
-            print("No label given.")
+            test_log.debug(f"{current_case.get()}: No label given.")
             return (None, [])
         
-        # Convert normalized coordinates (0-1000) to absolute pixels
-        x_min, y_min, x_max, y_max = bbox
-        x_min_px = int((x_min / 1000.0) * PNG_WIDTH)
-        y_min_px = int((y_min / 1000.0) * PNG_HEIGHT)
-        x_max_px = int((x_max / 1000.0) * PNG_WIDTH)
-        y_max_px = int((y_max / 1000.0) * PNG_HEIGHT)
-        
-        return (label, [x_min_px, y_min_px, x_max_px, y_max_px])
+        return (canonical_label(label, targets), normalized_bbox_to_pixels(bbox, transform))
     except json.JSONDecodeError:
-        print("Failed to parse JSON from model response.")
-        print("Raw response:", response_text)
+        test_log.debug(f"{current_case.get()}: Failed to parse JSON from model response: {response_text}")
         return (None, [])
 
-def parse_model_response_uitars(response: str) -> tuple[int, int]:
+def parse_model_response_bboxes(response: str, transform:ImageTransform|None=None, targets:tuple[str, ...]=()) -> list[tuple[str, list[int]]]:
+    # example: [{"bbox": [290, 245, 340, 317], "label": "BASKETBALL"}, ...]
     response_text = response.strip()
-    for line in response_text.splitlines():
-        if line.startswith("Action:"):
-            # regex Action: click(start_box='(230,131)')
-            import re
-            match = re.search(r"click\(.*='\(\s*(\d+)\s*,\s*(\d+)\s*\)'", line)
-            if match:
-                x = int(match.group(1))
-                y = int(match.group(2))
-                return (x, y)
-    return (-1, -1)
+    try:
+        bbox_data = extract_json(response_text)
+    except json.JSONDecodeError:
+        test_log.debug(f"{current_case.get()}: Failed to parse JSON from model response: {response_text}")
+        return []
+    if isinstance(bbox_data, dict):
+        # {"objects": [...]} of the JSON schema, or a single object
+        bbox_data = bbox_data["objects"] if isinstance(bbox_data.get("objects"), list) else [bbox_data]
+    if not isinstance(bbox_data, list):
+        test_log.debug(f"{current_case.get()}: Invalid bounding box list format.")
+        return []
+    boxes = []
+    for item in bbox_data:
+        if not isinstance(item, dict):
+            continue
+        bbox = item.get("bbox")
+        label = item.get("label")
+        if not label or not isinstance(bbox, list) or len(bbox) != 4:
+            continue
+        boxes.append((canonical_label(label, targets), normalized_bbox_to_pixels(bbox, transform)))
+    return boxes
+
+def parse_model_response_uitars(response: str, transform:ImageTransform|None=None) -> tuple[int, int]:
+    # Action: click(start_box='(230,131)') or click(point='<point>230 131</point>')
+    point = parse_click_point(response.strip())
+    if point is None:
+        return (-1, -1)
+    x, y = point
+    if transform is not None:
+        # pixels of the sent image, map back to the original screenshot
+        x, y = (round(value) for value in transform.to_original(x, y))
+    return (x, y)
 
 def evaluate_response(ground_truth: str, response: str):
     return ground_truth == response
@@ -173,42 +222,211 @@ def evaluate_response_bbox(ground_truth: tuple[str|None, list[int]], response: t
     iou = interArea / float(boxAArea + boxBArea - interArea)
     return iou
 
+def evaluate_response_bboxes(ground_truth: list[tuple[str, list[int]]], response: list[tuple[str, list[int]]]) -> float:
+    # mean IoU over all ground truth objects after optimal matching, missed objects count as 0
+    if not ground_truth:
+        return 0.0
+    if not response:
+        return 0.0
+    # scoring imports numpy, which is only needed once multi_bbox responses are scored
+    from scoring import match_boxes
+
+    _, _, ious = match_boxes([label for label, _ in response], [bbox for _, bbox in response],
+                             [label for label, _ in ground_truth], [bbox for _, bbox in ground_truth],
+                             iou_threshold=0.0, method="hungarian")
+    return float(ious.sum()) / len(ground_truth)
+
 def evaluate_response_point(ground_truth: tuple[int, int], response: tuple[int, int]):
     gt_x, gt_y = ground_truth
     resp_x, resp_y = response
     distance = ((gt_x - resp_x) ** 2 + (gt_y - resp_y) ** 2) ** 0.5
     return distance
 
-def calculate_benchmark_results():
-    pass
-    
-    
-if __name__ == "__main__":
-    parser = argparse.ArgumentParser(description="Benchmark Grounding Model Evaluation")
-    parser.add_argument("--input", required=True, type=str, metavar="FILE", help="Path to the input test that expects .PNG and .json files.")
-
-    args = parser.parse_args()
+def calculate_benchmark_results(results: list[dict]) -> dict:
+    """Accuracy, mean IoU and click distance with 95% confidence intervals per model and image budget."""
+    return aggregate_results(results)
 
-    input_png = Path(args.input).with_suffix(".png")
-    if not input_png.exists():
-        raise FileNotFoundError(f"Input image file not found: {input_png}")
-    input_json = Path(args.input).with_suffix(".json")
-    if not input_json.exists():
-        raise FileNotFoundError(f"Input JSON file not found: {input_json}")
 
-    API_KEY = get_api_key()
+async def evaluate_test(client:CompletionClient, test:Path, model_name:str, image_options:dict|None=None, scene_index:SceneIndex|None=None, dataset:ShardDataset|None=None) -> dict:
+    input_png = test.with_suffix(".png")
+    input_json = test.with_suffix(".json")
+    if dataset is not None:
+        data_url, transform = await dataset.payload(case_id(test), grid_size=28, **(image_options or {}))
+    else:
+        data_url, transform = await load_image_payload(input_png, grid_size=28, **(image_options or {}))
 
     # ground_truth = parse_ground_truth(input_json)
-    ground_truth_bbox = parse_ground_truth_bbox(input_json)
-    # response = generate_model_response(input_png, model_name="qwen/qwen3-vl-30b-a3b-instruct") or ""
-    # response = generate_model_response(input_png, api_key=API_KEY, model_name="qwen/qwen3-vl-235b-a22b-instruct") or ""
-    # response_bbox = generate_model_response(input_png, api_key=API_KEY, additional_user_prompt=ground_truth_bbox[0], model_name="qwen/qwen3-vl-235b-a22b-instruct") or ""
+    if scene_index is not None:
+        ground_truth_bbox = scene_index.ground_truth_bbox(case_id(test))
+    elif dataset is not None:
+        ground_truth_bbox = scene_ground_truth_bbox(dataset.scene(case_id(test)))
+    else:
+        ground_truth_bbox = parse_ground_truth_bbox(input_json)
+    # response = await generate_model_response(client, data_url, model_name="qwen/qwen3-vl-30b-a3b-instruct") or ""
+    # response_bbox = await generate_model_response(client, data_url, additional_user_prompt=ground_truth_bbox[0], model_name="qwen/qwen3-vl-235b-a22b-instruct") or ""
     additional_user_prompt = f"Click the {ground_truth_bbox[0].lower()}" if ground_truth_bbox[0] else "Click the object"
-    response_bbox = generate_model_response(input_png, api_key=API_KEY, additional_user_prompt=additional_user_prompt, model_name="bytedance/ui-tars-1.5-7b") or ""
-    # response_bbox = parse_model_response_bbox(response_bbox)
-    response_bbox = parse_model_response_uitars(response_bbox)
+    raw_response = await generate_model_response(client, data_url, additional_user_prompt=additional_user_prompt, model_name=model_name) or ""
+    # response_bbox = parse_model_response_bbox(raw_response)
+    response_bbox = parse_model_response_uitars(raw_response, transform)
     # score = evaluate_response_bbox(ground_truth_bbox, response_bbox)
     score = evaluate_response_point(((ground_truth_bbox[1][0] + ground_truth_bbox[1][2]) // 2, (ground_truth_bbox[1][1] + ground_truth_bbox[1][3]) // 2), response_bbox)
-    print(f"Ground Truth: {ground_truth_bbox}")
-    print(f"Response: {response_bbox}")
-    print(f"Evaluation Score: {score}")
+    test_log.debug(f"{case_id(test)}: Ground Truth: {ground_truth_bbox}, Response: {response_bbox}, Evaluation Score: {score}")
+    return {
+        "case_id": case_id(test),
+        "model": model_name,
+        "ground_truth": ground_truth_bbox,
+        "raw_response": raw_response,
+        "response": response_bbox,
+        "score": score,
+        "click_distance": score,
+        "target": ground_truth_bbox[0],
+        # the click counts as correct if it lands inside the ground truth box
+        "correct": bool(ground_truth_bbox[1]) and ground_truth_bbox[1][0] <= response_bbox[0] <= ground_truth_bbox[1][2]
+                   and ground_truth_bbox[1][1] <= response_bbox[1] <= ground_truth_bbox[1][3],
+        "image_budget": image_budget_name(image_options),
+        "image_tokens": transform.image_tokens,
+    }
+
+
+async def evaluate_test_multi(client:CompletionClient, test:Path, model_name:str, image_options:dict|None=None, scene_index:SceneIndex|None=None, all_objects:bool=False, dataset:ShardDataset|None=None) -> dict:
+    input_png = test.with_suffix(".png")
+    if dataset is not None:
+        data_url, transform = await dataset.payload(case_id(test), grid_size=28, **(image_options or {}))
+    else:
+        data_url, transform = await load_image_payload(input_png, grid_size=28, **(image_options or {}))
+    if scene_index is not None:
+        ground_truth_bboxes = scene_index.ground_truth_bboxes(case_id(test))
+    elif dataset is not None:
+        ground_truth_bboxes = scene_ground_truth_bboxes(dataset.scene(case_id(test)))
+    else:
+        ground_truth_bboxes = parse_ground_truth_bboxes(test.with_suffix(".json"))
+
+    # one request for all targets instead of one request per object
+    targets = [label for label, _ in ground_truth_bboxes]
+    additional_user_prompt = "Detect all objects." if all_objects else f"Detect: {', '.join(targets)}"
+    raw_response = await generate_model_response(client, data_url, additional_user_prompt=additional_user_prompt, model_name=model_name, prompt=multi_bbox_prompt, targets=None if all_objects else len(targets)) or ""
+    response_bboxes = parse_model_response_bboxes(raw_response, transform, tuple(sorted(set(targets))))
+    requests = 1
+
+    # fall back to single object requests only for targets missing in the array
+    missing = list(targets)
+    for label, _ in response_bboxes:
+        if label in missing:
+            missing.remove(label)
+    for label in missing:
+        fallback_response = await generate_model_response(client, data_url, additional_user_prompt=label, model_name=model_name, prompt=single_bbox_prompt) or ""
+        requests += 1
+        fallback_bbox = parse_model_response_bbox(fallback_response, transform, (label,))
+        if fallback_bbox[0] is not None:
+            response_bboxes.append(fallback_bbox)
+
+    score = evaluate_response_bboxes(ground_truth_bboxes, response_bboxes)
+    test_log.debug(f"{case_id(test)}: Ground Truth: {ground_truth_bboxes}, Response: {response_bboxes}, "
+                   f"Evaluation Score: {score} ({requests} requests for {len(targets)} objects)")
+    return {
+        "case_id": case_id(test),
+        "model": model_name,
+        "ground_truth": ground_truth_bboxes,
+        "raw_response": raw_response,
+        "response": response_bboxes,
+        "score": score,
+        "iou": score,
+        "correct": score >= 0.5,
+        "requests": requests,
+        "image_bytes": len(data_url) * requests,
+        "image_budget": image_budget_name(image_options),
+        "image_tokens": transform.image_tokens,
+    }
+
+
+async def main(args):
+    configure_test_log(args.verbose)
+    scene_index = SceneIndex(Path(args.index)) if args.index else None
+    dataset = open_dataset(args.input) if is_shard_input(args.input) else None
+    if dataset is not None:
+        tests = dataset.tests()
+    elif scene_index is not None:
+        tests = discover_tests(args.input, suffixes=(".png",))
+    else:
+        tests = discover_tests(args.input, suffixes=(".png", ".json"))
+    if not tests:
+        raise FileNotFoundError(f"No test with .png and .json files found for input: {args.input}")
+    if scene_index is not None:
+        # the index only holds the scenes it was built from, see the case ids in the README
+        num_tests, first_test = len(tests), tests[0]
+        tests = [test for test in tests if case_id(test) in scene_index]
+        if not tests:
+            raise ValueError(f"None of the {num_tests} tests of {args.input} is in the scene index {args.index}, e.g. "
+                             f"{case_id(first_test)}. Build the index from the directory that is passed as --input.")
+        if len(tests) < num_tests:
+            print(f"Skipping {num_tests - len(tests)} of {num_tests} tests that are not in the scene index {args.index}")
+    if args.shard:
+        num_tests = len(tests)
+        tests = select_shard(tests, args.shard)
+        print(f"Shard {args.shard}: {len(tests)} of {num_tests} tests")
+
+    # a resumed run is checked before anything is sent
+    store, run_id = store_from_args(args, {"pipeline": "grounding", "mode": args.mode,
+                                           "all_objects": args.mode == "multi_bbox" and args.all_objects})
+    cache = cache_from_args(args)
+    scheduler = scheduler_from_args(args)
+    telemetry = telemetry_from_args(args)
+    # retries are handled by the scheduler, which also honours Retry-After
+    client = CompletionClient(create_async_client(get_api_key(), base_url=args.base_url, max_retries=0), cache, scheduler, telemetry, contracts_from_args(args))
+    models = args.models or [args.model]
+    image_executor = create_image_executor(args.image_workers) if args.image_workers and len(tests) > 1 else None
+    results = []
+    # one pass over all tests per image budget, to compare image tokens against accuracy
+    for image_budget in args.image_budgets:
+        image_options = {"image_format": args.image_format, "quality": args.image_quality, "executor": image_executor, **parse_image_budget(image_budget)}
+        current_variant.set(image_budget_name(image_options))
+        if args.mode == "multi_bbox":
+            evaluate = lambda test, model, image_options=image_options: evaluate_test_multi(client, test, model, image_options, scene_index, args.all_objects, dataset)
+        else:
+            evaluate = lambda test, model, image_options=image_options: evaluate_test(client, test, model, image_options, scene_index, dataset)
+        if store is not None:
+            # finished tests of an interrupted run are taken from the store instead of being sent again
+            evaluate = store.checkpointed(run_id, image_budget_name(image_options), evaluate)
+        results += await run_batch(tests, evaluate, models, concurrency=args.concurrency, image_budget=image_budget_name(image_options))
+    await client.close()
+    scheduler.print_stats()
+    client.contracts.print_stats()
+    release_image_executor(image_executor)
+    if cache.mode != "off":
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+    if store is not None:
+        store.close()
+    if args.output:
+        write_results(results, Path(args.output))
+    print_aggregates(calculate_benchmark_results(results))
+    report = telemetry.report(results)
+    print_report(report)
+    if args.report:
+        write_report(report, Path(args.report))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark Grounding Model Evaluation")
+    parser.add_argument("--input", required=True, type=str, metavar="FILE|DIR|GLOB", help="Path to the input test that expects .PNG and .json files, a directory / glob pattern of such tests, or packed .shard files (see dataset_shards.py).")
+    parser.add_argument("--mode", choices=["click", "multi_bbox"], default="click", help="click: one UI-TARS click per test, multi_bbox: all objects of a scene in one request.")
+    parser.add_argument("--all-objects", action="store_true", help="multi_bbox: ask for all visible objects instead of the ground truth targets.")
+    parser.add_argument("--model", type=str, default="bytedance/ui-tars-1.5-7b", help="Model name at the provider.")
+    parser.add_argument("--models", nargs="+", type=str, metavar="MODEL", help="Evaluate several models side by side, overrides --model.")
+    parser.add_argument("--base-url", type=str, default="https://openrouter.ai/api/v1", help="OpenAI-compatible endpoint, e.g. http://127.0.0.1:8000/v1 for mock_server.py.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of tests in flight per model.")
+    parser.add_argument("--output", type=str, metavar="FILE", help="Write one JSON result per test to this file.")
+    parser.add_argument("--shard", type=str, metavar="i/N", help="Only run the i-th of N disjoint slices of the tests (0 <= i < N), e.g. one slice per machine. Combine the outputs with merge_results.py.")
+    parser.add_argument("--index", type=str, metavar="FILE", help="Scene index from `python scene_index.py build`, replaces reading the .json ground truth per test.")
+    add_cache_arguments(parser)
+    add_store_arguments(parser)
+    add_scheduler_arguments(parser)
+    add_telemetry_arguments(parser)
+    add_image_arguments(parser)
+    add_contract_arguments(parser)
+    add_verbose_argument(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(main(args))
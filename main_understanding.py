@@ -1,29 +1,37 @@
-import base64
+import asyncio
 import json
 from pathlib import Path
-from openai import OpenAI
 import argparse
+from types import ModuleType
 from typing import List
-import os
 
-from benchmark2_understanding.system_prompts.qwen3vl_object_property_ident_with_instruct import \
-    SYSTEM_PROMPT as SYSTEM_PROMPT_WITH
-from benchmark2_understanding.system_prompts.qwen3vl_object_property_ident_without_instruct import \
-    SYSTEM_PROMPT as SYSTEM_PROMPT_WITHOUT
-from benchmark2_understanding.system_prompts.qwen3vl_object_state_ident import \
-    SYSTEM_PROMPT as SYSTEM_PROMPT_STATE_IDENT
-from utils import get_api_key, encode_image
+from benchmark2_understanding.system_prompts import qwen3vl_object_property_ident_with_instruct as with_instruct_prompt
+from benchmark2_understanding.system_prompts import \
+    qwen3vl_object_property_ident_without_instruct as without_instruct_prompt
+from benchmark2_understanding.system_prompts import qwen3vl_object_state_ident as state_ident_prompt
+from dataset_shards import ShardDataset, is_shard_input, open_dataset
+from batch_runner import CompletionClient, create_async_client, run_batch, write_results
+from response_cache import add_cache_arguments, cache_from_args
+from scheduler import add_scheduler_arguments, scheduler_from_args
+from prompts import build_messages, prompt_name, read_task_description
+from output_contracts import add_contract_arguments, answer_text, contracts_from_args, part_matcher
+from results_store import add_store_arguments, aggregate_results, print_aggregates, store_from_args
+from telemetry import add_telemetry_arguments, current_case, current_prompt, current_variant, print_report, \
+    telemetry_from_args, write_report
+from utils import get_api_key, load_image_payload, add_image_arguments, add_verbose_argument, configure_test_log, \
+    create_image_executor, release_image_executor, discover_tests, case_id, select_shard, parse_image_budget, \
+    image_budget_name, test_log
 
 allowed_categories = ["with_instruct", "without_instruct", "state_ident"]
 
 
-def get_system_prompt(input_category: List[str]):
+def get_system_prompt(input_category: List[str]) -> ModuleType:
     if input_category == allowed_categories[0]:
-        return SYSTEM_PROMPT_WITH
+        return with_instruct_prompt
     elif input_category == allowed_categories[1]:
-        return SYSTEM_PROMPT_WITHOUT
+        return without_instruct_prompt
     else:
-        return SYSTEM_PROMPT_STATE_IDENT
+        return state_ident_prompt
 
 
 def parse_ground_truth(json_path: Path) -> str:
@@ -69,37 +77,23 @@ which converts to: BASKETBALL
     return data["solution"]
 
 
-def generate_model_response(image_path: Path, api_key: str, SYSTEM_PROMPT: str, instruct_prompt: str,
-                            model_name="qwen/qwen3-vl-8b-instruct",
-                            base_url="https://openrouter.ai/api/v1"):
-    client = OpenAI(api_key=api_key, base_url=base_url)
-    base64_image = encode_image(image_path)
-    data_url = f"data:image/jpeg;base64,{base64_image}"
-    messages = [
-        {
-            "role": "system",
-            "content": SYSTEM_PROMPT + instruct_prompt
-        },
-        {
-            "role": "user",
-            "content": [
-                {
-                    "type": "image_url",
-                    "image_url": {
-                        "url": data_url
-                    }
-                }
-            ]
-        }
-    ]
-    response = client.chat.completions.create(model=model_name, messages=messages)
-    part_name = response.choices[0].message.content
-    print(f"Model Response: {part_name}")
+async def generate_model_response(client: CompletionClient, data_url: str, prompt: ModuleType, task_description: str,
+                                  model_name="qwen/qwen3-vl-8b-instruct"):
+    # the task description of the test goes after the static prompt, see prompts.build_messages
+    messages = build_messages(prompt, data_url, task_description)
+    current_prompt.set(prompt_name(prompt))
+    part_name = await client.complete(prompt, messages, model=model_name)
+    test_log.debug(f"{current_case.get()}: Model Response: {part_name}")
     return part_name
 
 
 def parse_model_response(response: str):
-    normalized_response = response.upper().replace(" ", "_")
+    # canonical part name if the answer names one ("Bowling Ball" -> BOWLING_BALL), e.g. yes / no otherwise
+    answer = answer_text(response)
+    part, _ = part_matcher().match(answer)
+    if part is not None:
+        return part
+    normalized_response = answer.upper().replace(" ", "_")
 
     return normalized_response.strip()
 
@@ -108,17 +102,114 @@ def evaluate_response(ground_truth: str, response: str):
     return ground_truth == response
 
 
-def calculate_benchmark_results():
-    pass
+def calculate_benchmark_results(results: list[dict]) -> dict:
+    """Accuracy with 95% confidence intervals per model and image budget."""
+    return aggregate_results(results)
 
 
-if __name__ == "__main__":
-    allowed_categories = ["with_instruct", "without_instruct", "state_ident"]
+async def evaluate_test(client: CompletionClient, test: Path, prompt: ModuleType, model_name: str,
+                        image_options: dict | None = None, dataset: ShardDataset | None = None) -> dict:
+    input_png = test.with_suffix(".png")
+    input_json = test.with_suffix(".json")
+    # understanding tests send the screenshot unpadded
+    if dataset is not None:
+        data_url, transform = await dataset.payload(case_id(test), grid_size=None, **(image_options or {}))
+        task_description = dataset.task_description(case_id(test))
+        ground_truth = dataset.scene(case_id(test))["solution"]
+    else:
+        data_url, transform = await load_image_payload(input_png, grid_size=None, **(image_options or {}))
+        task_description = read_task_description(test.with_suffix(".py"))
+        ground_truth = parse_ground_truth(input_json)
+    raw_response = await generate_model_response(client, data_url, prompt=prompt,
+                                                 task_description=task_description,
+                                                 model_name=model_name) or ""
+    response = parse_model_response(raw_response)
+    score = evaluate_response(ground_truth, response)
+    test_log.debug(f"{case_id(test)}: Ground Truth: {ground_truth}, Parsed Response: {response}, "
+                   f"Evaluation Score: {score}")
+    return {
+        "case_id": case_id(test),
+        "model": model_name,
+        "ground_truth": ground_truth,
+        "raw_response": raw_response,
+        "response": response,
+        "score": score,
+        "correct": score,
+        "target": ground_truth,
+        "image_budget": image_budget_name(image_options),
+        "image_tokens": transform.image_tokens,
+    }
+
 
-    parser = argparse.ArgumentParser(description="Benchmark Grounding Model Evaluation")
-    parser.add_argument("--input", required=True, type=str, metavar="FILE",
-                        help="Path to the input test that expects .PNG, .py and .json files.",
+async def main(args):
+    configure_test_log(args.verbose)
+    dataset = open_dataset(args.input) if is_shard_input(args.input) else None
+    if dataset is not None:
+        tests = dataset.tests(with_task_description=True)
+    else:
+        tests = discover_tests(args.input, suffixes=(".png", ".json", ".py"))
+    if not tests:
+        raise FileNotFoundError(f"No test with .png, .json and .py files found for input: {args.input}")
+    if args.shard:
+        num_tests = len(tests)
+        tests = select_shard(tests, args.shard)
+        print(f"Shard {args.shard}: {len(tests)} of {num_tests} tests")
+
+    input_category = args.category.lower()
+    if input_category not in allowed_categories:
+        raise ValueError(f"Category {input_category} is not supported.")
+
+    prompt = get_system_prompt(input_category=input_category)
+
+    # a resumed run is checked before anything is sent
+    store, run_id = store_from_args(args, {"pipeline": "understanding", "category": input_category})
+    cache = cache_from_args(args)
+    scheduler = scheduler_from_args(args)
+    telemetry = telemetry_from_args(args)
+    # retries are handled by the scheduler, which also honours Retry-After
+    client = CompletionClient(create_async_client(get_api_key(), base_url=args.base_url, max_retries=0), cache,
+                              scheduler, telemetry, contracts_from_args(args))
+    models = args.models or [args.model]
+    image_executor = create_image_executor(args.image_workers) if args.image_workers and len(tests) > 1 else None
+    results = []
+    # one pass over all tests per image budget, to compare image tokens against accuracy
+    for image_budget in args.image_budgets:
+        image_options = {"image_format": args.image_format, "quality": args.image_quality, "executor": image_executor,
+                         **parse_image_budget(image_budget)}
+        current_variant.set(image_budget_name(image_options))
+        evaluate = lambda test, model, image_options=image_options: evaluate_test(client, test, prompt, model,
+                                                                                  image_options, dataset)
+        if store is not None:
+            # finished tests of an interrupted run are taken from the store instead of being sent again
+            evaluate = store.checkpointed(run_id, image_budget_name(image_options), evaluate)
+        results += await run_batch(tests, evaluate, models, concurrency=args.concurrency,
+                                   image_budget=image_budget_name(image_options))
+    await client.close()
+    scheduler.print_stats()
+    client.contracts.print_stats()
+    release_image_executor(image_executor)
+    if cache.mode != "off":
+        print(f"Response cache: {cache.hits} hits, {cache.misses} misses")
+    if store is not None:
+        store.close()
+    if args.output:
+        write_results(results, Path(args.output))
+    print_aggregates(calculate_benchmark_results(results))
+    report = telemetry.report(results)
+    print_report(report)
+    if args.report:
+        write_report(report, Path(args.report))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Benchmark Understanding Model Evaluation")
+    parser.add_argument("--input", required=True, type=str, metavar="FILE|DIR|GLOB",
+                        help="Path to the input test that expects .PNG, .py and .json files, "
+                             "a directory / glob pattern of such tests, or packed .shard files.",
                         )
+    parser.add_argument("--shard", type=str, metavar="i/N",
+                        help="Only run the i-th of N disjoint slices of the tests (0 <= i < N), e.g. one slice per "
+                             "machine. Combine the outputs with merge_results.py.")
     parser.add_argument(
         "--category",
         type=str,
@@ -126,36 +217,24 @@ if __name__ == "__main__":
         help=f"Possible categories are: {allowed_categories}",
         default=allowed_categories[0]
     )
+    parser.add_argument("--model", type=str, default="qwen/qwen3-vl-235b-a22b-instruct",
+                        help="Model name at the provider.")
+    parser.add_argument("--models", nargs="+", type=str, metavar="MODEL",
+                        help="Evaluate several models side by side, overrides --model.")
+    parser.add_argument("--base-url", type=str, default="https://openrouter.ai/api/v1",
+                        help="OpenAI-compatible endpoint, e.g. http://127.0.0.1:8000/v1 for mock_server.py.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of tests in flight per model.")
+    parser.add_argument("--output", type=str, metavar="FILE", help="Write one JSON result per test to this file.")
+    add_cache_arguments(parser)
+    add_store_arguments(parser)
+    add_scheduler_arguments(parser)
+    add_telemetry_arguments(parser)
+    add_image_arguments(parser)
+    add_contract_arguments(parser)
+    add_verbose_argument(parser)
+    return parser
 
-    args = parser.parse_args()
-
-    input_png = Path(args.input).with_suffix(".png")
-    if not input_png.exists():
-        raise FileNotFoundError(f"Input image file not found: {input_png}")
-    input_json = Path(args.input).with_suffix(".json")
-    if not input_json.exists():
-        raise FileNotFoundError(f"Input Json file not found: {input_json}")
-    input_py = Path(args.input).with_suffix(".py")
-    if not input_py.exists():
-        raise FileNotFoundError(f"Input Python file not found: {input_py}")
-    else:
-        with open(input_py, 'r') as f:
-            instruct_prompt = f.read()
-    input_category = args.category.lower()
-    if input_category not in allowed_categories:
-        raise ValueError(f"Category {input_category} is not supported.")
 
-    SYSTEM_PROMPT = get_system_prompt(input_category=input_category)
-
-    API_KEY = get_api_key()
-
-    ground_truth = parse_ground_truth(input_json)
-    # response = generate_model_response(input_png, model_name="qwen/qwen3-vl-30b-a3b-instruct") or ""
-    response = generate_model_response(input_png, api_key=API_KEY, SYSTEM_PROMPT=SYSTEM_PROMPT,
-                                       instruct_prompt=instruct_prompt,
-                                       model_name="qwen/qwen3-vl-235b-a22b-instruct") or ""
-    response = parse_model_response(response)
-    score = evaluate_response(ground_truth, response)
-    print(f"Ground Truth: {ground_truth}")
-    print(f"Parsed Response: {response}")
-    print(f"Evaluation Score: {score}")
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(main(args))
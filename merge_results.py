@@ -0,0 +1,75 @@
+import argparse
+import json
+from pathlib import Path
+
+from batch_runner import write_results
+from results_store import aggregate_results, print_aggregates
+from scoring import score_result_files
+from telemetry import Telemetry, print_report, record_key, result_key, write_report
+
+
+def load_jsonl(path: Path) -> list[dict]:
+    with open(path, "r") as f:
+        return [json.loads(line) for line in f if line.strip()]
+
+
+def merge_results(result_files: list[list[dict]]) -> tuple[list[dict], dict[tuple[str, str, str], int]]:
+    """Combine the results of several shards or nodes into one run.
+        A case that was run on more than one node is kept once: the first successful result in file order,
+        or the first error if it failed everywhere.
+        Args:
+            result_files (list[list[dict]]): Results per file, in node order.
+        Returns:
+            tuple: The merged results, ordered by model, image budget and case id, and the file each
+                (model, image budget, case_id) was taken from, see telemetry.result_key.
+    """
+    chosen: dict[tuple[str, str, str], tuple[int, dict]] = {}
+    for file_number, results in enumerate(result_files):
+        for result in results:
+            key = result_key(result)
+            if key not in chosen or ("error" in chosen[key][1] and "error" not in result):
+                chosen[key] = (file_number, result)
+    models = list(dict.fromkeys(key[0] for key in chosen))
+    keys = sorted(chosen, key=lambda key: (models.index(key[0]), key[1], key[2]))
+    return [chosen[key][1] for key in keys], {key: chosen[key][0] for key in keys}
+
+
+def main(args):
+    result_paths = [Path(path) for path in args.results]
+    result_files = [load_jsonl(path) for path in result_paths]
+    results, sources = merge_results(result_files)
+    print(f"Merged {sum(map(len, result_files))} results from {len(result_paths)} files into {len(results)} unique cases")
+    write_results(results, Path(args.output))
+
+    report = {"summary": aggregate_results(results)}
+    # grounding results also get the box and click metrics of scoring.py
+    if any(isinstance(result.get("ground_truth"), list) for result in results):
+        report["scoring"] = score_result_files([Path(args.output)], method=args.method)
+
+    if args.telemetry:
+        if len(args.telemetry) != len(result_paths):
+            raise ValueError("Pass one --telemetry file per result file, in the same order.")
+        # keep only the requests of the node whose result was kept, as if the case ran once
+        telemetry = Telemetry()
+        for file_number, path in enumerate(args.telemetry):
+            telemetry.records += [record for record in load_jsonl(Path(path))
+                                  if sources.get(record_key(record)) == file_number]
+        report["telemetry"] = telemetry.report(results)
+        print_report(report["telemetry"])
+
+    print_aggregates(report["summary"])
+    if args.report:
+        write_report(report, Path(args.report))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Merge the result files of a sharded sweep into one run")
+    parser.add_argument("results", nargs="+", type=str, metavar="FILE",
+                        help="JSONL result files written with --output, e.g. one per --shard.")
+    parser.add_argument("--output", required=True, type=str, metavar="FILE", help="Merged result file.")
+    parser.add_argument("--telemetry", nargs="+", type=str, metavar="FILE",
+                        help="Telemetry files of the same runs, in the order of the result files.")
+    parser.add_argument("--method", choices=["greedy", "hungarian"], default="greedy", help="Box matching method.")
+    parser.add_argument("--report", type=str, metavar="FILE", help="Write summary, scoring and telemetry report as JSON.")
+    args = parser.parse_args()
+    main(args)
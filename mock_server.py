@@ -0,0 +1,256 @@
+import argparse
+import hashlib
+import itertools
+import json
+import random
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+LATENCY_DISTRIBUTIONS = ["fixed", "uniform", "exponential", "lognormal"]
+RESPONSE_SHAPES = ["text", "auto", "bbox", "multi_bbox", "uitars", "part", "yes_no", "echo"]
+MOCK_PARTS = ["BOWLING_BALL", "BASKETBALL", "SUPER_BALL", "PROGRAMMABLE_BALL", "TEETER_TOTTER", "RED_BRICK_WALL"]
+
+
+def _message_text(content) -> str:
+    if isinstance(content, str):
+        return content
+    return "\n".join(item.get("text", "") for item in content or [] if item.get("type") == "text")
+
+
+def random_bbox() -> list[int]:
+    x_min, y_min = random.randint(75, 850), random.randint(0, 800)
+    return [x_min, y_min, x_min + random.randint(20, 120), y_min + random.randint(20, 120)]
+
+
+def infer_shape(system: str, user: str) -> str:
+    """Answer format the prompt asks for."""
+    prompt = system + "\n" + user
+    if "GUI agent" in prompt:
+        return "uitars"
+    if "JSON array" in prompt:
+        return "multi_bbox"
+    if "JSON object" in prompt:
+        return "bbox"
+    if "yes or no" in prompt:
+        return "yes_no"
+    return "part"
+
+
+def mock_answer(shape: str, system: str, user: str, response_text: str = "NONE") -> str:
+    """Plausible completion content for a prompt, e.g. a bbox JSON with the requested labels.
+        Also used to fake the output of a batch, see batch_api.py.
+    """
+    if shape == "auto":
+        shape = infer_shape(system, user)
+    if shape == "bbox":
+        label = user.strip().splitlines()[-1] if user.strip() else random.choice(MOCK_PARTS)
+        return json.dumps({"bbox": random_bbox(), "label": label})
+    if shape == "multi_bbox":
+        match = re.search(r"Detect: (.+)", user)
+        labels = match.group(1).split(", ") if match else random.sample(MOCK_PARTS, 2)
+        return json.dumps([{"bbox": random_bbox(), "label": label} for label in labels])
+    if shape == "uitars":
+        return (f"Thought: The target is in the play area.\n"
+                f"Action: click(start_box='({random.randint(48, 560)},{random.randint(0, 375)})')")
+    if shape in ("part", "yes_no"):
+        choices = MOCK_PARTS if shape == "part" else ["yes", "no"]
+        # several numbered questions in one request, see main_event.py
+        questions = len(re.findall(r"^\d+: ", user, re.MULTILINE))
+        if questions > 1:
+            return "\n".join(f"{i + 1}: {random.choice(choices)}" for i in range(questions))
+        return random.choice(choices)
+    if shape == "echo":
+        return user
+    return response_text
+
+
+def constrain_answer(content: str, request: dict, format_error_rate: float = 0.0) -> tuple[str, str]:
+    """Apply response_format and max_tokens of a request to an answer, like a provider with structured outputs.
+        Without a response_format a share of the answers comes back in prose or markdown, some of them not
+        parsable at all, to exercise lenient parsing and re-asks.
+        Returns:
+            tuple[str, str]: Content and finish_reason.
+    """
+    response_format = request.get("response_format") or {}
+    schema_name = (response_format.get("json_schema") or {}).get("name")
+    if schema_name in ("part", "yes_no"):
+        choices = response_format["json_schema"]["schema"]["properties"]["answer"]["enum"]
+        content = json.dumps({"answer": content if content in choices else random.choice(choices)})
+    elif schema_name == "multi_bbox":
+        content = json.dumps({"objects": json.loads(content)})
+    elif not schema_name and random.random() < format_error_rate:
+        content = random.choice([f"Sure, here is the answer:\n```json\n{content}\n```",
+                                 f"The answer is {content.lower().replace('_', ' ')}.",
+                                 "I cannot tell from the image."])
+    # about 4 characters per token
+    max_tokens = request.get("max_tokens")
+    if max_tokens and len(content) > 4 * max_tokens:
+        return content[:4 * max_tokens], "length"
+    return content, "stop"
+
+
+def message_texts(messages: list[dict]) -> tuple[str, str]:
+    """Text of the system and of the user messages of a chat request."""
+    system = next((_message_text(m.get("content")) for m in messages if m.get("role") == "system"), "")
+    user = "\n".join(_message_text(m.get("content")) for m in messages if m.get("role") == "user")
+    return system, user
+
+
+class MockHTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # the default backlog of 5 drops connections when a benchmark opens many at once
+    request_queue_size = 256
+
+
+class MockChatCompletionsHandler(BaseHTTPRequestHandler):
+    """Answers POST /v1/chat/completions like an OpenAI-compatible provider.
+        Latency, error rate, 429 bursts and the shape of the answers are configured with the class attributes,
+        see start_mock_server.
+    """
+    protocol_version = "HTTP/1.1"  # keep-alive, so clients can pool connections
+    # headers and body are written separately, without this every answer waits for the delayed ACK
+    disable_nagle_algorithm = True
+    response_text = "NONE"
+    latency = 0.0
+    latency_dist = "fixed"
+    error_rate = 0.0
+    rate_limit_every = 0
+    rate_limit_burst = 1
+    retry_after = 1.0
+    shape = "text"
+    format_error_rate = 0.0
+    # shared by all handler threads of one server
+    counter = None
+    seen_prefixes = None
+    lock = None
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = json.loads(self.rfile.read(length) or b"{}")
+        if not self.path.rstrip("/").endswith("/chat/completions"):
+            self.send_json(404, {"error": {"message": f"Unknown path {self.path}"}})
+            return
+        with self.lock:
+            request_number = next(self.counter)
+        # every rate_limit_every requests the next rate_limit_burst requests are rejected
+        if self.rate_limit_every and request_number % self.rate_limit_every < self.rate_limit_burst:
+            self.send_json(429, {"error": {"message": "Rate limit exceeded", "code": 429}},
+                           headers={"Retry-After": str(self.retry_after)})
+            return
+        time.sleep(self.sample_latency())
+        if self.error_rate and random.random() < self.error_rate:
+            self.send_json(500, {"error": {"message": "Internal server error", "code": 500}})
+            return
+
+        messages = body.get("messages", [])
+        system, user = message_texts(messages)
+        content, finish_reason = constrain_answer(self.answer(system, user), body, self.format_error_rate)
+        self.send_json(200, {
+            "id": f"chatcmpl-{uuid.uuid4().hex}",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": body.get("model", "mock"),
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": content},
+                "finish_reason": finish_reason,
+            }],
+            "usage": self.usage(system, user, messages),
+        })
+
+    def sample_latency(self) -> float:
+        if self.latency <= 0:
+            return 0.0
+        if self.latency_dist == "uniform":
+            return random.uniform(0, 2 * self.latency)
+        if self.latency_dist == "exponential":
+            return random.expovariate(1.0 / self.latency)
+        if self.latency_dist == "lognormal":
+            # sigma 0.5, scaled so the mean is self.latency
+            return random.lognormvariate(0.0, 0.5) * self.latency / 1.1331
+        return self.latency
+
+    def answer(self, system: str, user: str) -> str:
+        return mock_answer(self.shape, system, user, self.response_text)
+
+    def usage(self, system: str, user: str, messages: list[dict]) -> dict:
+        """Rough token counts, with the system prompt counted as cached after it was seen once."""
+        images = sum(1 for m in messages if isinstance(m.get("content"), list)
+                     for item in m["content"] if item.get("type") == "image_url")
+        prefix = hashlib.sha256(system.encode("utf-8")).hexdigest()
+        with self.lock:
+            cached = prefix in self.seen_prefixes
+            self.seen_prefixes.add(prefix)
+        prompt_tokens = (len(system) + len(user)) // 4 + 400 * images
+        return {
+            "prompt_tokens": prompt_tokens,
+            "completion_tokens": 20,
+            "total_tokens": prompt_tokens + 20,
+            "prompt_tokens_details": {"cached_tokens": len(system) // 4 if cached else 0},
+        }
+
+    def send_json(self, status: int, payload: dict, headers: dict | None = None):
+        data = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def start_mock_server(host="127.0.0.1", port=0, response_text="NONE", latency=0.0, **options) -> ThreadingHTTPServer:
+    """Start the mock server in a background thread.
+        Args:
+            options: latency_dist, error_rate, rate_limit_every, rate_limit_burst, retry_after, shape and
+                format_error_rate,
+                see MockChatCompletionsHandler.
+        Returns:
+            ThreadingHTTPServer: The running server, its base url is http://host:server.server_port/v1.
+    """
+    if options.get("latency_dist", "fixed") not in LATENCY_DISTRIBUTIONS:
+        raise ValueError(f"Latency distribution {options['latency_dist']} is not supported, use one of {LATENCY_DISTRIBUTIONS}.")
+    if options.get("shape", "text") not in RESPONSE_SHAPES:
+        raise ValueError(f"Response shape {options['shape']} is not supported, use one of {RESPONSE_SHAPES}.")
+    attributes = {"response_text": response_text, "latency": latency, "counter": itertools.count(),
+                  "seen_prefixes": set(), "lock": threading.Lock(), **options}
+    handler = type("ConfiguredHandler", (MockChatCompletionsHandler,), attributes)
+    server = MockHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Local OpenAI-compatible mock endpoint for offline runs")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000, help="0 picks a free port.")
+    parser.add_argument("--response", default="NONE", help="Content of every completion for --shape text.")
+    parser.add_argument("--shape", choices=RESPONSE_SHAPES, default="text",
+                        help="Answer format, auto picks it from the prompt (UI-TARS click, bbox JSON, part name, yes/no).")
+    parser.add_argument("--latency", type=float, default=0.0, help="Mean seconds to wait before answering.")
+    parser.add_argument("--latency-dist", choices=LATENCY_DISTRIBUTIONS, default="fixed")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Share of requests answered with a 500.")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="Start a burst of 429 responses every N requests.")
+    parser.add_argument("--rate-limit-burst", type=int, default=1, help="Number of 429 responses per burst.")
+    parser.add_argument("--retry-after", type=float, default=1.0, help="Retry-After of the 429 responses in seconds.")
+    parser.add_argument("--format-error-rate", type=float, default=0.0,
+                        help="Share of answers without response_format that are wrapped in prose or markdown.")
+    args = parser.parse_args()
+
+    server = start_mock_server(args.host, args.port, args.response, args.latency, latency_dist=args.latency_dist,
+                               error_rate=args.error_rate, rate_limit_every=args.rate_limit_every,
+                               rate_limit_burst=args.rate_limit_burst, retry_after=args.retry_after, shape=args.shape,
+                               format_error_rate=args.format_error_rate)
+    print(f"Mock endpoint listening on http://{args.host}:{server.server_port}/v1", flush=True)
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,347 @@
+import argparse
+import json
+import re
+from dataclasses import dataclass
+from functools import lru_cache
+from types import ModuleType
+from typing import Callable
+
+from prompts import part_names
+
+OUTPUT_MODES = ["off", "tokens", "schema"]
+NO_PART = "NONE"
+# answers per lookup that found them, over all matchers, to see how much parsing relies on the lenient lookups
+MATCH_COUNTS = {"exact": 0, "normalized": 0, "contained": 0, "fuzzy": 0, "none": 0}
+
+
+def normalize_label(text: str) -> str:
+    """Catalog spelling of a free text label, e.g. "Bowling ball" -> BOWLING_BALL."""
+    return re.sub(r"[^A-Z0-9]+", "_", text.upper()).strip("_")
+
+
+def edit_distance(a: str, b: str, limit: int) -> int:
+    """Levenshtein distance of a and b, or limit + 1 as soon as it is known to exceed limit."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        for j, char_b in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char_a != char_b)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+class PartMatcher:
+    """Maps model answers to the canonical part names of docs/additional_context/parts.txt.
+        The lookups run in order: exact, normalized (case, spaces, punctuation), without underscores,
+        a single catalog name contained in a longer answer, and finally the closest name within a small
+        edit distance. Results are memoized, model answers repeat a lot.
+    """
+
+    def __init__(self, names: list[str]):
+        self.names = list(names) + [NO_PART]
+        self.exact = set(self.names)
+        self.normalized = {normalize_label(name): name for name in self.names}
+        self.squashed = {name.replace("_", ""): name for name in self.normalized}
+        self.by_length: dict[int, list[str]] = {}
+        for key in self.squashed:
+            self.by_length.setdefault(len(key), []).append(key)
+        # longest names first, so BASKETBALL_HOOP is not matched as BASKETBALL
+        alternatives = "|".join(re.escape(name) for name in sorted(self.normalized, key=len, reverse=True))
+        self.contained = re.compile(rf"(?<![A-Z0-9])({alternatives})(?![A-Z0-9])")
+        self.cache: dict[str, tuple[str | None, str]] = {}
+
+    def match(self, text: str) -> tuple[str | None, str]:
+        """Canonical name of an answer and how it was found: exact, normalized, contained, fuzzy or none."""
+        result = self.lookup(text)
+        MATCH_COUNTS[result[1]] += 1
+        return result
+
+    def lookup(self, text: str) -> tuple[str | None, str]:
+        """match without counting, for checks of answers that are parsed again later."""
+        result = self.cache.get(text)
+        if result is None:
+            result = self._match(text)
+            self.cache[text] = result
+        return result
+
+    def _match(self, text: str) -> tuple[str | None, str]:
+        text = text.strip().strip("\"'`.")
+        if text in self.exact:
+            return text, "exact"
+        normalized = normalize_label(text)
+        if normalized in self.normalized:
+            return self.normalized[normalized], "normalized"
+        squashed = normalized.replace("_", "")
+        if squashed in self.squashed:
+            return self.squashed[squashed], "normalized"
+        found = set(self.contained.findall(normalized))
+        if len(found) == 1:
+            return self.normalized[found.pop()], "contained"
+        # short answers like "NO" are too close to too many names
+        if len(squashed) < 4:
+            return None, "none"
+        limit = max(1, len(squashed) // 5)
+        best, best_distance = None, limit + 1
+        for length in range(len(squashed) - limit, len(squashed) + limit + 1):
+            for key in self.by_length.get(length, []):
+                distance = edit_distance(squashed, key, min(limit, best_distance))
+                if distance < best_distance:
+                    best, best_distance = key, distance
+        if best is None:
+            return None, "none"
+        return self.squashed[best], "fuzzy"
+
+
+@lru_cache(maxsize=256)
+def part_matcher(extra_names: tuple[str, ...] = ()) -> PartMatcher:
+    """Matcher over the part catalog, built once per process and set of extra names.
+        Args:
+            extra_names (tuple[str, ...]): Names outside the catalog that are valid answers too, e.g. the part
+                types of a scene file like RED_BRICK_WALL. Pass them sorted, so equal sets share a matcher.
+    """
+    return PartMatcher(part_names() + [name for name in extra_names if name not in part_names()])
+
+
+def extract_json(text: str):
+    """First JSON value in a model answer, also inside markdown fences or after a sentence.
+        Raises:
+            json.JSONDecodeError: If the answer contains no JSON.
+    """
+    text = text.strip()
+    fence = re.search(r"```(?:json)?\s*(.*?)```", text, re.DOTALL)
+    if fence:
+        text = fence.group(1).strip()
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        pass
+    starts = [index for index in (text.find("{"), text.find("[")) if index >= 0]
+    if not starts:
+        raise json.JSONDecodeError("No JSON value found", text, 0)
+    value, _ = json.JSONDecoder().raw_decode(text[min(starts):])
+    return value
+
+
+def answer_text(response: str) -> str:
+    """The answer of a one-word task, unwrapped from {"answer": ...} if it was sent with a schema."""
+    response = response.strip()
+    if response.startswith(("{", "```")):
+        try:
+            value = extract_json(response)
+        except json.JSONDecodeError:
+            return response
+        if isinstance(value, dict) and isinstance(value.get("answer"), str):
+            return value["answer"]
+    return response
+
+
+# Action: click(start_box='(230,131)'), click(point='<point>230 131</point>') or click(start_box='<|box_start|>(230,131)<|box_end|>')
+CLICK_PATTERN = re.compile(r"click\(\s*(?:start_box|point)\s*=\s*['\"]?\s*(?:<\|box_start\|>|<point>)?\s*\(?\s*"
+                           r"(\d+(?:\.\d+)?)\s*[,\s]\s*(\d+(?:\.\d+)?)")
+
+
+def parse_click_point(response: str) -> tuple[int, int] | None:
+    """Click point of a UI-TARS answer, from the last Action if there is one."""
+    action = response.rsplit("Action:", 1)[-1]
+    match = CLICK_PATTERN.search(action)
+    if match is None:
+        return None
+    return round(float(match.group(1))), round(float(match.group(2)))
+
+
+def numbered_answers(response: str) -> dict[int, str]:
+    """Answers of a request with several questions, "1: ..." lines by number, the first answer per number counts."""
+    answers = {}
+    for line in response.splitlines():
+        match = re.match(r"\s*(\d+)\s*[:.)]\s*(.+)", line)
+        if match:
+            answers.setdefault(int(match.group(1)), match.group(2))
+    return answers
+
+
+def _is_part(response: str) -> bool:
+    return part_matcher().lookup(answer_text(response))[0] is not None
+
+
+def _is_yes_no(response: str) -> bool:
+    return normalize_label(answer_text(response)) in ("YES", "NO")
+
+
+def _is_bbox(response: str) -> bool:
+    try:
+        value = extract_json(response)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(value, dict) and "bbox" in value
+
+
+def _is_bbox_list(response: str) -> bool:
+    try:
+        value = extract_json(response)
+    except json.JSONDecodeError:
+        return False
+    return isinstance(value, list) or isinstance(value, dict) and ("objects" in value or "bbox" in value)
+
+
+def _json_schema(name: str, schema: dict) -> dict:
+    return {"type": "json_schema", "json_schema": {"name": name, "schema": schema}}
+
+
+def _bbox_schema(nullable: bool) -> dict:
+    bbox = {"type": "array", "items": {"type": "integer", "minimum": 0, "maximum": 1000}, "minItems": 4, "maxItems": 4}
+    return {
+        "type": "object",
+        "properties": {
+            "bbox": {"anyOf": [bbox, {"type": "null"}]} if nullable else bbox,
+            # no enum, the labels asked for are part types of the scene files, not all of them are in the catalog
+            "label": {"type": "string"},
+        },
+        "required": ["bbox", "label"],
+        "additionalProperties": False,
+    }
+
+
+@dataclass(frozen=True)
+class OutputContract:
+    """Expected answer of a prompt: how long it may be, the JSON schema it is constrained to and how to check it.
+        max_tokens is base_tokens for one requested object plus tokens_per_target for every further one.
+        Contracts with numbered set answer several questions (targets) on numbered lines, the schema only
+        constrains a single answer.
+    """
+    name: str
+    base_tokens: int
+    tokens_per_target: int
+    check: Callable[[str], bool]
+    reminder: str
+    schema: Callable[[], dict] | None = None
+    numbered: bool = False
+
+    def max_tokens(self, targets: int | None = 1) -> int:
+        # an unknown number of targets (e.g. all objects of a scene) gets room for a crowded scene
+        return self.base_tokens + self.tokens_per_target * ((targets if targets is not None else 24) - 1)
+
+    def response_format(self, targets: int | None = 1) -> dict | None:
+        if self.schema is None or self.numbered and targets != 1:
+            return None
+        return self.schema()
+
+    def valid(self, response: str, targets: int | None = 1) -> bool:
+        if self.numbered and targets != 1:
+            answers = numbered_answers(response)
+            return all(i in answers and self.check(answers[i]) for i in range(1, (targets or 1) + 1))
+        return self.check(response)
+
+
+CONTRACTS = {
+    "part": OutputContract(
+        "part", 24, 24, _is_part, "Respond only with one object name from the list of possible objects per question.",
+        lambda: _json_schema("part", {"type": "object", "properties": {
+            "answer": {"type": "string", "enum": part_names() + [NO_PART]}}, "required": ["answer"],
+            "additionalProperties": False}), numbered=True),
+    "yes_no": OutputContract(
+        "yes_no", 12, 12, _is_yes_no, "Respond only with yes or no per question.",
+        lambda: _json_schema("yes_no", {"type": "object", "properties": {
+            "answer": {"type": "string", "enum": ["yes", "no"]}}, "required": ["answer"],
+            "additionalProperties": False}), numbered=True),
+    "bbox": OutputContract(
+        "bbox", 48, 0, _is_bbox,
+        'Return only a JSON object {"bbox": [x_min, y_min, x_max, y_max], "label": "string"} without markdown.',
+        lambda: _json_schema("bbox", _bbox_schema(nullable=True))),
+    "multi_bbox": OutputContract(
+        "multi_bbox", 56, 40, _is_bbox_list,
+        'Return only a JSON array [{"bbox": [x_min, y_min, x_max, y_max], "label": "string"}, ...] without markdown.',
+        lambda: _json_schema("multi_bbox", {"type": "object", "properties": {
+            "objects": {"type": "array", "items": _bbox_schema(nullable=False)}}, "required": ["objects"],
+            "additionalProperties": False})),
+    # agent format with free text reasoning, it cannot be constrained by a schema
+    "uitars": OutputContract(
+        "uitars", 384, 0, lambda response: parse_click_point(response) is not None,
+        "Answer with a Thought and one click Action in the given output format."),
+}
+
+
+class OutputContracts:
+    """Sends the output contract of a prompt (prompt.OUTPUT) with every request and checks the answers.
+        Args:
+            mode (str): off sends requests unchanged, tokens caps max_tokens to the expected answer,
+                schema additionally constrains the answer with response_format where the task allows it.
+            reask (int): Times a request is repeated with a format reminder when its answer cannot be parsed.
+    """
+
+    def __init__(self, mode: str = "off", reask: int = 0):
+        if mode not in OUTPUT_MODES:
+            raise ValueError(f"Output contract mode {mode} is not supported, use one of {OUTPUT_MODES}.")
+        self.mode = mode
+        self.reask = reask
+        self.stats: dict[str, dict[str, int]] = {}
+
+    def request_options(self, prompt: ModuleType, targets: int | None = 1) -> dict:
+        contract = CONTRACTS.get(getattr(prompt, "OUTPUT", None))
+        if contract is None or self.mode == "off":
+            return {}
+        options = {"max_tokens": contract.max_tokens(targets)}
+        response_format = contract.response_format(targets) if self.mode == "schema" else None
+        if response_format is not None:
+            options["response_format"] = response_format
+        return options
+
+    async def complete(self, client, prompt: ModuleType, messages: list[dict], targets: int | None = 1,
+                       **request) -> str:
+        """Send a request with the prompt's output contract and re-ask while the answer cannot be parsed.
+            Args:
+                client (CompletionClient): Client to send the request with.
+                targets (int | None): Objects or questions asked for, scales max_tokens. None if unknown.
+                request: model, temperature, ... of chat.completions.create.
+            Returns:
+                str: Content of the last answer, parsable or not.
+        """
+        options = self.request_options(prompt, targets)
+        response = await client.create(messages=messages, **options, **request)
+        contract = CONTRACTS.get(getattr(prompt, "OUTPUT", None))
+        content = response.choices[0].message.content or ""
+        if contract is None:
+            return content
+        stats = self.stats.setdefault(contract.name, {"answers": 0, "parse_failures": 0, "truncated": 0,
+                                                      "reasks": 0, "recovered": 0})
+        reasks = 0
+        while True:
+            stats["answers"] += 1
+            stats["truncated"] += response.choices[0].finish_reason == "length"
+            if contract.valid(content, targets):
+                stats["recovered"] += reasks > 0
+                return content
+            stats["parse_failures"] += 1
+            if reasks >= self.reask:
+                return content
+            reasks += 1
+            stats["reasks"] += 1
+            messages = messages + [{"role": "assistant", "content": content},
+                                   {"role": "user", "content": f"Your answer could not be parsed. {contract.reminder}"}]
+            response = await client.create(messages=messages, **options, **request)
+            content = response.choices[0].message.content or ""
+
+    def print_stats(self):
+        for name, stats in self.stats.items():
+            answers = max(stats["answers"], 1)
+            print(f"Output {name}: {stats['answers']} answers, {stats['parse_failures'] / answers:.1%} not parsable, "
+                  f"{stats['truncated'] / answers:.1%} truncated, {stats['reasks']} re-asks "
+                  f"({stats['recovered']} recovered)")
+        if any(MATCH_COUNTS.values()):
+            print("Part names matched: " + ", ".join(f"{count} {how}" for how, count in MATCH_COUNTS.items()))
+
+
+def add_contract_arguments(parser: argparse.ArgumentParser):
+    # off by default, capping max_tokens or constraining the format changes the answers compared to earlier runs
+    parser.add_argument("--output-contract", choices=OUTPUT_MODES, default="off",
+                        help="off: requests as before, without max_tokens, tokens: cap max_tokens to the expected "
+                             "answer, schema: also constrain the answer with a JSON schema (response_format).")
+    parser.add_argument("--reask", type=int, default=0,
+                        help="Repeat a request with a format reminder up to this many times if its answer cannot be parsed.")
+
+
+def contracts_from_args(args: argparse.Namespace) -> OutputContracts:
+    return OutputContracts(args.output_contract, args.reask)
@@ -0,0 +1,104 @@
+import ast
+from functools import lru_cache
+from pathlib import Path
+from types import ModuleType
+
+CONTEXT_DIR = Path(__file__).parent / "docs" / "additional_context"
+CATALOG_FILES = {
+    "names": "parts.txt",
+    "descriptions": "parts_with_descriptions.txt",
+    # the balls of the object property tests, the list of the original with_instruct prompt
+    "balls": "balls_with_descriptions.txt",
+}
+
+
+@lru_cache(maxsize=None)
+def part_catalog(catalog: str) -> str:
+    """Part list from docs/additional_context, read once per process."""
+    if catalog not in CATALOG_FILES:
+        raise ValueError(f"Catalog {catalog} is not supported, use one of {list(CATALOG_FILES)}.")
+    with open(CONTEXT_DIR / CATALOG_FILES[catalog], "r") as f:
+        return f.read().strip()
+
+
+def part_names() -> list[str]:
+    return part_catalog("names").split(",")
+
+
+@lru_cache(maxsize=None)
+def system_prompt(catalog: str) -> str:
+    """Static system prompt shared by every task and test that uses the same catalog.
+        It must stay byte-identical across requests, so providers can serve it from their prompt cache.
+    """
+    return f"Possible objects:\n{part_catalog(catalog)}"
+
+
+def legacy_system_prompt(catalog: str | None, instruction: str) -> str:
+    """Instruction and part list as one text, the SYSTEM_PROMPT that the prompt modules defined before
+        build_messages split them into a cacheable system prompt and the user message. Kept for code that imports it.
+    """
+    if catalog is None:
+        return instruction
+    return f"{instruction}\n\n{system_prompt(catalog)}"
+
+
+def prompt_name(prompt: ModuleType) -> str:
+    return prompt.__name__.rsplit(".", 1)[-1]
+
+
+def build_messages(prompt: ModuleType, data_url: str | list[str] | None, user_text: str = "") -> list[dict]:
+    """Assemble a chat request with the static part first and everything that varies per test last.
+        Args:
+            prompt (ModuleType): Module from benchmark*/system_prompts with INSTRUCTION, CATALOG and OUTPUT.
+                With CATALOG = None the instruction is the system prompt, e.g. for agent prompts like UI-TARS.
+                OUTPUT names the answer format, see output_contracts.CONTRACTS.
+            data_url (str | list[str] | None): The screenshot, always the last content item. A list sends several
+                images in order (e.g. the frames of an event), None a text-only request.
+            user_text (str): Per-test text, e.g. the target object or the TASK_DESCRIPTION of a test.
+        Returns:
+            list[dict]: Messages for chat.completions.create.
+    """
+    if prompt.CATALOG is None:
+        system = prompt.INSTRUCTION
+        texts = [user_text]
+    else:
+        system = system_prompt(prompt.CATALOG)
+        texts = [prompt.INSTRUCTION, user_text]
+    text = "\n\n".join(text for text in texts if text)
+    user_content = [{"type": "text", "text": text}] if text else []
+    data_urls = [data_url] if isinstance(data_url, str) else data_url or []
+    user_content += [{"type": "image_url", "image_url": {"url": url}} for url in data_urls]
+    return [
+        {"role": "system", "content": system},
+        {"role": "user", "content": user_content},
+    ]
+
+
+def scene_text(scene: dict) -> str:
+    """Textual serialization of the parts of a scene (.json or parsed .TIM), shared by all text variants of
+        the prompts so that the same scene is always described the same way.
+    """
+    lines = []
+    settings = scene.get("global_settings")
+    if settings:
+        lines.append(f"Gravity: {settings.get('gravity')}, air pressure: {settings.get('pressure')}")
+    lines.append("Parts (x, y, width, height in pixels of the 640x441 screenshot):")
+    for part in scene.get("parts", []):
+        position, size = part.get("position", {}), part.get("size", {})
+        # the unnamed flags carry no meaning for the model
+        flags = [flag for flag in part.get("flags_3", []) if not flag.startswith("UNKNOWN_")]
+        line = (f"- {part.get('part_type')}: {position.get('x')}, {position.get('y')}, "
+                f"{size.get('width_1')}, {size.get('height_1')}")
+        lines.append(f"{line} ({', '.join(flags)})" if flags else line)
+    return "\n".join(lines)
+
+
+def read_task_description(py_path: Path) -> str:
+    """Value of SYSTEM_PROMPT in a test's .py file, read without executing it."""
+    with open(py_path, "r") as f:
+        tree = ast.parse(f.read(), filename=str(py_path))
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and any(isinstance(target, ast.Name) and target.id == "SYSTEM_PROMPT"
+                                                for target in node.targets):
+            return ast.literal_eval(node.value).strip()
+    raise ValueError(f"{py_path} does not define SYSTEM_PROMPT.")
@@ -0,0 +1,125 @@
+import argparse
+import hashlib
+import json
+import os
+import time
+from pathlib import Path
+
+CACHE_MODES = ["readwrite", "readonly", "off"]
+# evicting by size trims the cache to this share of --cache-max-size-mb, so a cache at its cap is not scanned again on
+# every put
+EVICT_TARGET = 0.9
+
+
+class ResponseCache:
+    """Content-addressed on-disk cache of chat completions.
+        Every completion is stored as <cache_dir>/<key[:2]>/<key>.json where key is the
+        sha256 of the full request (model, messages incl. the base64 image, temperature, ...).
+        Entries are evicted by age and, oldest first, by total size, at startup and whenever the entries written
+        since the last eviction push the cache past max_size_mb.
+    """
+
+    def __init__(self, cache_dir: Path, mode: str = "readwrite", max_age_days: float | None = None,
+                 max_size_mb: float | None = None):
+        if mode not in CACHE_MODES:
+            raise ValueError(f"Cache mode {mode} is not supported, use one of {CACHE_MODES}.")
+        self.cache_dir = Path(cache_dir)
+        self.mode = mode
+        self.max_age = max_age_days * 86400 if max_age_days is not None else None
+        self.max_size = max_size_mb * 1024 * 1024 if max_size_mb is not None else None
+        self.hits = 0
+        self.misses = 0
+        # estimated size of the cache on disk, updated by put and recounted by evict
+        self.size = 0
+        if self.mode == "readwrite":
+            self.evict()
+
+    @staticmethod
+    def key(request: dict) -> str:
+        canonical = json.dumps(request, sort_keys=True, separators=(",", ":"), ensure_ascii=False)
+        return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+    def path(self, key: str) -> Path:
+        return self.cache_dir / key[:2] / f"{key}.json"
+
+    def get(self, key: str) -> dict | None:
+        path = self.path(key)
+        try:
+            with open(path, "r") as f:
+                entry = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            self.misses += 1
+            return None
+        if self.max_age is not None and time.time() - entry["created"] > self.max_age:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return entry
+
+    def put(self, key: str, request: dict, completion: dict):
+        if self.mode != "readwrite":
+            return
+        path = self.path(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "created": time.time(),
+            "model": request.get("model"),
+            "completion": completion,
+            "usage": completion.get("usage"),
+        }
+        # write to a temporary file first so concurrent or crashed runs never leave half an entry
+        tmp_path = path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(entry, f)
+            self.size += f.tell()
+        os.replace(tmp_path, path)
+        if self.max_size is not None and self.size > self.max_size:
+            self.evict()
+
+    def evict(self):
+        """Removes entries older than max_age_days, then the oldest entries until the cache fits into
+            EVICT_TARGET of max_size_mb. Other runs may share the cache directory, so the size is recounted from disk.
+        """
+        if not self.cache_dir.exists() or (self.max_age is None and self.max_size is None):
+            return
+        now = time.time()
+        entries = []
+        for path in self.cache_dir.glob("*/*.json"):
+            stat = path.stat()
+            if self.max_age is not None and now - stat.st_mtime > self.max_age:
+                path.unlink(missing_ok=True)
+            else:
+                entries.append((stat.st_mtime, stat.st_size, path))
+        total_size = sum(size for _, size, _ in entries)
+        if self.max_size is not None and total_size > self.max_size:
+            for _, size, path in sorted(entries):
+                if total_size <= self.max_size * EVICT_TARGET:
+                    break
+                path.unlink(missing_ok=True)
+                total_size -= size
+        self.size = total_size
+
+
+def add_cache_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--cache-dir", type=str, default=".cache/responses",
+                        help="Directory of the response cache.")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Bypass the response cache, every request goes to the provider.")
+    parser.add_argument("--cache-readonly", action="store_true",
+                        help="Only serve cached responses and fail on a miss, e.g. to reproduce published numbers.")
+    parser.add_argument("--cache-max-age-days", type=float, default=None,
+                        help="Evict cached responses older than this.")
+    parser.add_argument("--cache-max-size-mb", type=float, default=None,
+                        help="Evict the oldest responses once the cache grows beyond this, checked at startup "
+                             "and while responses are written.")
+
+
+def cache_from_args(args: argparse.Namespace) -> ResponseCache:
+    if args.no_cache:
+        mode = "off"
+    elif args.cache_readonly:
+        mode = "readonly"
+    else:
+        mode = "readwrite"
+    return ResponseCache(Path(args.cache_dir), mode=mode, max_age_days=args.cache_max_age_days,
+                         max_size_mb=args.cache_max_size_mb)
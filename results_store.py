@@ -0,0 +1,318 @@
+import argparse
+import json
+import math
+import sqlite3
+import time
+from pathlib import Path
+from typing import Awaitable, Callable
+
+from telemetry import category, result_key
+from utils import case_id
+
+# z of a two-sided 95% confidence interval
+Z_95 = 1.959964
+METRICS = ["score", "iou", "click_distance"]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    run_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    case_id TEXT NOT NULL,
+    category TEXT NOT NULL,
+    target TEXT,
+    correct INTEGER NOT NULL,
+    score REAL,
+    iou REAL,
+    click_distance REAL,
+    finished REAL NOT NULL,
+    result TEXT NOT NULL,
+    PRIMARY KEY (run_id, model, variant, case_id)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS results_by_target ON results (target, run_id, model, correct);
+CREATE INDEX IF NOT EXISTS results_by_category ON results (category, run_id, model, correct);
+CREATE TABLE IF NOT EXISTS aggregates (
+    run_id TEXT NOT NULL,
+    model TEXT NOT NULL,
+    variant TEXT NOT NULL,
+    tests INTEGER NOT NULL DEFAULT 0,
+    correct INTEGER NOT NULL DEFAULT 0,
+    score_n INTEGER NOT NULL DEFAULT 0, score_sum REAL NOT NULL DEFAULT 0, score_sq_sum REAL NOT NULL DEFAULT 0,
+    iou_n INTEGER NOT NULL DEFAULT 0, iou_sum REAL NOT NULL DEFAULT 0, iou_sq_sum REAL NOT NULL DEFAULT 0,
+    click_distance_n INTEGER NOT NULL DEFAULT 0, click_distance_sum REAL NOT NULL DEFAULT 0,
+    click_distance_sq_sum REAL NOT NULL DEFAULT 0,
+    updated REAL,
+    PRIMARY KEY (run_id, model, variant)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS run_configs (
+    run_id TEXT PRIMARY KEY,
+    config TEXT NOT NULL,
+    started REAL NOT NULL
+) WITHOUT ROWID;
+"""
+
+
+def wilson_interval(successes: int, n: int, z: float = Z_95) -> tuple[float, float] | None:
+    """Confidence interval of a proportion, also sensible for 0 or n successes and small n."""
+    if n == 0:
+        return None
+    p = successes / n
+    center = (p + z * z / (2 * n)) / (1 + z * z / n)
+    half_width = z * math.sqrt(p * (1 - p) / n + z * z / (4 * n * n)) / (1 + z * z / n)
+    return (max(0.0, center - half_width), min(1.0, center + half_width))
+
+
+def mean_interval(n: int, total: float, sq_total: float, z: float = Z_95) -> dict | None:
+    """Mean and normal confidence interval from the count, sum and sum of squares of a metric."""
+    if n == 0:
+        return None
+    mean = total / n
+    variance = max(sq_total / n - mean * mean, 0.0) * n / (n - 1) if n > 1 else 0.0
+    half_width = z * math.sqrt(variance / n)
+    return {"n": n, "mean": mean, "ci95": (mean - half_width, mean + half_width)}
+
+
+def result_metrics(result: dict) -> dict[str, float | None]:
+    """Numeric metrics of a result, missing ones (e.g. iou of a click test) are None."""
+    metrics = {name: result.get(name) for name in METRICS}
+    # understanding tests score True/False
+    if isinstance(metrics["score"], bool):
+        metrics["score"] = float(metrics["score"])
+    return metrics
+
+
+class RunningAggregate:
+    """Accuracy and metric sums of one model and variant, updated in O(1) per result."""
+
+    def __init__(self, tests: int = 0, correct: int = 0, **sums):
+        self.tests = tests
+        self.correct = correct
+        self.sums = {name: [sums.get(f"{name}_n", 0), sums.get(f"{name}_sum", 0.0), sums.get(f"{name}_sq_sum", 0.0)]
+                     for name in METRICS}
+
+    def add(self, result: dict):
+        self.tests += 1
+        self.correct += bool(result.get("correct"))
+        for name, value in result_metrics(result).items():
+            if value is not None:
+                entry = self.sums[name]
+                entry[0] += 1
+                entry[1] += value
+                entry[2] += value * value
+
+    def summary(self) -> dict:
+        return {
+            "tests": self.tests,
+            "correct": self.correct,
+            "accuracy": self.correct / self.tests if self.tests else None,
+            "accuracy_ci95": wilson_interval(self.correct, self.tests),
+            **{name: mean_interval(*self.sums[name]) for name in METRICS},
+        }
+
+
+def aggregate_results(results: list[dict]) -> dict[str, dict[str, dict]]:
+    """Accuracy, mean score, IoU and click distance with 95% confidence intervals per model and image budget.
+        Failed tests are skipped, they are neither correct nor wrong.
+    """
+    aggregates: dict[str, dict[str, RunningAggregate]] = {}
+    for result in results:
+        if "error" in result:
+            continue
+        model, variant, _ = result_key(result)
+        aggregates.setdefault(model, {}).setdefault(variant, RunningAggregate()).add(result)
+    return {model: {variant: aggregate.summary() for variant, aggregate in variants.items()}
+            for model, variants in aggregates.items()}
+
+
+class ResultsStore:
+    """SQLite store of scored test results, written as soon as a test finishes.
+        Every result is keyed by run id, model, variant (image budget) and case id. The aggregates table is
+        updated in the same transaction, so a running sweep can be watched by reading one row per model.
+        Args:
+            db_path (Path): SQLite database, created if missing. Several runs can share one database.
+    """
+
+    def __init__(self, db_path: Path):
+        self.path = Path(db_path)
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path)
+        # readers (watch, compare) do not block the writer
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript(SCHEMA)
+
+    def start_run(self, run_id: str, config: dict):
+        """Record the pipeline settings of a run, e.g. {"pipeline": "grounding", "mode": "click"}, or check them
+            when an existing run is resumed. Results are keyed without these settings, so a run holds one pipeline.
+            Raises:
+                ValueError: If the run was started with other settings, its results would be reused for them.
+        """
+        config_text = json.dumps(config, sort_keys=True)
+        with self.connection:
+            self.connection.execute("INSERT INTO run_configs VALUES (?, ?, ?) ON CONFLICT (run_id) DO NOTHING",
+                                    (run_id, config_text, time.time()))
+            (stored,) = self.connection.execute("SELECT config FROM run_configs WHERE run_id = ?", (run_id,)).fetchone()
+        if stored != config_text:
+            raise ValueError(f"Run {run_id} was started with {stored}, not {config_text}. Use another --run-id.")
+
+    def put(self, run_id: str, result: dict) -> bool:
+        """Store a finished result and add it to the aggregates.
+            Returns:
+                bool: False if the case was already stored for this run, the stored result is kept.
+        """
+        model, variant, test_id = result_key(result)
+        metrics = result_metrics(result)
+        target = result.get("target")
+        with self.connection:
+            cursor = self.connection.execute(
+                "INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?) "
+                "ON CONFLICT (run_id, model, variant, case_id) DO NOTHING",
+                (run_id, model, variant, test_id, category(test_id), target, int(bool(result.get("correct"))),
+                 metrics["score"], metrics["iou"], metrics["click_distance"], time.time(), json.dumps(result)))
+            if cursor.rowcount == 0:
+                return False
+            values = [1, int(bool(result.get("correct")))]
+            for name in METRICS:
+                value = metrics[name]
+                values += [0, 0.0, 0.0] if value is None else [1, value, value * value]
+            columns = ["tests", "correct"] + [f"{name}{suffix}" for name in METRICS for suffix in ("_n", "_sum", "_sq_sum")]
+            self.connection.execute(
+                f"INSERT INTO aggregates (run_id, model, variant, {', '.join(columns)}, updated) "
+                f"VALUES (?, ?, ?, {', '.join('?' * len(columns))}, ?) "
+                f"ON CONFLICT (run_id, model, variant) DO UPDATE SET "
+                f"{', '.join(f'{c} = {c} + excluded.{c}' for c in columns)}, updated = excluded.updated",
+                (run_id, model, variant, *values, time.time()))
+        return True
+
+    def finished(self, run_id: str) -> dict[tuple[str, str, str], dict]:
+        """Stored results of a run by (model, variant, case_id)."""
+        rows = self.connection.execute("SELECT model, variant, case_id, result FROM results WHERE run_id = ?", (run_id,))
+        return {(model, variant, test_id): json.loads(result) for model, variant, test_id, result in rows}
+
+    def aggregates(self, run_id: str) -> dict[str, dict[str, dict]]:
+        """Running aggregates of a run per model and variant, without reading the results."""
+        self.connection.row_factory = sqlite3.Row
+        try:
+            rows = self.connection.execute("SELECT * FROM aggregates WHERE run_id = ?", (run_id,)).fetchall()
+        finally:
+            self.connection.row_factory = None
+        aggregates = {}
+        for row in rows:
+            row = dict(row)
+            aggregate = RunningAggregate(**{key: value for key, value in row.items()
+                                            if key not in ("run_id", "model", "variant", "updated")})
+            aggregates.setdefault(row["model"], {})[row["variant"]] = aggregate.summary()
+        return aggregates
+
+    def compare(self, run_ids: list[str], by: str = "target") -> list[dict]:
+        """Accuracy per group (target part or category), run and model, e.g. model A vs B per part type.
+            Served from the covering indexes, so it does not touch the stored results.
+        """
+        if by not in ("target", "category"):
+            raise ValueError(f"Cannot group by {by}, use target or category.")
+        placeholders = ", ".join("?" * len(run_ids))
+        rows = self.connection.execute(
+            f"SELECT {by}, run_id, model, COUNT(*), SUM(correct) FROM results "
+            f"WHERE run_id IN ({placeholders}) GROUP BY {by}, run_id, model ORDER BY {by}, run_id, model", run_ids)
+        return [{by: group, "run_id": run_id, "model": model, "tests": tests, "correct": correct,
+                 "accuracy": correct / tests, "accuracy_ci95": wilson_interval(correct, tests)}
+                for group, run_id, model, tests, correct in rows]
+
+    def runs(self) -> list[tuple[str, int, float]]:
+        """Run ids with their number of results and time of the last update."""
+        return self.connection.execute(
+            "SELECT run_id, SUM(tests), MAX(updated) FROM aggregates GROUP BY run_id ORDER BY MAX(updated)").fetchall()
+
+    def checkpointed(self, run_id: str, variant: str,
+                     evaluate_test: Callable[[Path, str], Awaitable[dict]]) -> Callable[[Path, str], Awaitable[dict]]:
+        """Wrap an evaluate_test coroutine for batch_runner.run_batch: cases already stored for this run and
+            variant are returned from the store, new results are stored as soon as they are scored.
+            Failed tests are not stored, so a resumed run retries them.
+        """
+        finished = self.finished(run_id)
+
+        async def evaluate(test: Path, model: str) -> dict:
+            stored = finished.get((model, variant, case_id(test)))
+            if stored is not None:
+                return stored
+            result = await evaluate_test(test, model)
+            self.put(run_id, result)
+            return result
+
+        return evaluate
+
+    def close(self):
+        self.connection.close()
+
+
+def print_aggregates(aggregates: dict[str, dict[str, dict]]):
+    def fmt(entry, spec=".3f"):
+        if entry is None:
+            return "-"
+        low, high = entry["ci95"]
+        return f"{entry['mean']:{spec}} [{low:{spec}}, {high:{spec}}]"
+
+    for model, variants in aggregates.items():
+        for variant, entry in variants.items():
+            low, high = entry["accuracy_ci95"] or (0.0, 0.0)
+            print(f"{model} ({variant}): {entry['correct']}/{entry['tests']} correct, "
+                  f"accuracy {entry['accuracy'] or 0.0:.3f} [{low:.3f}, {high:.3f}], score {fmt(entry['score'])}, "
+                  f"IoU {fmt(entry['iou'])}, click distance {fmt(entry['click_distance'], '.1f')} px")
+
+
+def add_store_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--store", type=str, metavar="FILE", default=None,
+                        help="SQLite results store, every scored test is written to it as soon as it finishes.")
+    parser.add_argument("--run-id", type=str, default=None,
+                        help="Run id in the store, reuse the id of an interrupted run to skip its finished tests. "
+                             "Defaults to a new id from the current time. A run is resumed only with the same "
+                             "pipeline settings (mode, category).")
+
+
+def store_from_args(args: argparse.Namespace, config: dict) -> tuple[ResultsStore | None, str | None]:
+    """Open the store of --store and start or resume the run, config are the pipeline settings of the run."""
+    if not args.store:
+        return None, None
+    run_id = args.run_id or time.strftime("%Y%m%d-%H%M%S")
+    store = ResultsStore(Path(args.store))
+    try:
+        store.start_run(run_id, config)
+    except ValueError:
+        store.close()
+        raise
+    print(f"Storing results in {args.store} as run {run_id}")
+    return store, run_id
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Query the results store of benchmark runs")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    runs_parser = subparsers.add_parser("runs", help="List the stored runs.")
+    runs_parser.add_argument("store", type=str, metavar="FILE")
+    watch_parser = subparsers.add_parser("watch", help="Print the running aggregates of a run.")
+    watch_parser.add_argument("store", type=str, metavar="FILE")
+    watch_parser.add_argument("run_id", type=str)
+    watch_parser.add_argument("--interval", type=float, default=0, help="Repeat every N seconds, 0 prints once.")
+    compare_parser = subparsers.add_parser("compare", help="Accuracy per target part or category across runs and models.")
+    compare_parser.add_argument("store", type=str, metavar="FILE")
+    compare_parser.add_argument("run_ids", nargs="+", type=str)
+    compare_parser.add_argument("--by", choices=["target", "category"], default="target")
+    args = parser.parse_args()
+
+    store = ResultsStore(Path(args.store))
+    if args.command == "runs":
+        for run_id, tests, updated in store.runs():
+            print(f"{run_id}: {tests} results, last update {time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(updated))}")
+    elif args.command == "watch":
+        while True:
+            print_aggregates(store.aggregates(args.run_id))
+            if not args.interval:
+                break
+            time.sleep(args.interval)
+            print()
+    else:
+        for row in store.compare(args.run_ids, args.by):
+            low, high = row["accuracy_ci95"]
+            print(f"{row[args.by]!s:24} {row['run_id']:20} {row['model']:40} {row['correct']:6}/{row['tests']:<6} "
+                  f"{row['accuracy']:.3f} [{low:.3f}, {high:.3f}]")
+    store.close()
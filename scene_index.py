@@ -0,0 +1,175 @@
+import argparse
+import json
+from pathlib import Path
+from typing import TYPE_CHECKING
+
+from prompts import part_names
+from tim_parser import FLAGS_3, parse_tim
+from utils import relative_case_id
+
+if TYPE_CHECKING:
+    # numpy is imported once an index is built or loaded, load_scene and --help of the scripts do not need it
+    import numpy as np
+
+FLAG_BITS = {name: mask for mask, name in FLAGS_3.items()}
+
+
+def load_scene(scene_path: Path) -> dict:
+    """Load a scene from its exported .json, falling back to the .TIM file for levels without an export.
+        The .json carries the names of all parts, the .TIM parser only knows the ids seen in the examples.
+    """
+    json_path = scene_path.with_suffix(".json")
+    if json_path.exists():
+        with open(json_path, "r") as f:
+            return json.load(f)
+    return parse_tim(scene_path.with_suffix(".TIM"))
+
+
+def _flags_value(flag_names: list[str]) -> int:
+    value = 0
+    for name in flag_names:
+        if name in FLAG_BITS:
+            value |= FLAG_BITS[name]
+        elif name.startswith("UNKNOWN_0x"):
+            value |= int(name[len("UNKNOWN_"):], 16)
+    return value
+
+
+def build_index(root: Path) -> dict[str, "np.ndarray"]:
+    """Scan a dataset tree once and collect all parts in fixed-width columns.
+        Parts of scene i are the rows scene_offsets[i]:scene_offsets[i + 1] of the part columns.
+        Args:
+            root (Path): Directory that is searched recursively for .TIM (or .json) scenes. Scene ids are the case
+                ids of utils.discover_tests for the same directory as --input.
+        Returns:
+            dict[str, np.ndarray]: scene_ids, scene_offsets, part_type, x, y, width, height, flags and
+                part_type_names, the names of the part_type ids: the catalog in parts.txt order, followed by the
+                names outside the catalog (e.g. RED_BRICK_WALL) in the order they were found.
+    """
+    import numpy as np
+
+    scene_paths = sorted({path.with_suffix("") for pattern in ("*.TIM", "*.json") for path in root.rglob(pattern)})
+    scene_ids = []
+    offsets = [0]
+    columns = {"part_type": [], "x": [], "y": [], "width": [], "height": [], "flags": []}
+    type_names = part_names()
+    type_ids = {name: type_id for type_id, name in enumerate(type_names)}
+    for scene_path in scene_paths:
+        scene = load_scene(scene_path)
+        # understanding tests only carry the solution, they have no parts to index
+        if "parts" not in scene:
+            continue
+        scene_ids.append(relative_case_id(scene_path, root))
+        for part in scene["parts"]:
+            if part["part_type"] not in type_ids:
+                type_ids[part["part_type"]] = len(type_names)
+                type_names.append(part["part_type"])
+            columns["part_type"].append(type_ids[part["part_type"]])
+            columns["x"].append(part["position"]["x"])
+            columns["y"].append(part["position"]["y"])
+            columns["width"].append(part["size"]["width_1"])
+            columns["height"].append(part["size"]["height_1"])
+            columns["flags"].append(_flags_value(part.get("flags_3", [])))
+        offsets.append(len(columns["part_type"]))
+
+    return {
+        "scene_ids": np.array(scene_ids, dtype=str),
+        "scene_offsets": np.array(offsets, dtype=np.int64),
+        "part_type": np.array(columns["part_type"], dtype=np.uint16),
+        "x": np.array(columns["x"], dtype=np.int16),
+        "y": np.array(columns["y"], dtype=np.int16),
+        "width": np.array(columns["width"], dtype=np.int16),
+        "height": np.array(columns["height"], dtype=np.int16),
+        "flags": np.array(columns["flags"], dtype=np.uint16),
+        "part_type_names": np.array(type_names, dtype=str),
+    }
+
+
+class SceneIndex:
+    """Columnar index of all parts of a dataset, written by `python scene_index.py build`."""
+
+    def __init__(self, index_path: Path):
+        import numpy as np
+
+        with np.load(index_path) as data:
+            self.columns = {name: data[name] for name in data.files}
+        if "part_type_names" not in self.columns:
+            raise ValueError(f"{index_path} was built by an older version, rebuild it with `python scene_index.py build`.")
+        self.scene_ids = self.columns["scene_ids"]
+        self.part_type_names = self.columns["part_type_names"].tolist()
+        self.part_type_ids = {name: type_id for type_id, name in enumerate(self.part_type_names)}
+        self.offsets = self.columns["scene_offsets"]
+        self.positions = {scene_id: i for i, scene_id in enumerate(self.scene_ids.tolist())}
+        self.part_scene = np.repeat(np.arange(len(self.scene_ids)), np.diff(self.offsets))
+
+    def __len__(self):
+        return len(self.scene_ids)
+
+    def __contains__(self, scene_id: str):
+        return scene_id in self.positions
+
+    def _rows(self, scene_id: str) -> slice:
+        i = self.positions[scene_id]
+        return slice(self.offsets[i], self.offsets[i + 1])
+
+    def boxes(self, scene_id: str) -> tuple["np.ndarray", "np.ndarray"]:
+        """Part type ids and [x_min, y_min, x_max, y_max] boxes of all parts of a scene."""
+        import numpy as np
+
+        rows = self._rows(scene_id)
+        x = self.columns["x"][rows].astype(np.int32)
+        y = self.columns["y"][rows].astype(np.int32)
+        boxes = np.stack([x, y, x + self.columns["width"][rows], y + self.columns["height"][rows]], axis=1)
+        return self.columns["part_type"][rows], boxes
+
+    def ground_truth(self, scene_id: str) -> str:
+        """Same result as main_grounding_dominik.parse_ground_truth."""
+        part_types, _ = self.boxes(scene_id)
+        return ",".join(self.part_type_names[part_id] for part_id in part_types) if len(part_types) else "NONE"
+
+    def ground_truth_bbox(self, scene_id: str) -> tuple[str | None, list[int]]:
+        """Same result as main_grounding_dominik.parse_ground_truth_bbox."""
+        part_types, boxes = self.boxes(scene_id)
+        if not len(part_types):
+            return (None, [])
+        return (self.part_type_names[part_types[0]], boxes[0].tolist())
+
+    def ground_truth_bboxes(self, scene_id: str) -> list[tuple[str, list[int]]]:
+        """Same result as main_grounding_dominik.parse_ground_truth_bboxes."""
+        part_types, boxes = self.boxes(scene_id)
+        return [(self.part_type_names[part_id], box) for part_id, box in zip(part_types, boxes.tolist())]
+
+    def scenes_with(self, part_type: str) -> list[str]:
+        """Ids of all scenes containing at least one part of the given type, empty if no scene has one.
+            Raises:
+                ValueError: If the part type is neither in the part catalog nor in any indexed scene.
+        """
+        import numpy as np
+
+        if part_type not in self.part_type_ids:
+            raise ValueError(f"Part type {part_type} is neither in the part catalog nor in the index.")
+        mask = self.columns["part_type"] == self.part_type_ids[part_type]
+        return self.scene_ids[np.unique(self.part_scene[mask])].tolist()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Build or query the columnar scene index")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    build_parser = subparsers.add_parser("build", help="Index all scenes below a directory.")
+    build_parser.add_argument("root", type=str, metavar="DIR")
+    build_parser.add_argument("--output", type=str, metavar="FILE", default="scene_index.npz")
+    query_parser = subparsers.add_parser("query", help="List scenes that contain a part type.")
+    query_parser.add_argument("index", type=str, metavar="FILE")
+    query_parser.add_argument("--part-type", type=str, required=True, help="e.g. TEETER_TOTTER")
+    args = parser.parse_args()
+
+    if args.command == "build":
+        # not `as np`, which would redefine the np of the type annotations at module level
+        import numpy
+
+        columns = build_index(Path(args.root))
+        numpy.savez(args.output, **columns)
+        print(f"Indexed {len(columns['scene_ids'])} scenes with {len(columns['part_type'])} parts to {args.output}")
+    else:
+        for scene_id in SceneIndex(Path(args.index)).scenes_with(args.part_type):
+            print(scene_id)
@@ -0,0 +1,266 @@
+import argparse
+import asyncio
+import base64
+import json
+import random
+import struct
+import time
+from dataclasses import dataclass
+from email.utils import parsedate_to_datetime
+from pathlib import Path
+from typing import TYPE_CHECKING, Awaitable, Callable
+
+if TYPE_CHECKING:
+    # openai takes most of the startup time, it is imported once the first request is sent
+    import openai
+    from openai.types.chat import ChatCompletion
+
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+DEFAULT_IMAGE_TOKENS = 1000
+# base64 characters decoded to find the image size, enough for the EXIF-free JPEG headers written by utils
+IMAGE_HEADER_CHARS = 4096
+
+
+@dataclass
+class RateLimits:
+    rpm: float | None = None  # requests per minute
+    tpm: float | None = None  # tokens per minute
+
+
+class TokenBucket:
+    """Async token bucket, refilled continuously at rate_per_minute / 60 per second.
+        The bucket holds at most ten seconds of budget, so a run never starts with a burst
+        that a sliding-window rate limit at the provider would reject.
+    """
+
+    def __init__(self, rate_per_minute: float | None):
+        self.rate_per_minute = rate_per_minute
+        self.rate = rate_per_minute / 60.0 if rate_per_minute else None
+        self.capacity = max(rate_per_minute / 6.0, 1.0) if rate_per_minute else None
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    async def acquire(self, amount: float = 1.0):
+        """Wait until the bucket holds amount and take it.
+            The pause of a 429 is checked again after every wait, also by requests that were already waiting
+            for budget. The lock only guards the bookkeeping, so waiting requests do not block each other.
+        """
+        while True:
+            async with self.lock:
+                delay = self.paused_until - time.monotonic()
+                if delay <= 0:
+                    if self.rate is None:
+                        return
+                    amount = min(amount, self.capacity)
+                    self._refill()
+                    if self.tokens >= amount:
+                        self.tokens -= amount
+                        return
+                    delay = (amount - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+
+    def adjust(self, amount: float):
+        """Take (or give back) budget after the fact, e.g. once the real token usage is known."""
+        if self.rate is None:
+            return
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+    def pause(self, seconds: float):
+        self.paused_until = max(self.paused_until, time.monotonic() + seconds)
+
+    def slow_down(self, factor: float = 0.5):
+        if self.rate is not None:
+            self.rate = max(self.rate * factor, self.rate_per_minute / 60.0 / 16)
+
+    def speed_up(self, factor: float = 1.05):
+        if self.rate is not None:
+            self.rate = min(self.rate * factor, self.rate_per_minute / 60.0)
+
+
+def estimate_request_tokens(request: dict) -> int:
+    """Rough prompt size of a chat request: 4 characters per text token and 28x28 pixels per image token."""
+    tokens = 0
+    for message in request.get("messages", []):
+        content = message.get("content")
+        if isinstance(content, str):
+            tokens += len(content) // 4
+            continue
+        for item in content or []:
+            if item.get("type") == "text":
+                tokens += len(item["text"]) // 4
+            elif item.get("type") == "image_url":
+                tokens += estimate_image_tokens(item["image_url"]["url"])
+    return tokens + request.get("max_tokens", 0)
+
+
+def estimate_image_tokens(data_url: str) -> int:
+    header = data_url.split(",", 1)
+    if len(header) != 2 or not header[0].startswith("data:image/"):
+        return DEFAULT_IMAGE_TOKENS
+    # the size is in the first bytes of PNG and WEBP, JPEG stores it after the tables of its header
+    data = base64.b64decode(header[1][:IMAGE_HEADER_CHARS])
+    size = image_size(data)
+    if size is None:
+        return DEFAULT_IMAGE_TOKENS
+    width, height = size
+    return max(1, (width * height) // (28 * 28))
+
+
+def image_size(data: bytes) -> tuple[int, int] | None:
+    """Width and height from the header of a PNG, JPEG or WEBP file, None for other or truncated data."""
+    try:
+        if data.startswith(b"\x89PNG"):
+            return struct.unpack(">II", data[16:24])
+        if data.startswith(b"RIFF") and data[8:12] == b"WEBP":
+            chunk = data[12:16]
+            if chunk == b"VP8 ":
+                width, height = struct.unpack("<HH", data[26:30])
+                return width & 0x3FFF, height & 0x3FFF
+            if chunk == b"VP8L":
+                bits = int.from_bytes(data[21:25], "little")
+                return (bits & 0x3FFF) + 1, ((bits >> 14) & 0x3FFF) + 1
+            if chunk == b"VP8X":
+                return int.from_bytes(data[24:27], "little") + 1, int.from_bytes(data[27:30], "little") + 1
+            return None
+        if data.startswith(b"\xff\xd8"):
+            offset = 2
+            while offset + 9 <= len(data) and data[offset] == 0xFF:
+                marker = data[offset + 1]
+                # start of frame, except the DHT, JPG and DAC markers in the same range
+                if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+                    height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+                    return width, height
+                offset += 2 + struct.unpack(">H", data[offset + 2:offset + 4])[0]
+    except struct.error:
+        pass
+    return None
+
+
+def retry_after_seconds(error: "openai.APIStatusError") -> float | None:
+    """Delay requested by the provider via Retry-After (seconds or HTTP date) or retry-after-ms."""
+    headers = error.response.headers if error.response is not None else {}
+    if "retry-after-ms" in headers:
+        try:
+            return float(headers["retry-after-ms"]) / 1000.0
+        except ValueError:
+            pass
+    value = headers.get("retry-after")
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+class ModelScheduler:
+    """Rate limits and retries all requests for one model."""
+
+    def __init__(self, model: str, limits: RateLimits, max_retries: int = 5, base_delay: float = 1.0,
+                 max_delay: float = 60.0):
+        self.model = model
+        self.requests = TokenBucket(limits.rpm)
+        self.tokens = TokenBucket(limits.tpm)
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self.stats = {"requests": 0, "retries": 0, "rate_limited": 0, "failed": 0}
+
+    async def submit(self, create: Callable[[], Awaitable["ChatCompletion"]], estimated_tokens: int = 0,
+                     trace: dict | None = None) -> "ChatCompletion":
+        """Run create() once the model has budget, retrying transient errors with exponential backoff and full jitter.
+            The request is retried unchanged, so every attempt is idempotent.
+            If given, trace collects the time spent waiting for budget (queue_wait) and the number of attempts.
+        """
+        import openai
+
+        trace = trace if trace is not None else {}
+        for attempt in range(self.max_retries + 1):
+            waiting = time.perf_counter()
+            await self.requests.acquire(1)
+            await self.tokens.acquire(estimated_tokens)
+            trace["queue_wait"] = trace.get("queue_wait", 0.0) + time.perf_counter() - waiting
+            trace["attempts"] = attempt + 1
+            self.stats["requests"] += 1
+            try:
+                response = await create()
+            except (openai.APIConnectionError, openai.APIStatusError) as e:
+                status_code = getattr(e, "status_code", None)
+                retryable = isinstance(e, openai.APIConnectionError) or status_code in RETRYABLE_STATUS_CODES
+                if not retryable or attempt == self.max_retries:
+                    self.stats["failed"] += 1
+                    raise
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
+                if status_code == 429:
+                    self.stats["rate_limited"] += 1
+                    retry_after = retry_after_seconds(e)
+                    if retry_after is not None:
+                        delay = retry_after + random.uniform(0, self.base_delay)
+                    # everyone waiting for this model backs off, not just this request
+                    self.requests.pause(delay)
+                    self.requests.slow_down()
+                    self.tokens.slow_down()
+                self.stats["retries"] += 1
+                print(f"{self.model}: {e.__class__.__name__} (status {status_code}), retry {attempt + 1}/{self.max_retries} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+                continue
+            self.requests.speed_up()
+            self.tokens.speed_up()
+            if response.usage is not None:
+                self.tokens.adjust(response.usage.total_tokens - estimated_tokens)
+            return response
+        raise RuntimeError("unreachable")
+
+
+class Scheduler:
+    """One ModelScheduler per model, so several models are rate limited independently and run side by side."""
+
+    def __init__(self, default_limits: RateLimits, model_limits: dict[str, RateLimits] | None = None,
+                 max_retries: int = 5):
+        self.default_limits = default_limits
+        self.model_limits = model_limits or {}
+        self.max_retries = max_retries
+        self.models: dict[str, ModelScheduler] = {}
+
+    def for_model(self, model: str) -> ModelScheduler:
+        if model not in self.models:
+            limits = self.model_limits.get(model, self.default_limits)
+            self.models[model] = ModelScheduler(model, limits, max_retries=self.max_retries)
+        return self.models[model]
+
+    async def submit(self, model: str, create: Callable[[], Awaitable["ChatCompletion"]],
+                     estimated_tokens: int = 0, trace: dict | None = None) -> "ChatCompletion":
+        return await self.for_model(model).submit(create, estimated_tokens, trace)
+
+    def print_stats(self):
+        for model, model_scheduler in self.models.items():
+            print(f"{model}: {model_scheduler.stats}")
+
+
+def add_scheduler_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--rpm", type=float, default=None, help="Requests per minute per model.")
+    parser.add_argument("--tpm", type=float, default=None, help="Tokens per minute per model.")
+    parser.add_argument("--rate-limits", type=str, metavar="FILE", default=None,
+                        help='JSON file with per model limits, e.g. {"bytedance/ui-tars-1.5-7b": {"rpm": 60, "tpm": 100000}}.')
+    parser.add_argument("--max-retries", type=int, default=5,
+                        help="Retries of rate limited (429), server (5xx) and connection errors.")
+
+
+def scheduler_from_args(args: argparse.Namespace) -> Scheduler:
+    model_limits = {}
+    if args.rate_limits:
+        with open(Path(args.rate_limits), "r") as f:
+            model_limits = {model: RateLimits(**limits) for model, limits in json.load(f).items()}
+    return Scheduler(RateLimits(rpm=args.rpm, tpm=args.tpm), model_limits, max_retries=args.max_retries)
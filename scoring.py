@@ -0,0 +1,336 @@
+import argparse
+import json
+from pathlib import Path
+
+import numpy as np
+
+from scene_index import SceneIndex
+
+IOU_THRESHOLDS = (0.5, 0.55, 0.6, 0.65, 0.7, 0.75, 0.8, 0.85, 0.9, 0.95)
+
+
+def iou_matrix(pred_boxes: np.ndarray, gt_boxes: np.ndarray) -> np.ndarray:
+    """IoU of every predicted against every ground truth box.
+        Args:
+            pred_boxes (np.ndarray): (N, 4) boxes as [x_min, y_min, x_max, y_max].
+            gt_boxes (np.ndarray): (M, 4) boxes as [x_min, y_min, x_max, y_max].
+        Returns:
+            np.ndarray: (N, M) IoU matrix.
+    """
+    pred_boxes = np.asarray(pred_boxes, dtype=np.float64).reshape(-1, 4)
+    gt_boxes = np.asarray(gt_boxes, dtype=np.float64).reshape(-1, 4)
+    return pairwise_iou(pred_boxes[:, None, :], gt_boxes[None, :, :])
+
+
+def pairwise_iou(boxes_a: np.ndarray, boxes_b: np.ndarray) -> np.ndarray:
+    """Element-wise IoU of two broadcastable arrays of boxes with the coordinates in the last axis."""
+    x_a = np.maximum(boxes_a[..., 0], boxes_b[..., 0])
+    y_a = np.maximum(boxes_a[..., 1], boxes_b[..., 1])
+    x_b = np.minimum(boxes_a[..., 2], boxes_b[..., 2])
+    y_b = np.minimum(boxes_a[..., 3], boxes_b[..., 3])
+    inter_area = np.clip(x_b - x_a, 0, None) * np.clip(y_b - y_a, 0, None)
+    area_a = (boxes_a[..., 2] - boxes_a[..., 0]) * (boxes_a[..., 3] - boxes_a[..., 1])
+    area_b = (boxes_b[..., 2] - boxes_b[..., 0]) * (boxes_b[..., 3] - boxes_b[..., 1])
+    union = area_a + area_b - inter_area
+    return np.divide(inter_area, union, out=np.zeros_like(inter_area, dtype=np.float64), where=union > 0)
+
+
+def hungarian(cost: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    """Minimum cost assignment of a (N, M) cost matrix.
+        Returns:
+            tuple[np.ndarray, np.ndarray]: Row and column indices of the min(N, M) assigned pairs.
+    """
+    cost = np.asarray(cost, dtype=np.float64)
+    transposed = cost.shape[0] > cost.shape[1]
+    if transposed:
+        cost = cost.T
+    n, m = cost.shape
+    # potentials formulation (rows <= columns), index 0 is a virtual column
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    assigned_row = np.zeros(m + 1, dtype=np.int64)
+    way = np.zeros(m + 1, dtype=np.int64)
+    for i in range(1, n + 1):
+        assigned_row[0] = i
+        j0 = 0
+        min_slack = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = assigned_row[j0]
+            slack = cost[i0 - 1] - u[i0] - v[1:]
+            free = ~used[1:]
+            improved = free & (slack < min_slack[1:])
+            min_slack[1:][improved] = slack[improved]
+            way[1:][improved] = j0
+            candidates = np.where(free, min_slack[1:], np.inf)
+            j1 = int(np.argmin(candidates)) + 1
+            delta = candidates[j1 - 1]
+            u[assigned_row[used]] += delta
+            v[used] -= delta
+            min_slack[1:][free] -= delta
+            j0 = j1
+            if assigned_row[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            assigned_row[j0] = assigned_row[j1]
+            j0 = j1
+    cols = np.nonzero(assigned_row[1:])[0]
+    rows = assigned_row[1:][cols] - 1
+    order = np.argsort(rows)
+    rows, cols = rows[order], cols[order]
+    return (cols, rows) if transposed else (rows, cols)
+
+
+def greedy_match(iou: np.ndarray, iou_threshold: float) -> tuple[np.ndarray, np.ndarray]:
+    """Repeatedly match the highest remaining IoU pair above the threshold."""
+    rows, cols = np.nonzero(iou >= iou_threshold)
+    order = np.argsort(-iou[rows, cols], kind="stable")
+    matched_rows, matched_cols = [], []
+    used_rows, used_cols = set(), set()
+    for row, col in zip(rows[order].tolist(), cols[order].tolist()):
+        if row in used_rows or col in used_cols:
+            continue
+        used_rows.add(row)
+        used_cols.add(col)
+        matched_rows.append(row)
+        matched_cols.append(col)
+    return np.array(matched_rows, dtype=np.int64), np.array(matched_cols, dtype=np.int64)
+
+
+def match_boxes(pred_labels: np.ndarray, pred_boxes: np.ndarray, gt_labels: np.ndarray, gt_boxes: np.ndarray,
+                iou_threshold: float = 0.5, method: str = "greedy") -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Match predictions of one scene to its ground truth, only boxes with equal labels can match.
+        Args:
+            method (str): "greedy" (by IoU) or "hungarian" (maximal total IoU).
+        Returns:
+            tuple: Indices of matched predictions, indices of matched ground truth boxes and their IoU.
+    """
+    iou = iou_matrix(pred_boxes, gt_boxes)
+    iou[np.asarray(pred_labels)[:, None] != np.asarray(gt_labels)[None, :]] = 0.0
+    if method == "hungarian":
+        rows, cols = hungarian(-iou) if iou.size else (np.zeros(0, np.int64), np.zeros(0, np.int64))
+        keep = iou[rows, cols] >= iou_threshold
+        rows, cols = rows[keep], cols[keep]
+    elif method == "greedy":
+        rows, cols = greedy_match(iou, iou_threshold)
+    else:
+        raise ValueError(f"Matching method {method} is not supported.")
+    return rows, cols, iou[rows, cols]
+
+
+def _flatten(scenes: list[tuple[list, list]]) -> dict[str, np.ndarray]:
+    """Concatenate (predictions, ground truth) of all scenes into flat arrays with a scene column."""
+    predictions = [[(label, bbox) for label, bbox in scene_predictions if label is not None and len(bbox) == 4]
+                   for scene_predictions, _ in scenes]
+    ground_truth = [scene_ground_truth for _, scene_ground_truth in scenes]
+    columns = {}
+    for prefix, boxes_per_scene in (("pred", predictions), ("gt", ground_truth)):
+        counts = np.fromiter((len(boxes) for boxes in boxes_per_scene), dtype=np.int64, count=len(scenes))
+        flat_boxes = [item for boxes in boxes_per_scene for item in boxes]
+        columns[f"{prefix}_scene"] = np.repeat(np.arange(len(scenes)), counts)
+        columns[f"{prefix}_label"] = np.array([label for label, _ in flat_boxes], dtype=str)
+        columns[f"{prefix}_box"] = np.array([bbox for _, bbox in flat_boxes], dtype=np.float64).reshape(-1, 4)
+    return columns
+
+
+def _candidate_pairs(flat: dict[str, np.ndarray]) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """All (prediction, ground truth) pairs that share scene and label, with their IoU, in one shot."""
+    labels, label_codes = np.unique(np.concatenate([flat["pred_label"], flat["gt_label"]]), return_inverse=True)
+    pred_key = flat["pred_scene"] * len(labels) + label_codes[:len(flat["pred_label"])]
+    gt_key = flat["gt_scene"] * len(labels) + label_codes[len(flat["pred_label"]):]
+    gt_order = np.argsort(gt_key, kind="stable")
+    sorted_gt_key = gt_key[gt_order]
+    start = np.searchsorted(sorted_gt_key, pred_key, side="left")
+    counts = np.searchsorted(sorted_gt_key, pred_key, side="right") - start
+    pred_index = np.repeat(np.arange(len(pred_key)), counts)
+    # position of every pair inside its group of ground truth boxes
+    within = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    gt_index = gt_order[np.repeat(start, counts) + within]
+    iou = pairwise_iou(flat["pred_box"][pred_index], flat["gt_box"][gt_index])
+    return pred_index, gt_index, iou
+
+
+def _greedy_pairs(pred_index: np.ndarray, gt_index: np.ndarray, iou: np.ndarray,
+                  iou_threshold: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    keep = iou >= iou_threshold
+    pred_index, gt_index, iou = pred_index[keep], gt_index[keep], iou[keep]
+    # pairs whose prediction and ground truth box have no other candidate need no greedy pass
+    pred_counts = np.bincount(pred_index, minlength=pred_index.max(initial=-1) + 1)
+    gt_counts = np.bincount(gt_index, minlength=gt_index.max(initial=-1) + 1)
+    unique = (pred_counts[pred_index] == 1) & (gt_counts[gt_index] == 1)
+    matches = np.nonzero(unique)[0].tolist()
+    conflicts = np.nonzero(~unique)[0]
+    used_pred, used_gt = set(), set()
+    for i in conflicts[np.argsort(-iou[conflicts], kind="stable")].tolist():
+        p, g = int(pred_index[i]), int(gt_index[i])
+        if p in used_pred or g in used_gt:
+            continue
+        used_pred.add(p)
+        used_gt.add(g)
+        matches.append(i)
+    matches = np.sort(np.array(matches, dtype=np.int64))
+    return pred_index[matches], gt_index[matches], iou[matches]
+
+
+def average_precision(true_positive: np.ndarray, num_ground_truth: int) -> float:
+    """All-point interpolated AP of predictions that are already sorted by confidence."""
+    if num_ground_truth == 0:
+        return float("nan")
+    tp = np.cumsum(true_positive)
+    fp = np.cumsum(~true_positive)
+    recall = np.concatenate([[0.0], tp / num_ground_truth])
+    precision = np.concatenate([[1.0], tp / np.maximum(tp + fp, 1)])
+    precision = np.maximum.accumulate(precision[::-1])[::-1]
+    return float(np.sum((recall[1:] - recall[:-1]) * precision[1:]))
+
+
+def score_boxes(scenes: list[tuple[list, list]], iou_thresholds=IOU_THRESHOLDS, method: str = "greedy") -> dict:
+    """Score labelled boxes of many scenes at once.
+        Predictions carry no confidence, so their order in the model response is used as ranking for AP.
+        Args:
+            scenes (list): Per scene a tuple (predictions, ground_truth), each a list of (label, [x_min, y_min, x_max, y_max]).
+            iou_thresholds (tuple): Thresholds for mAP, per-label precision/recall use the first one.
+            method (str): "greedy" (vectorized candidate pairs) or "hungarian" (optimal assignment per scene).
+        Returns:
+            dict: Counts, mean IoU of matches, per-label precision/recall/AP and mAP per threshold.
+    """
+    flat = _flatten(scenes)
+    if method == "hungarian":
+        matches = {threshold: _hungarian_pairs(flat, threshold) for threshold in iou_thresholds}
+    else:
+        candidates = _candidate_pairs(flat)
+        matches = {threshold: _greedy_pairs(*candidates, threshold) for threshold in iou_thresholds}
+
+    labels = np.unique(np.concatenate([flat["pred_label"], flat["gt_label"]]))
+    per_label = {}
+    average_precisions = {threshold: [] for threshold in iou_thresholds}
+    for threshold in iou_thresholds:
+        true_positive = np.zeros(len(flat["pred_label"]), dtype=bool)
+        true_positive[matches[threshold][0]] = True
+        for label in labels.tolist():
+            pred_mask = flat["pred_label"] == label
+            num_gt = int(np.sum(flat["gt_label"] == label))
+            ap = average_precision(true_positive[pred_mask], num_gt)
+            if num_gt:
+                average_precisions[threshold].append(ap)
+            if threshold == iou_thresholds[0]:
+                tp = int(np.sum(true_positive[pred_mask]))
+                num_pred = int(np.sum(pred_mask))
+                per_label[label] = {
+                    "predictions": num_pred,
+                    "ground_truth": num_gt,
+                    "precision": tp / num_pred if num_pred else 0.0,
+                    "recall": tp / num_gt if num_gt else 0.0,
+                    "ap": ap,
+                }
+
+    map_per_threshold = {f"{t:.2f}": float(np.mean(average_precisions[t])) if average_precisions[t] else 0.0
+                         for t in iou_thresholds}
+    first_matches = matches[iou_thresholds[0]]
+    return {
+        "scenes": len(scenes),
+        "predictions": int(len(flat["pred_label"])),
+        "ground_truth": int(len(flat["gt_label"])),
+        "matched": int(len(first_matches[0])),
+        "mean_iou": float(np.mean(first_matches[2])) if len(first_matches[2]) else 0.0,
+        "map": map_per_threshold,
+        "map_50_95": float(np.mean(list(map_per_threshold.values()))),
+        "per_label": per_label,
+    }
+
+
+def _hungarian_pairs(flat: dict[str, np.ndarray], iou_threshold: float) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    pred_rows, gt_rows, ious = [], [], []
+    pred_bounds = np.searchsorted(flat["pred_scene"], np.arange(flat["pred_scene"].max(initial=-1) + 2))
+    gt_bounds = np.searchsorted(flat["gt_scene"], np.arange(flat["pred_scene"].max(initial=-1) + 2))
+    for scene in range(len(pred_bounds) - 1):
+        p0, p1 = pred_bounds[scene], pred_bounds[scene + 1]
+        g0, g1 = gt_bounds[scene], gt_bounds[scene + 1]
+        if p0 == p1 or g0 == g1:
+            continue
+        rows, cols, iou = match_boxes(flat["pred_label"][p0:p1], flat["pred_box"][p0:p1],
+                                      flat["gt_label"][g0:g1], flat["gt_box"][g0:g1], iou_threshold, "hungarian")
+        pred_rows.append(rows + p0)
+        gt_rows.append(cols + g0)
+        ious.append(iou)
+    if not pred_rows:
+        return np.zeros(0, np.int64), np.zeros(0, np.int64), np.zeros(0)
+    return np.concatenate(pred_rows), np.concatenate(gt_rows), np.concatenate(ious)
+
+
+def score_points(points: np.ndarray, gt_boxes: np.ndarray) -> dict:
+    """Score click points (UI-TARS) against the ground truth box of each test.
+        Args:
+            points (np.ndarray): (K, 2) clicked points, (-1, -1) marks an unparsable response.
+            gt_boxes (np.ndarray): (K, 4) ground truth boxes as [x_min, y_min, x_max, y_max].
+        Returns:
+            dict: Hit rate (point inside the box), distances to the box center and parse failures.
+    """
+    points = np.asarray(points, dtype=np.float64).reshape(-1, 2)
+    gt_boxes = np.asarray(gt_boxes, dtype=np.float64).reshape(-1, 4)
+    valid = ~np.all(points == -1, axis=1)
+    inside = ((points[:, 0] >= gt_boxes[:, 0]) & (points[:, 0] <= gt_boxes[:, 2]) &
+              (points[:, 1] >= gt_boxes[:, 1]) & (points[:, 1] <= gt_boxes[:, 3]) & valid)
+    centers = (gt_boxes[:, :2] + gt_boxes[:, 2:]) / 2
+    distances = np.linalg.norm(points - centers, axis=1)[valid]
+    return {
+        "points": int(len(points)),
+        "parse_failures": int(np.sum(~valid)),
+        "hit_rate": float(np.mean(inside)) if len(points) else 0.0,
+        "mean_distance": float(np.mean(distances)) if len(distances) else float("nan"),
+        "median_distance": float(np.median(distances)) if len(distances) else float("nan"),
+    }
+
+
+def _as_boxes(value) -> list:
+    """Normalize a (label, bbox) pair or a list of such pairs to a list of pairs."""
+    if not value:
+        return []
+    if len(value) == 2 and (value[0] is None or isinstance(value[0], str)):
+        return [tuple(value)] if value[0] is not None else []
+    return [tuple(item) for item in value]
+
+
+def score_result_files(result_paths: list[Path], method: str = "greedy", scene_index: SceneIndex | None = None) -> dict:
+    """Score grounding result files written with --output.
+        Results with a clicked point as response are scored with score_points, all others with score_boxes.
+        Args:
+            scene_index (SceneIndex | None): Replaces the ground truth of each result with all parts of its scene.
+    """
+    box_scenes, points, point_boxes = [], [], []
+    for result_path in result_paths:
+        with open(result_path, "r") as f:
+            for line in f:
+                result = json.loads(line)
+                if "error" in result:
+                    continue
+                if scene_index is not None and result["case_id"] in scene_index:
+                    ground_truth = scene_index.ground_truth_bboxes(result["case_id"])
+                else:
+                    ground_truth = _as_boxes(result["ground_truth"])
+                response = result["response"]
+                if len(response) == 2 and all(isinstance(v, (int, float)) for v in response):
+                    if ground_truth:
+                        points.append(response)
+                        point_boxes.append(ground_truth[0][1])
+                else:
+                    box_scenes.append((_as_boxes(response), ground_truth))
+    report = {}
+    if box_scenes:
+        report["boxes"] = score_boxes(box_scenes, method=method)
+    if points:
+        report["points"] = score_points(np.array(points), np.array(point_boxes))
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score grounding result files")
+    parser.add_argument("results", nargs="+", type=str, metavar="FILE", help="JSONL result files written with --output.")
+    parser.add_argument("--method", choices=["greedy", "hungarian"], default="greedy", help="Box matching method.")
+    parser.add_argument("--index", type=str, metavar="FILE", help="Scene index that provides the ground truth of all parts.")
+    args = parser.parse_args()
+
+    scene_index = SceneIndex(Path(args.index)) if args.index else None
+    print(json.dumps(score_result_files([Path(p) for p in args.results], args.method, scene_index), indent=2))
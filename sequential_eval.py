@@ -0,0 +1,312 @@
+import argparse
+import asyncio
+import json
+import math
+import random
+from pathlib import Path
+
+import main_grounding_dominik
+import main_understanding
+from batch_runner import CompletionClient, create_async_client, run_batch, write_results
+from dataset_shards import ShardDataset, is_shard_input, open_dataset
+from output_contracts import add_contract_arguments, contracts_from_args
+from response_cache import add_cache_arguments, cache_from_args
+from scheduler import add_scheduler_arguments, scheduler_from_args
+from telemetry import add_telemetry_arguments, category, current_variant, print_report, telemetry_from_args, \
+    write_report
+from utils import add_image_arguments, add_verbose_argument, case_id, configure_test_log, create_image_executor, \
+    discover_tests, get_api_key, image_budget_name, parse_image_budget, release_image_executor
+
+PIPELINES = ["click", "multi_bbox", "understanding"]
+METRICS = ["correct", "score", "iou", "click_distance"]
+
+
+def load_scene(test: Path, dataset: ShardDataset | None = None) -> dict:
+    if dataset is not None:
+        return dataset.scene(case_id(test))
+    with open(test.with_suffix(".json"), "r") as f:
+        return json.load(f)
+
+
+def stratum(test: Path, pipeline: str, dataset: ShardDataset | None = None) -> tuple[str, str]:
+    """(benchmark category, part type) of a test, the part type is the target of grounding tests and the
+        expected answer of understanding tests."""
+    scene = load_scene(test, dataset)
+    if pipeline == "understanding":
+        part_type = str(scene.get("solution"))
+    else:
+        part_type = str(main_grounding_dominik.scene_ground_truth_bbox(scene)[0])
+    return category(case_id(test)), part_type
+
+
+def stratified_order(tests: list[Path], strata: list[tuple[str, str]], seed: int = 0) -> list[Path]:
+    """Shuffle the tests so every prefix holds the strata in about their overall proportions.
+        Within a stratum the order is random, the i-th of n tests of a stratum is placed at (i + u) / n
+        with a random u, so small strata are spread over the whole order instead of clustering at the start.
+    """
+    rng = random.Random(seed)
+    by_stratum: dict[tuple[str, str], list[Path]] = {}
+    for test, key in zip(tests, strata):
+        by_stratum.setdefault(key, []).append(test)
+    placed = []
+    for key in sorted(by_stratum):
+        members = by_stratum[key]
+        rng.shuffle(members)
+        offset = rng.random()
+        placed += [((i + offset) / len(members), rng.random(), test) for i, test in enumerate(members)]
+    return [test for _, _, test in sorted(placed)]
+
+
+def spent_alpha(alpha: float, fraction: float, rho: float = 2.0) -> float:
+    """Share of the error rate spent up to a fraction of the cases, power family alpha * t^rho."""
+    return alpha * min(fraction, 1.0) ** rho
+
+
+def incomplete_beta(a: float, b: float, x: float) -> float:
+    """Regularized incomplete beta function I_x(a, b), continued fraction evaluated with Lentz's method."""
+    if x <= 0.0:
+        return 0.0
+    if x >= 1.0:
+        return 1.0
+    if x > (a + 1) / (a + b + 2):
+        # the continued fraction converges quickly below the mean only
+        return 1.0 - incomplete_beta(b, a, 1.0 - x)
+    front = math.exp(math.lgamma(a + b) - math.lgamma(a) - math.lgamma(b) + a * math.log(x) + b * math.log(1 - x)) / a
+    tiny = 1e-300
+    c, d = 1.0, 1.0 - (a + b) * x / (a + 1)
+    d = 1.0 / (d if abs(d) > tiny else tiny)
+    fraction = d
+    for m in range(1, 300):
+        for numerator in (m * (b - m) * x / ((a + 2 * m - 1) * (a + 2 * m)),
+                          -(a + m) * (a + b + m) * x / ((a + 2 * m) * (a + 2 * m + 1))):
+            d = 1.0 + numerator * d
+            d = 1.0 / (d if abs(d) > tiny else tiny)
+            c = 1.0 + numerator / c
+            c = c if abs(c) > tiny else tiny
+            fraction *= c * d
+        if abs(c * d - 1.0) < 1e-14:
+            break
+    return front * fraction
+
+
+def t_quantile(p: float, df: int) -> float:
+    """Quantile of Student's t distribution with df degrees of freedom, by bisection on its CDF."""
+    if p == 0.5:
+        return 0.0
+    if p < 0.5:
+        return -t_quantile(1 - p, df)
+
+    def upper_tail(t: float) -> float:
+        return 0.5 * incomplete_beta(df / 2, 0.5, df / (df + t * t))
+
+    low, high = 0.0, 1.0
+    while upper_tail(high) > 1 - p:
+        low, high = high, high * 2
+    for _ in range(200):
+        middle = (low + high) / 2
+        if upper_tail(middle) > 1 - p:
+            low = middle
+        else:
+            high = middle
+    return (low + high) / 2
+
+
+class PairedDifference:
+    """Running mean and variance (Welford) of the per-case difference of a metric between two models.
+        Pairs with a non-zero difference are counted as discordant: as long as there are few, the sample variance
+        says nothing about the spread, e.g. it is 0 while both models answered every case alike.
+    """
+
+    def __init__(self):
+        self.n = 0
+        self.discordant = 0
+        self.scale = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, difference: float):
+        self.n += 1
+        self.discordant += difference != 0
+        self.scale = max(self.scale, abs(difference))
+        delta = difference - self.mean
+        self.mean += delta / self.n
+        self.m2 += delta * (difference - self.mean)
+
+    def interval(self, alpha: float) -> tuple[float, float]:
+        """Two-sided (1 - alpha) t confidence interval of the mean difference."""
+        if self.n < 2:
+            return (-math.inf, math.inf)
+        # variance floor: the variance with one more pair at each end of the observed differences (as in the
+        # Agresti-Caffo interval), so a run of equal differences does not give an interval of width 0
+        floor_mean = self.n * self.mean / (self.n + 2)
+        floor_m2 = (self.m2 + self.n * (self.mean - floor_mean) ** 2
+                    + (self.scale - floor_mean) ** 2 + (self.scale + floor_mean) ** 2)
+        variance = max(self.m2 / (self.n - 1), floor_m2 / (self.n + 1))
+        half_width = t_quantile(1 - alpha / 2, self.n - 1) * math.sqrt(variance / self.n)
+        return (self.mean - half_width, self.mean + half_width)
+
+
+def metric_value(result: dict, metric: str) -> float | None:
+    if "error" in result:
+        return None
+    value = result.get(metric)
+    return None if value is None else float(value)
+
+
+def pipeline_evaluate(args, client: CompletionClient, image_options: dict, dataset: ShardDataset | None):
+    if args.pipeline == "click":
+        return lambda test, model: main_grounding_dominik.evaluate_test(client, test, model, image_options, None,
+                                                                       dataset)
+    if args.pipeline == "multi_bbox":
+        return lambda test, model: main_grounding_dominik.evaluate_test_multi(client, test, model, image_options, None,
+                                                                             False, dataset)
+    prompt = main_understanding.get_system_prompt(args.category)
+    return lambda test, model: main_understanding.evaluate_test(client, test, prompt, model, image_options, dataset)
+
+
+def stop_decision(difference: PairedDifference, interval: tuple[float, float], model_a: str, model_b: str,
+                  metric: str, precision: float | None, min_discordant: int) -> str | None:
+    """Decision to stop at this look, None to go on. No stop is allowed before min_discordant pairs differ."""
+    if difference.discordant < min_discordant:
+        return None
+    if interval[0] > 0 or interval[1] < 0:
+        # "higher" rather than "better", a higher click distance is worse
+        return f"{model_a if interval[0] > 0 else model_b} has the higher {metric}"
+    if precision and (interval[1] - interval[0]) / 2 <= precision:
+        return f"difference within +-{precision}"
+    return None
+
+
+async def main(args):
+    configure_test_log(args.verbose)
+    model_a, model_b = args.models
+    if len(args.image_budgets) > 1:
+        raise ValueError(f"The models are compared at one image budget, got {args.image_budgets}. "
+                         "Run one comparison per budget.")
+    dataset = open_dataset(args.input) if is_shard_input(args.input) else None
+    if dataset is not None:
+        tests = dataset.tests(with_task_description=args.pipeline == "understanding")
+    else:
+        suffixes = (".png", ".json", ".py") if args.pipeline == "understanding" else (".png", ".json")
+        tests = discover_tests(args.input, suffixes=suffixes)
+    if not tests:
+        raise FileNotFoundError(f"No tests found for input: {args.input}")
+    tests = stratified_order(tests, [stratum(test, args.pipeline, dataset) for test in tests], args.seed)
+    min_cases = min(args.min_cases, len(tests))
+
+    cache = cache_from_args(args)
+    scheduler = scheduler_from_args(args)
+    telemetry = telemetry_from_args(args)
+    client = CompletionClient(create_async_client(get_api_key(), base_url=args.base_url, max_retries=0), cache,
+                              scheduler, telemetry, contracts_from_args(args))
+    image_executor = create_image_executor(args.image_workers) if args.image_workers and len(tests) > 1 else None
+    image_options = {"image_format": args.image_format, "quality": args.image_quality, "executor": image_executor,
+                     **parse_image_budget(args.image_budgets[0])}
+    current_variant.set(image_budget_name(image_options))
+    evaluate = pipeline_evaluate(args, client, image_options, dataset)
+
+    difference = PairedDifference()
+    results = []
+    evaluated = 0
+    spent = 0.0
+    interval = (-math.inf, math.inf)
+    decision = "all cases evaluated"
+    while evaluated < len(tests):
+        # a look after every batch, the first one once min_cases are in
+        size = max(args.batch_size, min_cases - evaluated)
+        batch = tests[evaluated:evaluated + size]
+        batch_results = await run_batch(batch, evaluate, [model_a, model_b], concurrency=args.concurrency,
+                                        image_budget=image_budget_name(image_options))
+        evaluated += len(batch)
+        results += batch_results
+        by_key = {(result["model"], result["case_id"]): result for result in batch_results}
+        for test in batch:
+            value_a = metric_value(by_key[(model_a, case_id(test))], args.metric)
+            value_b = metric_value(by_key[(model_b, case_id(test))], args.metric)
+            # only cases both models answered are paired
+            if value_a is not None and value_b is not None:
+                difference.add(value_a - value_b)
+
+        # the error rate of this look is what the spending function allows on top of the earlier looks
+        look_alpha = spent_alpha(args.alpha, evaluated / len(tests)) - spent
+        spent += look_alpha
+        interval = difference.interval(look_alpha)
+        print(f"{evaluated}/{len(tests)} cases, {args.metric} difference {model_a} - {model_b}: "
+              f"{difference.mean:+.4f} [{interval[0]:+.4f}, {interval[1]:+.4f}] (alpha {look_alpha:.2g}, "
+              f"{difference.discordant} discordant pairs)")
+        stop = stop_decision(difference, interval, model_a, model_b, args.metric, args.precision, args.min_discordant)
+        if stop is not None:
+            decision = stop
+            break
+
+    await client.close()
+    scheduler.print_stats()
+    client.contracts.print_stats()
+    release_image_executor(image_executor)
+    requests = sum(result.get("requests", 1) for result in results)
+    # requests per case so far, extrapolated to the cases that were skipped
+    requests_full = round(requests / evaluated * len(tests))
+    summary = {
+        "models": [model_a, model_b],
+        "metric": args.metric,
+        "decision": decision,
+        "cases": evaluated,
+        "total_cases": len(tests),
+        "paired_cases": difference.n,
+        "discordant_pairs": difference.discordant,
+        "mean_difference": difference.mean,
+        "interval": list(interval),
+        "alpha": args.alpha,
+        "requests": requests,
+        "requests_full": requests_full,
+        "calls_saved": requests_full - requests,
+    }
+    print(f"Decision: {decision} after {evaluated} of {len(tests)} cases, {args.metric} difference "
+          f"{difference.mean:+.4f} [{interval[0]:+.4f}, {interval[1]:+.4f}]")
+    print(f"{requests} requests instead of about {requests_full}, {summary['calls_saved']} calls saved")
+    if args.output:
+        write_results(results, Path(args.output))
+    report = {"sequential": summary, "telemetry": telemetry.report(results)}
+    print_report(report["telemetry"])
+    if args.report:
+        write_report(report, Path(args.report))
+
+
+def build_parser() -> argparse.ArgumentParser:
+    parser = argparse.ArgumentParser(description="Compare two models on a randomized, stratified sample of the tests "
+                                                 "and stop as soon as the difference is decided")
+    parser.add_argument("--input", required=True, type=str, metavar="DIR|GLOB",
+                        help="Tests as for the main scripts, or packed .shard files.")
+    parser.add_argument("--models", required=True, nargs=2, type=str, metavar="MODEL", help="The two models to compare.")
+    parser.add_argument("--pipeline", choices=PIPELINES, default="click")
+    parser.add_argument("--category", choices=["with_instruct", "without_instruct", "state_ident"],
+                        default="with_instruct", help="Prompt of the understanding pipeline.")
+    parser.add_argument("--metric", choices=METRICS, default="correct",
+                        help="Per case metric to compare, correct gives the accuracy difference, iou the mean IoU "
+                             "difference of multi_bbox.")
+    parser.add_argument("--alpha", type=float, default=0.05,
+                        help="Error rate of the decision, spread over all looks at the data.")
+    parser.add_argument("--precision", type=float, default=None,
+                        help="Also stop once the half width of the interval is at most this, e.g. 0.02 for +-2%%.")
+    parser.add_argument("--min-cases", type=int, default=30, help="Cases to evaluate before the first look.")
+    parser.add_argument("--min-discordant", type=int, default=10,
+                        help="Pairs on which the models differ before the run may stop, the variance of fewer "
+                             "says little, e.g. it is 0 while both models answer every case alike.")
+    parser.add_argument("--batch-size", type=int, default=16, help="Cases evaluated between two looks.")
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the case order.")
+    parser.add_argument("--base-url", type=str, default="https://openrouter.ai/api/v1",
+                        help="OpenAI-compatible endpoint, e.g. http://127.0.0.1:8000/v1 for mock_server.py.")
+    parser.add_argument("--concurrency", type=int, default=8, help="Maximum number of tests in flight per model.")
+    parser.add_argument("--output", type=str, metavar="FILE", help="Write one JSON result per evaluated test.")
+    add_cache_arguments(parser)
+    add_scheduler_arguments(parser)
+    add_telemetry_arguments(parser)
+    add_image_arguments(parser)
+    add_contract_arguments(parser)
+    add_verbose_argument(parser)
+    return parser
+
+
+if __name__ == "__main__":
+    args = build_parser().parse_args()
+    asyncio.run(main(args))
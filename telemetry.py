@@ -0,0 +1,234 @@
+import argparse
+import json
+from contextvars import ContextVar
+from pathlib import Path
+
+# case id of the test a request belongs to, set per task by batch_runner.run_batch
+current_case: ContextVar[str | None] = ContextVar("current_case", default=None)
+# name of the prompt module a request was built from, set by the generate_model_response functions
+current_prompt: ContextVar[str | None] = ContextVar("current_prompt", default=None)
+# image budget the tests run with, e.g. "play_area:150", set per pass by the main scripts
+current_variant: ContextVar[str | None] = ContextVar("current_variant", default=None)
+
+LATENCY_PERCENTILES = (50, 95, 99)
+
+
+def category(case_id: str | None) -> str:
+    """Benchmark category of a test, i.e. the name of its example directory."""
+    if not case_id:
+        return "unknown"
+    return Path(case_id).parent.name or "unknown"
+
+
+def result_key(result: dict) -> tuple[str, str, str]:
+    """(model, image budget, case id) of a test result, results written before image budgets count as full."""
+    return result["model"], result.get("image_budget") or "full", result["case_id"]
+
+
+def record_key(record: dict) -> tuple[str, str, str]:
+    """Same as result_key, for a request record."""
+    return record["model"], record.get("variant") or "full", record["case_id"]
+
+
+class Telemetry:
+    """Collects one record per model call and writes it as JSON line as soon as the call finishes.
+        Args:
+            output_path (Path | None): JSONL file for the per-request records, in memory only if None.
+            prices (dict | None): USD per million tokens per model, e.g. {"model": {"prompt": 0.2, "completion": 0.6}}.
+                Only used when the provider does not report the cost of a call itself.
+    """
+
+    def __init__(self, output_path: Path | None = None, prices: dict[str, dict] | None = None):
+        self.records: list[dict] = []
+        self.prices = prices or {}
+        self.output_file = None
+        if output_path is not None:
+            output_path.parent.mkdir(parents=True, exist_ok=True)
+            self.output_file = open(output_path, "w")
+
+    def cost(self, model: str, usage: dict | None) -> float | None:
+        if not usage:
+            return None
+        if usage.get("cost") is not None:
+            return float(usage["cost"])
+        price = self.prices.get(model)
+        if price is None:
+            return None
+        return (usage.get("prompt_tokens", 0) * price.get("prompt", 0.0)
+                + usage.get("completion_tokens", 0) * price.get("completion", 0.0)) / 1e6
+
+    def record(self, model: str, trace: dict, usage: dict | None = None, image_tokens: int = 0,
+               cached: bool = False, error: str | None = None):
+        """Store the measurements of one call.
+            Args:
+                model (str): Model name at the provider.
+                trace (dict): Timings in seconds (started, queue_wait, ttfb, latency, total) and attempts.
+                usage (dict | None): response.usage of the completion.
+                image_tokens (int): Estimated image tokens of the request, see scheduler.estimate_image_tokens.
+                cached (bool): Served from the response cache, the call cost nothing.
+                error (str | None): repr of the exception if the call failed for good.
+        """
+        usage = usage or {}
+        prompt_details = usage.get("prompt_tokens_details") or {}
+        record = {
+            "case_id": current_case.get(),
+            "prompt": current_prompt.get(),
+            "variant": current_variant.get(),
+            "model": model,
+            "started": trace.get("started"),
+            "queue_wait": trace.get("queue_wait", 0.0),
+            "ttfb": trace.get("ttfb"),
+            "latency": trace.get("latency"),
+            "total": trace.get("total"),
+            "retries": max(trace.get("attempts", 1) - 1, 0),
+            "prompt_tokens": usage.get("prompt_tokens", 0),
+            "completion_tokens": usage.get("completion_tokens", 0),
+            "cached_tokens": prompt_details.get("cached_tokens") or 0,
+            "image_tokens": image_tokens,
+            "cost": 0.0 if cached else self.cost(model, usage),
+            "cached": cached,
+            "error": error,
+        }
+        self.records.append(record)
+        if self.output_file is not None:
+            self.output_file.write(json.dumps(record) + "\n")
+            self.output_file.flush()
+
+    def close(self):
+        if self.output_file is not None:
+            self.output_file.close()
+            self.output_file = None
+
+    def report(self, results: list[dict]) -> dict:
+        """Roll the request records and test results of a run up per model and benchmark category."""
+        # imported here, every script imports telemetry before parsing its arguments
+        import numpy as np
+
+        correct = {result_key(result): bool(result.get("correct")) for result in results}
+        report = {}
+        for model in dict.fromkeys(record["model"] for record in self.records):
+            records = [record for record in self.records if record["model"] == model]
+            sent = [record for record in records if not record["cached"] and record["latency"] is not None]
+            latencies = np.array([record["latency"] for record in sent], dtype=float)
+            ttfbs = np.array([record["ttfb"] for record in sent if record["ttfb"] is not None], dtype=float)
+            span = (max(record["started"] + record["total"] for record in records)
+                    - min(record["started"] for record in records))
+            tests = [key for key in correct if key[0] == model]
+            num_correct = sum(correct[key] for key in tests)
+            tokens = sum(record["prompt_tokens"] + record["completion_tokens"] for record in records)
+            costs = [record["cost"] for record in records if record["cost"] is not None]
+            cost = sum(costs) if costs else None
+
+            categories = {}
+            for record in records:
+                entry = categories.setdefault(category(record["case_id"]), {"tests": set(), "correct": 0,
+                                                                            "tokens": 0, "cost": None})
+                entry["tests"].add(record_key(record))
+                entry["tokens"] += record["prompt_tokens"] + record["completion_tokens"]
+                if record["cost"] is not None:
+                    entry["cost"] = (entry["cost"] or 0.0) + record["cost"]
+            for name, entry in categories.items():
+                entry["correct"] = sum(correct.get(key, False) for key in entry["tests"])
+                entry["tests"] = len(entry["tests"])
+
+            # share of prompt tokens served from the provider's prompt cache, per prompt
+            prompts = {}
+            for record in records:
+                if record["cached"]:
+                    continue
+                entry = prompts.setdefault(record["prompt"] or "unknown", {"requests": 0, "prompt_tokens": 0,
+                                                                           "cached_tokens": 0})
+                entry["requests"] += 1
+                entry["prompt_tokens"] += record["prompt_tokens"]
+                entry["cached_tokens"] += record["cached_tokens"]
+            for entry in prompts.values():
+                entry["prompt_tokens_mean"] = entry["prompt_tokens"] / entry["requests"]
+                entry["cached_ratio"] = entry["cached_tokens"] / entry["prompt_tokens"] if entry["prompt_tokens"] else None
+
+            # image tokens against accuracy, one entry per image budget the tests ran with
+            budgets = {}
+            for record in records:
+                entry = budgets.setdefault(record_key(record)[1], {"tests": set(), "requests": 0, "image_tokens": 0})
+                entry["tests"].add(record_key(record))
+                entry["requests"] += 1
+                entry["image_tokens"] += record["image_tokens"]
+            for entry in budgets.values():
+                entry["correct"] = sum(correct.get(key, False) for key in entry["tests"])
+                entry["tests"] = len(entry["tests"])
+                entry["accuracy"] = entry["correct"] / entry["tests"]
+                entry["image_tokens_per_request"] = entry["image_tokens"] / entry["requests"]
+
+            report[model] = {
+                "tests": len(tests),
+                "correct": num_correct,
+                "accuracy": num_correct / len(tests) if tests else None,
+                "requests": len(records),
+                "cached": sum(record["cached"] for record in records),
+                "errors": sum(record["error"] is not None for record in records),
+                "retries": sum(record["retries"] for record in records),
+                "latency": {f"p{p}": float(np.percentile(latencies, p)) if len(latencies) else None
+                            for p in LATENCY_PERCENTILES},
+                "ttfb_p50": float(np.percentile(ttfbs, 50)) if len(ttfbs) else None,
+                "queue_wait_p50": float(np.median([record["queue_wait"] for record in records])),
+                "requests_per_s": len(records) / span if span > 0 else None,
+                "tests_per_s": len(tests) / span if span > 0 else None,
+                "prompt_tokens": sum(record["prompt_tokens"] for record in records),
+                "completion_tokens": sum(record["completion_tokens"] for record in records),
+                "image_tokens": sum(record["image_tokens"] for record in records),
+                "tokens_per_correct": tokens / num_correct if num_correct else None,
+                "cost": cost,
+                "cost_per_correct": cost / num_correct if cost is not None and num_correct else None,
+                "categories": categories,
+                "prompts": prompts,
+                "budgets": budgets,
+            }
+        return report
+
+
+def print_report(report: dict):
+    def fmt(value, spec=".2f"):
+        return "-" if value is None else format(value, spec)
+
+    for model, entry in report.items():
+        latency = entry["latency"]
+        print(f"{model}: {entry['correct']}/{entry['tests']} correct, {entry['requests']} requests "
+              f"({entry['cached']} cached, {entry['retries']} retries, {entry['errors']} errors)")
+        print(f"  latency p50/p95/p99 {fmt(latency['p50'])}/{fmt(latency['p95'])}/{fmt(latency['p99'])}s, "
+              f"ttfb p50 {fmt(entry['ttfb_p50'])}s, queue wait p50 {fmt(entry['queue_wait_p50'])}s, "
+              f"{fmt(entry['tests_per_s'])} tests/s")
+        print(f"  tokens {entry['prompt_tokens']} prompt ({entry['image_tokens']} image est.) + "
+              f"{entry['completion_tokens']} completion, {fmt(entry['tokens_per_correct'], '.0f')} per correct answer")
+        print(f"  cost ${fmt(entry['cost'], '.4f')}, ${fmt(entry['cost_per_correct'], '.5f')} per correct answer")
+        for name, category_entry in entry["categories"].items():
+            print(f"  {name}: {category_entry['correct']}/{category_entry['tests']} correct, "
+                  f"{category_entry['tokens']} tokens, ${fmt(category_entry['cost'], '.4f')}")
+        for name, prompt_entry in entry["prompts"].items():
+            print(f"  prompt {name}: {prompt_entry['prompt_tokens_mean']:.0f} prompt tokens per request, "
+                  f"{fmt(prompt_entry['cached_ratio'], '.1%')} served from the prompt cache")
+        for name, budget_entry in entry.get("budgets", {}).items():
+            print(f"  budget {name}: {budget_entry['image_tokens_per_request']:.0f} image tokens per request, "
+                  f"{budget_entry['correct']}/{budget_entry['tests']} correct")
+
+
+def add_telemetry_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--telemetry", type=str, metavar="FILE", default=None,
+                        help="Write one JSON record per model call (timings, tokens, cost, retries) to this file.")
+    parser.add_argument("--prices", type=str, metavar="FILE", default=None,
+                        help='JSON file with USD per million tokens, e.g. {"qwen/qwen3-vl-8b-instruct": {"prompt": 0.08, "completion": 0.5}}.')
+    parser.add_argument("--report", type=str, metavar="FILE", default=None,
+                        help="Write the aggregated run report as JSON to this file.")
+
+
+def telemetry_from_args(args: argparse.Namespace) -> Telemetry:
+    prices = None
+    if args.prices:
+        with open(Path(args.prices), "r") as f:
+            prices = json.load(f)
+    return Telemetry(Path(args.telemetry) if args.telemetry else None, prices)
+
+
+def write_report(report: dict, report_path: Path):
+    report_path.parent.mkdir(parents=True, exist_ok=True)
+    with open(report_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote run report to {report_path}")
@@ -0,0 +1,35 @@
+import asyncio
+from pathlib import Path
+
+from batch_runner import run_batch
+from merge_results import merge_results
+from telemetry import result_key
+
+
+async def unreachable(test: Path, model: str) -> dict:
+    raise ConnectionError("endpoint unreachable")
+
+
+def run_passes(budgets: list[str]) -> list[dict]:
+    tests = [Path("examples/single/OBJ_REC1"), Path("examples/single/OBJ_REC2")]
+    results = []
+    for budget in budgets:
+        results += asyncio.run(run_batch(tests, unreachable, ["model"], concurrency=2, image_budget=budget))
+    return results
+
+
+def test_failed_requests_keep_their_image_budget():
+    results = run_passes(["full", "play_area:150"])
+    assert len(results) == 4
+    assert all("error" in result for result in results)
+    assert {result["image_budget"] for result in results} == {"full", "play_area:150"}
+    # one key per case and budget, so neither merging nor the store folds the passes together
+    assert len({result_key(result) for result in results}) == 4
+    merged, _ = merge_results([results])
+    assert len(merged) == 4
+
+
+def test_failed_requests_without_image_budget():
+    results = asyncio.run(run_batch([Path("examples/single/OBJ_REC1")], unreachable, ["model"]))
+    assert "image_budget" not in results[0]
+    assert result_key(results[0]) == ("model", "full", "examples/single/OBJ_REC1")
@@ -0,0 +1,33 @@
+import asyncio
+import json
+from pathlib import Path
+
+from dataset_shards import open_dataset, pack
+from utils import case_id, discover_tests, load_image_payload
+
+ROOT = Path(__file__).resolve().parent.parent
+ENCODE = {"grid_size": 28, "image_format": "PNG", "quality": None, "crop": "full", "max_image_tokens": None}
+
+
+def test_packed_shards_hold_every_test(monkeypatch, tmp_path):
+    monkeypatch.chdir(ROOT)
+    paths = pack("benchmark1_grounding/examples", tmp_path / "examples", cases_per_shard=4)
+    tests = discover_tests("benchmark1_grounding/examples")
+    assert len(paths) == (len(tests) + 3) // 4
+    dataset = open_dataset(str(tmp_path / "examples-*.shard"))
+    assert [case_id(test) for test in dataset.tests()] == sorted(case_id(test) for test in tests)
+    for test in tests:
+        shard = dataset.shard_of[case_id(test)]
+        assert bytes(shard.image_bytes(case_id(test))) == test.with_suffix(".png").read_bytes()
+        with open(test.with_suffix(".json"), "r") as f:
+            assert dataset.scene(case_id(test)) == json.load(f)
+
+
+def test_pre_encoded_payload_equals_the_loose_file(monkeypatch, tmp_path):
+    monkeypatch.chdir(ROOT)
+    pack("benchmark2_understanding/examples", tmp_path / "understanding", encode=ENCODE)
+    dataset = open_dataset(str(tmp_path / "understanding-*.shard"))
+    for test in discover_tests("benchmark2_understanding/examples"):
+        packed = asyncio.run(dataset.payload(case_id(test), **ENCODE))
+        assert packed == asyncio.run(load_image_payload(test.with_suffix(".png"), **ENCODE))
+        assert dataset.task_description(case_id(test))
@@ -0,0 +1,23 @@
+import importlib
+from pathlib import Path
+
+from prompts import build_messages
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def test_every_prompt_module_keeps_its_system_prompt():
+    for path in sorted(ROOT.glob("benchmark*/system_prompts/*.py")):
+        prompt = importlib.import_module(f"{path.parent.parent.name}.system_prompts.{path.stem}")
+        assert prompt.SYSTEM_PROMPT.startswith(prompt.INSTRUCTION)
+        system = build_messages(prompt, None)[0]["content"]
+        # the system prompt of a request is the part list, or the whole agent prompt
+        assert prompt.SYSTEM_PROMPT.endswith(system)
+
+
+def test_object_property_prompt_lists_the_balls():
+    from benchmark2_understanding.system_prompts import qwen3vl_object_property_ident_with_instruct as prompt
+
+    system = build_messages(prompt, None)[0]["content"]
+    assert system.count("\n") == 8
+    assert "Super Ball - This super ball gains height" in system
@@ -0,0 +1,24 @@
+import os
+
+from response_cache import ResponseCache
+
+
+def test_put_evicts_once_the_cache_outgrows_its_cap(tmp_path):
+    cache = ResponseCache(tmp_path, max_size_mb=0.01)
+    completion = {"choices": [{"message": {"content": "x" * 1000}}]}
+    keys = [ResponseCache.key({"model": "model", "n": n}) for n in range(40)]
+    for n, key in enumerate(keys):
+        cache.put(key, {"model": "model"}, completion)
+        # older entries first, independent of the file system's timestamp resolution
+        os.utime(cache.path(key), (n, n))
+    on_disk = sum(path.stat().st_size for path in tmp_path.glob("*/*.json"))
+    assert on_disk <= cache.max_size
+    assert cache.get(keys[-1]) is not None
+    assert cache.get(keys[0]) is None
+
+
+def test_readonly_cache_never_evicts(tmp_path):
+    ResponseCache(tmp_path).put(ResponseCache.key({"n": 0}), {}, {"choices": []})
+    cache = ResponseCache(tmp_path, mode="readonly", max_size_mb=0)
+    cache.put(ResponseCache.key({"n": 1}), {}, {"choices": []})
+    assert len(list(tmp_path.glob("*/*.json"))) == 1
@@ -0,0 +1,32 @@
+import asyncio
+import base64
+import io
+import time
+
+from PIL import Image
+
+from scheduler import TokenBucket, estimate_image_tokens
+
+
+def test_image_tokens_of_every_payload_format():
+    image = Image.new("RGB", (640, 441))
+    for image_format in ("PNG", "JPEG", "WEBP"):
+        buffer = io.BytesIO()
+        image.save(buffer, image_format)
+        data_url = f"data:image/{image_format.lower()};base64,{base64.b64encode(buffer.getvalue()).decode()}"
+        assert estimate_image_tokens(data_url) == 640 * 441 // (28 * 28)
+
+
+def test_pause_holds_back_requests_already_waiting_for_budget():
+    async def run() -> float:
+        bucket = TokenBucket(600)
+        await bucket.acquire(bucket.capacity)
+        start = time.monotonic()
+        # needs 0.1 s of refill, the 429 arrives while it waits
+        waiting = asyncio.create_task(bucket.acquire(1))
+        await asyncio.sleep(0.02)
+        bucket.pause(0.5)
+        await waiting
+        return time.monotonic() - start
+
+    assert asyncio.run(run()) >= 0.5
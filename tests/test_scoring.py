@@ -0,0 +1,53 @@
+from itertools import permutations
+
+import numpy as np
+
+from scoring import hungarian, iou_matrix
+
+
+def brute_force_cost(cost: np.ndarray) -> float:
+    # every assignment of the shorter side to distinct entries of the longer side
+    if cost.shape[0] > cost.shape[1]:
+        cost = cost.T
+    rows = range(cost.shape[0])
+    return min(cost[rows, list(cols)].sum() for cols in permutations(range(cost.shape[1]), cost.shape[0]))
+
+
+def test_hungarian_matches_brute_force_on_small_matrices():
+    rng = np.random.default_rng(0)
+    for _ in range(200):
+        n, m = rng.integers(1, 6, size=2)
+        # small integers, so many assignments tie
+        cost = rng.integers(-3, 4, size=(n, m)).astype(np.float64)
+        rows, cols = hungarian(cost)
+        assert len(rows) == len(cols) == min(n, m)
+        assert len(set(rows.tolist())) == len(rows) and len(set(cols.tolist())) == len(cols)
+        assert cost[rows, cols].sum() == brute_force_cost(cost)
+
+
+def test_iou_matrix_shapes_with_no_boxes():
+    boxes = [[0, 0, 10, 10], [5, 5, 15, 15]]
+    assert iou_matrix(np.zeros((0, 4)), boxes).shape == (0, 2)
+    assert iou_matrix(boxes, []).shape == (2, 0)
+    assert iou_matrix([], []).shape == (0, 0)
+
+
+def test_iou_matrix_values():
+    pred = [[0, 0, 10, 10], [0, 0, 10, 10], [10, 0, 20, 10], [2, 2, 4, 4], [0, 0, 0, 10]]
+    gt = [[0, 0, 10, 10], [0, 0, 20, 10]]
+    iou = iou_matrix(pred, gt)
+    np.testing.assert_allclose(iou, [
+        [1.0, 0.5],
+        [1.0, 0.5],
+        # touching edges do not overlap
+        [0.0, 0.5],
+        # contained box
+        [0.04, 0.02],
+        # zero area, no division by zero
+        [0.0, 0.0],
+    ])
+
+
+def test_iou_matrix_of_two_zero_area_boxes_is_zero():
+    iou = iou_matrix([[5, 5, 5, 5]], [[5, 5, 5, 5]])
+    assert iou.tolist() == [[0.0]]
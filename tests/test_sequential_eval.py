@@ -0,0 +1,54 @@
+import math
+
+import pytest
+
+from sequential_eval import PairedDifference, spent_alpha, stop_decision, t_quantile
+
+
+@pytest.mark.parametrize("p, df, expected", [(0.975, 1, 12.7062), (0.975, 5, 2.5706), (0.975, 30, 2.0423),
+                                             (0.995, 10, 3.1693), (0.025, 5, -2.5706)])
+def test_t_quantile(p, df, expected):
+    assert t_quantile(p, df) == pytest.approx(expected, abs=1e-4)
+
+
+def differences(values: list[float]) -> PairedDifference:
+    difference = PairedDifference()
+    for value in values:
+        difference.add(value)
+    return difference
+
+
+@pytest.mark.parametrize("repeat", [1, 100])
+def test_interval_is_at_least_the_t_interval(repeat):
+    values = [1, 0, 0, 1, -1, 1, 0, 1, 0, 1, 1, 0] * repeat
+    difference = differences(values)
+    mean = sum(values) / len(values)
+    sd = math.sqrt(sum((value - mean) ** 2 for value in values) / (len(values) - 1))
+    half_width = t_quantile(0.975, len(values) - 1) * sd / math.sqrt(len(values))
+    low, high = difference.interval(0.05)
+    assert low <= mean - half_width and high >= mean + half_width
+    # the variance floor fades with the number of pairs
+    assert (high - low) / (2 * half_width) < (1.2 if repeat == 1 else 1.01)
+
+
+def test_no_stop_while_both_models_answer_alike():
+    # both models right on the first min_cases: the sample variance is 0
+    difference = differences([0.0] * 30)
+    interval = difference.interval(spent_alpha(0.05, 30 / 1000))
+    assert difference.discordant == 0
+    assert stop_decision(difference, interval, "a", "b", "correct", 0.02, min_discordant=10) is None
+
+
+def test_a_run_of_wins_has_a_positive_width():
+    difference = differences([1.0] * 5)
+    low, high = difference.interval(0.01)
+    assert high - low > 0.5
+    assert stop_decision(difference, (low, high), "a", "b", "correct", 0.02, min_discordant=10) is None
+
+
+def test_stop_once_enough_pairs_differ():
+    difference = differences([1.0] * 40 + [0.0] * 10)
+    interval = difference.interval(0.01)
+    assert interval[0] > 0
+    assert stop_decision(difference, interval, "a", "b", "correct", None, min_discordant=10) == \
+        "a has the higher correct"
@@ -0,0 +1,30 @@
+import json
+from pathlib import Path
+
+import pytest
+
+from tim_parser import parse_tim
+
+ROOT = Path(__file__).resolve().parent.parent
+
+
+def exported_levels() -> list[Path]:
+    """Example levels with the exported .json next to them, the understanding tests store only their answer there."""
+    levels = []
+    for tim_path in sorted(ROOT.glob("benchmark*/examples/*/*.TIM")):
+        json_path = tim_path.with_suffix(".json")
+        if json_path.exists() and "parts" in json.loads(json_path.read_text()):
+            levels.append(tim_path)
+    return levels
+
+
+@pytest.mark.parametrize("tim_path", exported_levels(), ids=lambda path: f"{path.parent.name}/{path.stem}")
+def test_tim_matches_the_exported_json(tim_path: Path):
+    with open(tim_path.with_suffix(".json"), "r") as f:
+        assert parse_tim(tim_path) == json.load(f)
+
+
+def test_levels_without_export_parse():
+    tim_path = ROOT / "benchmark2_understanding" / "examples" / "object_property_ident" / "BALLS4.TIM"
+    level = parse_tim(tim_path)
+    assert level["parts"] and all("part_type" in part for part in level["parts"])
@@ -0,0 +1,51 @@
+import os
+from pathlib import Path
+
+import utils
+from utils import case_id, create_image_executor, discover_tests, pool_image_executors, release_image_executor, \
+    select_shard, shutdown_pooled_executors
+
+ROOT = Path(__file__).resolve().parent.parent
+EXAMPLES = ROOT / "benchmark1_grounding" / "examples"
+
+
+def test_case_ids_do_not_depend_on_the_spelling_of_the_input(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    relative = [case_id(test) for test in discover_tests("benchmark1_grounding/examples")]
+    absolute = [case_id(test) for test in discover_tests(str(EXAMPLES))]
+    pattern = [case_id(test) for test in discover_tests("benchmark1_grounding/examples/*/*")]
+    assert relative == absolute == pattern
+    assert "examples/object_recognition_single/OBJ_REC1" in relative
+
+
+def test_case_ids_do_not_depend_on_the_working_directory(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    ids = [case_id(test) for test in discover_tests(os.path.relpath(EXAMPLES, tmp_path))]
+    monkeypatch.chdir(ROOT)
+    assert ids == [case_id(test) for test in discover_tests("benchmark1_grounding/examples")]
+
+
+def test_single_test_keeps_its_category(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    tests = discover_tests("benchmark1_grounding/examples/object_recognition_single/OBJ_REC1.png")
+    assert [case_id(test) for test in tests] == ["object_recognition_single/OBJ_REC1"]
+
+
+def test_shards_are_the_same_for_every_spelling(monkeypatch):
+    monkeypatch.chdir(ROOT)
+    for spec in ("0/3", "1/3", "2/3"):
+        relative = [case_id(test) for test in select_shard(discover_tests("benchmark1_grounding/examples"), spec)]
+        absolute = [case_id(test) for test in select_shard(discover_tests(str(EXAMPLES)), spec)]
+        assert relative == absolute
+
+
+def test_pooled_image_executor_outlives_its_run(monkeypatch):
+    monkeypatch.setattr(utils, "_executor_pool", None)
+    pool_image_executors()
+    executor = create_image_executor(1)
+    release_image_executor(executor)
+    # the next run of the warm worker gets the same, still running pool
+    assert create_image_executor(1) is executor
+    assert executor.submit(abs, -1).result() == 1
+    shutdown_pooled_executors()
+    assert utils._executor_pool is None
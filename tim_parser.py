@@ -0,0 +1,143 @@
+import argparse
+import json
+import struct
+from pathlib import Path
+
+TIM_MAGIC = 0xACEF
+TIM_VERSIONS = {0x0113: "TIM2"}
+
+# part type ids seen in the example levels, everything else is exported as UNKNOWN_<id>.
+# The ids are not in the order of the part catalog (parts.txt), BASKETBALL is 9 here and second in the catalog,
+# so levels with an exported .json are read from the .json, see scene_index.load_scene.
+PART_TYPES = {
+    0: "BOWLING_BALL",
+    1: "RED_BRICK_WALL",
+    9: "BASKETBALL",
+    30: "MAGNIFYING_GLASS",
+    59: "SUPER_BALL",
+    63: "POOL_BALL",
+    87: "PROGRAMMABLE_BALL",
+    139: "TEETER_TOTTER",
+}
+PART_TYPE_IDS = {name: part_id for part_id, name in PART_TYPES.items()}
+
+FLAGS_3 = {
+    0x0040: "LOCKED",
+    0x0400: "SHOW_PROGRAM_ICON",
+    0x2000: "WALL_PART",
+    0x8000: "SHOW_SOLUTION_ICON",
+}
+
+# fixed block between the description and the global settings, all zero in the examples
+HEADER_PADDING = 58
+# type, flags_1, flags_2, flags_3, appearance, unknown, width_1, height_1, width_2, height_2, x, y
+PART_STRUCT = struct.Struct("<6H4H2h")
+PART_SIZE = 48
+# density, elasticity, friction, gravity_buoyancy, mass, appearance_2
+PROGRAMMABLE_BALL_STRUCT = struct.Struct("<6H")
+
+
+def part_type_name(part_id: int) -> str:
+    return PART_TYPES.get(part_id, f"UNKNOWN_{part_id}")
+
+
+def part_type_id(name: str) -> int:
+    """Inverse of part_type_name, raises ValueError for names without a known id."""
+    if name in PART_TYPE_IDS:
+        return PART_TYPE_IDS[name]
+    if name.startswith("UNKNOWN_") and name[len("UNKNOWN_"):].isdigit():
+        return int(name[len("UNKNOWN_"):])
+    raise ValueError(f"Part type {name} has no known TIM id.")
+
+
+def flag_names(flags: int) -> list[str]:
+    names = []
+    for bit in range(16):
+        mask = 1 << bit
+        if flags & mask:
+            names.append(FLAGS_3.get(mask, f"UNKNOWN_{mask:#x}"))
+    return names
+
+
+def _read_cstring(data: bytes, offset: int) -> tuple[str, int]:
+    end = data.index(b"\x00", offset)
+    return data[offset:end].decode("latin-1"), end + 1
+
+
+def parse_part(data: bytes, offset: int) -> tuple[dict, int]:
+    """Parse one part record starting at offset.
+        Returns:
+            tuple[dict, int]: The part in the layout of the exported .json files and the offset of the next part.
+    """
+    (part_id, _flags_1, _flags_2, flags_3, appearance, _unknown,
+     width_1, height_1, width_2, height_2, x, y) = PART_STRUCT.unpack_from(data, offset)
+    part = {
+        "part_type": part_type_name(part_id),
+        "position": {"x": x, "y": y},
+        "size": {"width_1": width_1, "height_1": height_1, "width_2": width_2, "height_2": height_2},
+        "flags_3": flag_names(flags_3),
+    }
+    rope_1 = data[offset + 34:offset + 36]
+    rope_2 = data[offset + 38:offset + 40]
+    if any(rope_1) or any(rope_2):
+        part["rope_1_connection"] = {"x": rope_1[0], "y": rope_1[1]}
+        part["rope_2_connection"] = {"x": rope_2[0], "y": rope_2[1]}
+    if appearance:
+        part["appearance"] = appearance
+    offset += PART_SIZE
+    if part["part_type"] == "PROGRAMMABLE_BALL":
+        density, elasticity, friction, gravity_buoyancy, mass, appearance_2 = \
+            PROGRAMMABLE_BALL_STRUCT.unpack_from(data, offset)
+        part["programmable_ball_data"] = {
+            "density": density,
+            "elasticity": elasticity,
+            "friction": friction,
+            "gravity_buoyancy": gravity_buoyancy,
+            "mass": mass,
+            "appearance_2": appearance_2,
+        }
+        offset += PROGRAMMABLE_BALL_STRUCT.size
+    return part, offset
+
+
+def parse_tim(tim_path: Path) -> dict:
+    """Parse a binary .TIM level into the same structure as the exported .json files.
+        Args:
+            tim_path (Path): Path to the .TIM file.
+        Returns:
+            dict: version, title, description, background, global_settings and parts.
+    """
+    with open(tim_path, "rb") as f:
+        data = f.read()
+    magic, version = struct.unpack_from("<HH", data, 0)
+    if magic != TIM_MAGIC:
+        raise ValueError(f"{tim_path} is not a TIM level (magic {magic:#06x}).")
+    if version not in TIM_VERSIONS:
+        raise ValueError(f"{tim_path} has unsupported TIM version {version:#06x}.")
+    background_color = data[5]
+    title, offset = _read_cstring(data, 6)
+    description, offset = _read_cstring(data, offset)
+    offset += HEADER_PADDING
+    pressure, gravity, _unknown, music, num_static, num_moving, _unknown_2 = \
+        struct.unpack_from("<HHIHHHH", data, offset)
+    offset += 16
+
+    parts = []
+    for _ in range(num_static + num_moving):
+        part, offset = parse_part(data, offset)
+        parts.append(part)
+    return {
+        "version": TIM_VERSIONS[version],
+        "title": title,
+        "description": description,
+        "background": {"color": background_color},
+        "global_settings": {"pressure": pressure, "gravity": gravity, "music": music, "num_moving": num_moving},
+        "parts": parts,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Convert a .TIM level to the .json export format")
+    parser.add_argument("input", type=str, metavar="FILE", help="Path to the .TIM file.")
+    args = parser.parse_args()
+    print(json.dumps(parse_tim(Path(args.input)), indent=2))
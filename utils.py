@@ -1,34 +1,294 @@
+import argparse
+import asyncio
 import base64
+import glob
+import hashlib
+import io
+import logging
+import math
 import os
+import sys
+from collections import OrderedDict
+from concurrent.futures import Executor
+from dataclasses import dataclass
 from pathlib import Path
-from PIL import Image
+from typing import TYPE_CHECKING
 
-def encode_image(image_path):
-    """Encode the image to base64."""
-    with open(image_path, "rb") as image_file:
-        return base64.b64encode(image_file.read()).decode('utf-8')
+if TYPE_CHECKING:
+    # numpy and PIL take most of the import time of the scripts, they are imported once the first image is prepared
+    from PIL import Image
 
-def pad_image(image_path: Path, grid_size) -> Path:
+IMAGE_MIME_TYPES = {"PNG": "image/png", "JPEG": "image/jpeg", "WEBP": "image/webp"}
+IMAGE_PAYLOAD_CACHE_SIZE = 1024
+_image_payload_cache: OrderedDict[tuple, tuple[str, "ImageTransform"]] = OrderedDict()
+# x_min, y_min, x_max, y_max of the blue game play area in the 640x441 screenshots
+PLAY_AREA = (48, 0, 560, 377)
+CROP_MODES = ["full", "play_area", "detect"]
+# pixels per visual token of Qwen-VL style models (14 pixel patches, merged 2x2)
+TOKEN_PIXELS = 28
+# per-test lines (model response, ground truth, score), tests run concurrently so they are only shown with --verbose
+test_log = logging.getLogger("fmvlatim.tests")
+# image pools by number of workers once pool_image_executors was called, e.g. by the warm worker
+_executor_pool: dict[int, Executor] | None = None
+# case ids of the tests found by discover_tests, relative to the dataset root instead of the path as typed
+_case_ids: dict[Path, str] = {}
+
+
+@dataclass(frozen=True)
+class ImageTransform:
+    """How the image sent to the model was derived from the original screenshot.
+        The original is cropped at (crop_x, crop_y), scaled by (scale_x, scale_y) and padded to width x height.
+    """
+    crop_x: int
+    crop_y: int
+    scale_x: float
+    scale_y: float
+    width: int
+    height: int
+
+    def to_original(self, x: float, y: float) -> tuple[float, float]:
+        """Map pixel coordinates in the sent image back to the original screenshot."""
+        return (x / self.scale_x + self.crop_x, y / self.scale_y + self.crop_y)
+
+    def normalized_to_original(self, x: float, y: float) -> tuple[float, float]:
+        """Map coordinates normalized to 0-1000 of the sent image back to the original screenshot."""
+        return self.to_original(x / 1000.0 * self.width, y / 1000.0 * self.height)
+
+    @property
+    def image_tokens(self) -> int:
+        return math.ceil(self.width / TOKEN_PIXELS) * math.ceil(self.height / TOKEN_PIXELS)
+
+
+def pad_image(image: "Image.Image", grid_size: int) -> "Image.Image":
     """Pad the image to make its dimensions multiples of grid_size.
         Args:
-            image_path (str): Path to the input image.
-            grid_size (int): The grid size to pad to.
+            image (Image.Image): The input image.
+            grid_size (int): The grid size to pad to, e.g. the 28 pixel patches of Qwen3-VL.
         Returns:
-            str: Path to the padded image (image_path with '_padded' suffix).
+            Image.Image: New RGB image with the input pasted at the top-left corner.
     """
+    from PIL import Image
 
-    image = Image.open(image_path)
     width, height = image.size
     new_width = ((width + grid_size - 1) // grid_size) * grid_size
     new_height = ((height + grid_size - 1) // grid_size) * grid_size
 
-    print(f"Padding image from ({width}, {height}) to ({new_width}, {new_height})")
-
     padded_image = Image.new("RGB", (new_width, new_height))
     padded_image.paste(image, (0, 0))
-    padded_image_path = image_path.with_name(image_path.stem + ".g.png")
-    padded_image.save(padded_image_path)
-    return padded_image_path
+    return padded_image
+
+def detect_play_area(image: "Image.Image") -> tuple[int, int, int, int]:
+    """Bounding box of the blue game play area, rows and columns that are mostly blue.
+        Falls back to PLAY_AREA if no blue area is found.
+    """
+    import numpy as np
+
+    pixels = np.asarray(image.convert("RGB"), dtype=np.int16)
+    red, green, blue = pixels[..., 0], pixels[..., 1], pixels[..., 2]
+    mask = (blue > 120) & (blue > red + 40) & (blue > green + 20)
+    rows = np.flatnonzero(mask.mean(axis=1) > 0.5)
+    columns = np.flatnonzero(mask.mean(axis=0) > 0.5)
+    if not len(rows) or not len(columns):
+        return PLAY_AREA
+    return (int(columns[0]), int(rows[0]), int(columns[-1]) + 1, int(rows[-1]) + 1)
+
+def _budget_size(width: int, height: int, max_image_tokens: int) -> tuple[int, int]:
+    """Largest size with the aspect ratio of the input that needs at most max_image_tokens visual tokens."""
+    scale = min(1.0, math.sqrt(max_image_tokens * TOKEN_PIXELS ** 2 / (width * height)))
+    while True:
+        new_width, new_height = max(1, round(width * scale)), max(1, round(height * scale))
+        if math.ceil(new_width / TOKEN_PIXELS) * math.ceil(new_height / TOKEN_PIXELS) <= max_image_tokens:
+            return new_width, new_height
+        scale *= 0.98
+
+def prepare_image(image: "Image.Image", grid_size: int | None = 28, crop: str = "full",
+                  max_image_tokens: int | None = None) -> tuple["Image.Image", ImageTransform]:
+    """Crop, downscale and pad a screenshot for the model.
+        Args:
+            image (Image.Image): The original screenshot.
+            grid_size (int | None): Pad to multiples of grid_size, None keeps the size.
+            crop (str): full, play_area (fixed PLAY_AREA rectangle) or detect (find the blue area per image).
+            max_image_tokens (int | None): Downscale until the image needs at most this many visual tokens.
+        Returns:
+            tuple[Image.Image, ImageTransform]: The image to send and how to map coordinates back.
+    """
+    from PIL import Image
+
+    if crop not in CROP_MODES:
+        raise ValueError(f"Crop mode {crop} is not supported, use one of {CROP_MODES}.")
+    image = image.convert("RGB")
+    width, height = image.size
+    if crop == "play_area":
+        box = (min(PLAY_AREA[0], width), min(PLAY_AREA[1], height), min(PLAY_AREA[2], width), min(PLAY_AREA[3], height))
+    elif crop == "detect":
+        box = detect_play_area(image)
+    else:
+        box = (0, 0, width, height)
+    if box != (0, 0, width, height):
+        image = image.crop(box)
+    crop_width, crop_height = image.size
+    if max_image_tokens:
+        new_size = _budget_size(crop_width, crop_height, max_image_tokens)
+        if new_size != image.size:
+            image = image.resize(new_size, Image.Resampling.LANCZOS)
+    scale_x, scale_y = image.width / crop_width, image.height / crop_height
+    if grid_size:
+        image = pad_image(image, grid_size)
+    return image, ImageTransform(box[0], box[1], scale_x, scale_y, image.width, image.height)
+
+def encode_image_bytes(image_bytes: bytes, grid_size: int | None = 28, image_format: str = "PNG",
+                       quality: int | None = None, crop: str = "full",
+                       max_image_tokens: int | None = None) -> tuple[str, ImageTransform]:
+    """Crop, scale, pad and encode an image entirely in memory.
+        Module level function, so it can be submitted to a ProcessPoolExecutor.
+        Args:
+            image_bytes (bytes): Content of the image file.
+            grid_size (int | None): Pad to multiples of grid_size, None sends the image unpadded.
+            image_format (str): One of IMAGE_MIME_TYPES.
+            quality (int | None): Quality for the lossy JPEG and WEBP formats.
+            crop (str), max_image_tokens (int | None): See prepare_image.
+        Returns:
+            tuple[str, ImageTransform]: data URL with the base64 encoded image and its transform.
+    """
+    from PIL import Image
+
+    with Image.open(io.BytesIO(image_bytes)) as image:
+        image, transform = prepare_image(image, grid_size, crop, max_image_tokens)
+        return encode_image(image, image_format, quality), transform
+
+def encode_image(image: "Image.Image", image_format: str = "PNG", quality: int | None = None) -> str:
+    """Encode a prepared image as data URL, see encode_image_bytes."""
+    if image_format not in IMAGE_MIME_TYPES:
+        raise ValueError(f"Image format {image_format} is not supported, use one of {list(IMAGE_MIME_TYPES)}.")
+    buffer = io.BytesIO()
+    save_args = {"quality": quality} if quality is not None and image_format != "PNG" else {}
+    image.save(buffer, format=image_format, **save_args)
+    base64_image = base64.b64encode(buffer.getvalue()).decode("utf-8")
+    return f"data:{IMAGE_MIME_TYPES[image_format]};base64,{base64_image}"
+
+async def load_image_payload(image_path: Path, grid_size: int | None = 28, image_format: str = "PNG",
+                             quality: int | None = None, crop: str = "full", max_image_tokens: int | None = None,
+                             executor: Executor | None = None) -> tuple[str, ImageTransform]:
+    """Return the encoded payload of an image file, see image_bytes_payload.
+        Args:
+            image_path (Path): Path to the input image.
+        Returns:
+            tuple[str, ImageTransform]: data URL with the base64 encoded image and its transform.
+    """
+    with open(image_path, "rb") as f:
+        image_bytes = f.read()
+    return await image_bytes_payload(image_bytes, grid_size, image_format, quality, crop, max_image_tokens, executor)
+
+async def image_bytes_payload(image_bytes: bytes | memoryview, grid_size: int | None = 28, image_format: str = "PNG",
+                              quality: int | None = None, crop: str = "full", max_image_tokens: int | None = None,
+                              executor: Executor | None = None) -> tuple[str, ImageTransform]:
+    """Return the encoded payload of an image, memoized per (image hash, grid, format, quality, crop, budget).
+        Args:
+            image_bytes (bytes | memoryview): Content of the image file, e.g. a zero-copy view into a dataset shard.
+            executor (Executor | None): Pool that encodes cache misses, e.g. a ProcessPoolExecutor.
+                Without one the image is encoded in the calling thread.
+        Returns:
+            tuple[str, ImageTransform]: data URL with the base64 encoded image and its transform.
+    """
+    key = (hashlib.sha256(image_bytes).hexdigest(), grid_size, image_format, quality, crop, max_image_tokens)
+    payload = _image_payload_cache.get(key)
+    if payload is not None:
+        _image_payload_cache.move_to_end(key)
+        return payload
+    if executor is not None:
+        loop = asyncio.get_running_loop()
+        # memoryviews cannot be pickled to the worker processes
+        payload = await loop.run_in_executor(executor, encode_image_bytes, bytes(image_bytes), grid_size, image_format,
+                                             quality, crop, max_image_tokens)
+    else:
+        payload = encode_image_bytes(image_bytes, grid_size, image_format, quality, crop, max_image_tokens)
+    _image_payload_cache[key] = payload
+    if len(_image_payload_cache) > IMAGE_PAYLOAD_CACHE_SIZE:
+        _image_payload_cache.popitem(last=False)
+    return payload
+
+def image_budget_name(image_options: dict | None) -> str:
+    """Inverse of parse_image_budget, used to label results and telemetry."""
+    image_options = image_options or {}
+    crop = image_options.get("crop", "full")
+    max_image_tokens = image_options.get("max_image_tokens")
+    return f"{crop}:{max_image_tokens}" if max_image_tokens else crop
+
+def parse_image_budget(spec: str) -> dict:
+    """Parse an --image-budgets entry CROP[:MAX_IMAGE_TOKENS], e.g. full, play_area or play_area:150."""
+    crop, _, max_image_tokens = spec.partition(":")
+    if crop not in CROP_MODES:
+        raise ValueError(f"Crop mode {crop} is not supported, use one of {CROP_MODES}.")
+    return {"crop": crop, "max_image_tokens": int(max_image_tokens) if max_image_tokens else None}
+
+
+def create_image_executor(workers: int) -> Executor:
+    """Process pool that pads and encodes the images of a run.
+        With pool_image_executors the pool is reused by the next run of the same process instead of starting
+        and stopping its worker processes for every job.
+    """
+    from concurrent.futures import ProcessPoolExecutor
+
+    if _executor_pool is None:
+        return ProcessPoolExecutor(workers)
+    if workers not in _executor_pool:
+        _executor_pool[workers] = ProcessPoolExecutor(workers)
+    return _executor_pool[workers]
+
+
+def release_image_executor(executor: Executor | None):
+    """Shut down the pool of a finished run, unless it is pooled for the next run."""
+    if executor is not None and executor not in (_executor_pool or {}).values():
+        executor.shutdown()
+
+
+def pool_image_executors():
+    """Keep the image pools of finished runs for the next run of a long-lived process."""
+    global _executor_pool
+    if _executor_pool is None:
+        _executor_pool = {}
+
+
+def shutdown_pooled_executors():
+    global _executor_pool
+    for executor in (_executor_pool or {}).values():
+        executor.shutdown()
+    _executor_pool = None
+
+
+class _StdoutHandler(logging.StreamHandler):
+    """Writes to the current sys.stdout, which the warm worker redirects to the log file of each job."""
+
+    def emit(self, record: logging.LogRecord):
+        self.stream = sys.stdout
+        super().emit(record)
+
+
+def add_verbose_argument(parser: argparse.ArgumentParser):
+    parser.add_argument("--verbose", action="store_true",
+                        help="Print the response, ground truth and score of every test. Tests run concurrently, "
+                             "so these lines interleave with the progress lines.")
+
+
+def configure_test_log(verbose: bool):
+    """Show the per-test lines of test_log on stdout with --verbose, hide them otherwise."""
+    if not test_log.handlers:
+        test_log.addHandler(_StdoutHandler())
+        test_log.propagate = False
+    test_log.setLevel(logging.DEBUG if verbose else logging.WARNING)
+
+
+def add_image_arguments(parser: argparse.ArgumentParser):
+    parser.add_argument("--image-format", type=str.upper, choices=list(IMAGE_MIME_TYPES), default="PNG",
+                        help="Encoding of the image payload.")
+    parser.add_argument("--image-quality", type=int, default=None,
+                        help="Quality of lossy image formats (JPEG, WEBP).")
+    parser.add_argument("--image-workers", type=int, default=os.cpu_count(),
+                        help="Processes that pad and encode images in parallel, 0 encodes in the main process.")
+    parser.add_argument("--image-budgets", nargs="+", type=str, metavar="CROP[:TOKENS]", default=["full"],
+                        help=f"Image preprocessing settings to evaluate, crop one of {CROP_MODES} optionally followed "
+                             "by a visual token budget, e.g. full play_area play_area:150. Every setting is a "
+                             "separate pass over the tests.")
 
 def get_api_key() -> str:
     API_KEY = os.getenv("OPENROUTER_API_KEY")
@@ -43,4 +303,98 @@ def get_api_key() -> str:
             API_KEY = os.getenv("OPENROUTER_API_KEY")
         except FileNotFoundError:
             raise ValueError("Please set the OPENROUTER_API_KEY environment variable (e.g. in .env)")
-    return API_KEY
\ No newline at end of file
+    return API_KEY
+
+
+def input_root(input_path: str) -> Path:
+    """Dataset root of an --input argument: the directory itself, the fixed directories in front of a glob
+        pattern, or the directory of a single test.
+    """
+    path = Path(input_path)
+    if any(char in input_path for char in "*?["):
+        fixed = []
+        for part in path.parts:
+            if any(char in part for char in "*?["):
+                break
+            fixed.append(part)
+        return Path(*fixed) if fixed else Path(".")
+    return path if path.is_dir() else path.parent
+
+
+def relative_case_id(test_path: Path, root: Path) -> str:
+    """Case id of a test below a dataset root: its path relative to the parent of the root, e.g.
+        examples/object_recognition_single/OBJ_REC1 for the root benchmark1_grounding/examples. The same on every
+        machine, checkout location and spelling of the root (relative or absolute). Below the working directory
+        (e.g. --input "benchmark*/examples/**") the id is relative to the working directory itself.
+    """
+    root = Path(os.path.abspath(root))
+    base = root if root == Path.cwd() else root.parent
+    return Path(os.path.abspath(test_path)).relative_to(base).as_posix()
+
+
+def discover_tests(input_path: str, suffixes: tuple[str, ...] = (".png", ".json")) -> list[Path]:
+    """Resolve an --input argument to the test cases it names.
+        Args:
+            input_path (str): A single test (path without suffix or any of its files),
+                a directory that is searched recursively, or a glob pattern.
+            suffixes (tuple): Files that must exist next to each other for a test to count.
+        Returns:
+            list[Path]: Sorted test paths without suffix, e.g. examples/OBJ_REC1. Their case ids are relative to
+                the dataset root, see input_root and relative_case_id.
+    """
+    path = Path(input_path)
+    if any(char in input_path for char in "*?["):
+        candidates = [Path(p) for p in glob.glob(input_path, recursive=True)]
+    elif path.is_dir():
+        candidates = list(path.rglob("*"))
+    else:
+        candidates = [path]
+
+    tests = set()
+    for candidate in candidates:
+        if candidate.is_dir():
+            continue
+        stem = candidate.with_suffix("") if candidate.suffix else candidate
+        # skip padded images written by older versions of pad_image
+        if stem.suffix == ".g":
+            continue
+        if all(stem.with_suffix(suffix).exists() for suffix in suffixes):
+            tests.add(stem)
+    root = input_root(input_path)
+    for test in tests:
+        _case_ids[test] = relative_case_id(test, root)
+    return sorted(tests)
+
+
+def case_id(test_path: Path) -> str:
+    """Stable identifier of a test case, used as key in result files, for --shard and for the scene index.
+        Tests found by discover_tests are identified relative to their dataset root, other paths (e.g. the tests
+        of a dataset shard, whose paths are the stored ids) by the path itself.
+    """
+    test_id = _case_ids.get(test_path)
+    return test_id if test_id is not None else test_path.as_posix()
+
+
+def parse_shard_spec(shard_spec: str) -> tuple[int, int]:
+    """Parse --shard i/N, with 0 <= i < N."""
+    try:
+        index, count = (int(value) for value in shard_spec.split("/"))
+    except ValueError:
+        raise ValueError(f"Shard {shard_spec} is not of the form i/N, e.g. 0/4.")
+    if count < 1 or not 0 <= index < count:
+        raise ValueError(f"Shard {shard_spec} is out of range, use 0/N to {count - 1}/N.")
+    return index, count
+
+
+def shard_index(test_id: str, count: int) -> int:
+    """Stable shard of a case id, the same on every machine and Python version."""
+    digest = hashlib.sha256(test_id.encode("utf-8")).digest()
+    return int.from_bytes(digest[:8], "big") % count
+
+
+def select_shard(tests: list[Path], shard_spec: str | None) -> list[Path]:
+    """Disjoint, balanced slice of the tests for --shard i/N, all tests without a spec."""
+    if not shard_spec:
+        return tests
+    index, count = parse_shard_spec(shard_spec)
+    return [test for test in tests if shard_index(case_id(test), count) == index]